@@ -0,0 +1,442 @@
+"""
+Benchmarks for multimodal part conversions and serialization.
+
+All fixtures are generated synthetically, so no network access or test data is required. Benchmarks whose optional
+dependencies (e.g. ffmpeg, torch) are not installed are skipped.
+
+Usage::
+
+    # run all benchmarks and print a summary
+    python benchmarks/bench.py
+
+    # only run some benchmarks, and save machine-readable results
+    python benchmarks/bench.py -k image -k audio --output results.json
+
+    # compare against a previous run, exiting with an error if anything regressed by more than 10%
+    python benchmarks/bench.py --output new.json --compare results.json --threshold 0.1
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import datetime
+import fnmatch
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+
+from kani.ext.multimodal_core import AudioPart, BinaryFilePart, ImagePart, VideoPart, encode_parts  # noqa: E402
+
+SIZES = ("small", "medium", "large")
+
+
+class SkipBenchmark(Exception):
+    """Raised by a benchmark's setup if it cannot run in this environment."""
+
+
+@dataclasses.dataclass
+class Benchmark:
+    name: str
+    setup: Callable[[str], tuple[Callable[[], object], int]]
+    """Given a size, return the function to time and the number of bytes of media it processes per call."""
+    sizes: tuple[str, ...] = SIZES
+
+
+BENCHMARKS: list[Benchmark] = []
+_tmpdir = tempfile.TemporaryDirectory(prefix="kani-multimodal-bench-")
+TMP = Path(_tmpdir.name)
+
+
+def benchmark(name: str, sizes: tuple[str, ...] = SIZES):
+    """Register a benchmark setup function."""
+
+    def decorator(f):
+        BENCHMARKS.append(Benchmark(name=name, setup=f, sizes=sizes))
+        return f
+
+    return decorator
+
+
+def run_async(coro_fn):
+    """Wrap a coroutine function so it can be timed synchronously."""
+    return lambda: asyncio.run(coro_fn())
+
+
+# ==== fixtures ====
+IMAGE_SIZES = {"small": (256, 256), "medium": (1024, 768), "large": (3840, 2160)}
+AUDIO_SECONDS = {"small": 5, "medium": 60, "large": 600}
+FILE_BYTES = {"small": 100_000, "medium": 2_000_000, "large": 20_000_000}
+VIDEO_SPECS = {"small": ("320x240", 5), "medium": ("640x360", 10), "large": ("1280x720", 20)}
+
+
+def make_image(size: str) -> ImagePart:
+    """A gradient with some noise: compresses somewhat, like a photo."""
+    from PIL import Image
+
+    w, h = IMAGE_SIZES[size]
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, w, dtype=np.float32)[np.newaxis, :, np.newaxis]
+    y = np.linspace(0, 255, h, dtype=np.float32)[:, np.newaxis, np.newaxis]
+    pixels = (x * 0.5 + y * 0.5 + rng.normal(0, 12, (h, w, 3))).clip(0, 255).astype(np.uint8)
+    return ImagePart(image=Image.fromarray(pixels))
+
+
+def make_audio(size: str, sr: int = 24000) -> AudioPart:
+    """A sine sweep with some noise."""
+    n = AUDIO_SECONDS[size] * sr
+    t = np.arange(n, dtype=np.float32) / sr
+    rng = np.random.default_rng(0)
+    signal = 0.5 * np.sin(2 * np.pi * (220 + 20 * t) * t) + rng.normal(0, 0.02, n)
+    return AudioPart(raw=(signal * 32767).clip(-32768, 32767).astype("<i2").tobytes(), sample_rate=sr)
+
+
+def make_file(size: str) -> BinaryFilePart:
+    """Half random, half repetitive data."""
+    n = FILE_BYTES[size]
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, 256, n // 2, dtype=np.uint8).tobytes() + b"kani multimodal " * (n // 32)
+    return BinaryFilePart.from_bytes(data, mime="application/octet-stream")
+
+
+def make_video(size: str) -> Path:
+    """Generate a test video with ffmpeg."""
+    if shutil.which("ffmpeg") is None:
+        raise SkipBenchmark("ffmpeg is not installed")
+    resolution, duration = VIDEO_SPECS[size]
+    path = TMP / f"video-{size}.mp4"
+    if not path.exists():
+        subprocess.run(
+            [
+                "ffmpeg",
+                "-v",
+                "error",
+                "-y",
+                "-f",
+                "lavfi",
+                "-i",
+                f"testsrc=size={resolution}:rate=30:duration={duration}",
+                "-f",
+                "lavfi",
+                "-i",
+                f"sine=frequency=440:duration={duration}",
+                "-c:v",
+                "libx264",
+                "-pix_fmt",
+                "yuv420p",
+                "-c:a",
+                "aac",
+                str(path),
+            ],
+            check=True,
+        )
+    return path
+
+
+# ==== benchmarks ====
+# --- image ---
+@benchmark("image.as_b64_uri[png]")
+def bench_image_b64_png(size):
+    part = make_image(size)
+    return lambda: part.as_b64_uri("png"), part.image.width * part.image.height * 3
+
+
+@benchmark("image.as_b64_uri[jpeg]")
+def bench_image_b64_jpeg(size):
+    part = make_image(size)
+    return lambda: part.as_b64_uri("jpeg"), part.image.width * part.image.height * 3
+
+
+@benchmark("image.to_array[224]")
+def bench_image_to_array(size):
+    part = make_image(size)
+    mean, std = (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)
+    return lambda: part.to_array((224, 224), mean=mean, std=std), part.image.width * part.image.height * 3
+
+
+def json_roundtrip(part):
+    # drop the memoized payload so that we measure the serializer, not the cache
+    part._json_payload = None
+    return type(part).model_validate_json(part.model_dump_json())
+
+
+@benchmark("image.json_roundtrip")
+def bench_image_json(size):
+    part = make_image(size)
+    return lambda: json_roundtrip(part), part.image.width * part.image.height * 3
+
+
+@benchmark("image.encode_parts[x16]", sizes=("small", "medium"))
+def bench_encode_parts(size):
+    parts = [make_image(size) for _ in range(16)]
+    return lambda: encode_parts(parts), sum(p.image.width * p.image.height * 3 for p in parts)
+
+
+# --- audio ---
+@benchmark("audio.as_bytes[resample 24k->16k]")
+def bench_audio_resample(size):
+    part = make_audio(size)
+    return lambda: part.as_bytes(sr=16000), len(part.raw)
+
+
+@benchmark("audio.as_wav_b64_uri")
+def bench_audio_wav(size):
+    part = make_audio(size)
+    return part.as_wav_b64_uri, len(part.raw)
+
+
+@benchmark("audio.json_roundtrip")
+def bench_audio_json(size):
+    if shutil.which("ffmpeg") is None:
+        raise SkipBenchmark("ffmpeg is not installed")
+    part = make_audio(size)
+    return lambda: json_roundtrip(part), len(part.raw)
+
+
+def encode_audio(part, format):
+    # drop the cached encodings so that we measure the encoder, not the cache
+    part._encoded = None
+    return part.as_encoded(format)
+
+
+@benchmark("audio.as_encoded[flac]")
+def bench_audio_flac(size):
+    part = make_audio(size)
+    return lambda: encode_audio(part, "flac"), len(part.raw)
+
+
+@benchmark("audio.as_encoded[opus]", sizes=("small", "medium"))
+def bench_audio_opus(size):
+    if shutil.which("ffmpeg") is None:
+        raise SkipBenchmark("ffmpeg is not installed")
+    part = make_audio(size)
+    return lambda: encode_audio(part, "opus"), len(part.raw)
+
+
+# --- binary file ---
+@benchmark("binary.json_roundtrip")
+def bench_binary_json(size):
+    part = make_file(size)
+    return lambda: json_roundtrip(part), part.filesize
+
+
+@benchmark("binary.json_dump[memoized]")
+def bench_binary_json_memoized(size):
+    part = make_file(size)
+    part.model_dump_json()
+    return part.model_dump_json, part.filesize
+
+
+@benchmark("binary.as_b64_uri")
+def bench_binary_b64(size):
+    part = make_file(size)
+    return part.as_b64_uri, part.filesize
+
+
+# --- video ---
+@benchmark("video.metadata")
+def bench_video_metadata(size):
+    path = make_video(size)
+
+    def f():
+        part = VideoPart.from_file(path)
+        return part.duration
+
+    return f, path.stat().st_size
+
+
+@benchmark("video.as_tensor[1fps]")
+def bench_video_as_tensor(size):
+    try:
+        import torchcodec  # noqa: F401
+    except (ImportError, RuntimeError):
+        raise SkipBenchmark("torchcodec is not installed")
+    path = make_video(size)
+    part = VideoPart.from_file(path)
+    return part.as_tensor, path.stat().st_size
+
+
+# --- cli ---
+@benchmark("cli.parts_from_cli_query", sizes=("small",))
+def bench_cli_query(size):
+    from kani.ext.multimodal_core.cli import parts_from_cli_query
+
+    image_path = TMP / "query-image.png"
+    image = make_image("small")
+    image.image.save(image_path)
+    media = [image_path]
+    # loading audio from a file requires ffmpeg (via pydub)
+    if shutil.which("ffmpeg") is not None:
+        wav_path = TMP / "query-audio.wav"
+        with wave.open(str(wav_path), "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(24000)
+            f.writeframes(make_audio("small").raw)
+        media.append(wav_path)
+    query = " ".join(f"Please describe @{path} in detail." for path in media) * 4
+    return run_async(lambda: parts_from_cli_query(query)), sum(path.stat().st_size for path in media) * 4
+
+
+# inputs that make a backtracking regex take exponential or quadratic time, and pasted logs with lots of @s and URLs
+MEDIA_QUERY_LENGTHS = {"small": 10_000, "medium": 100_000, "large": 1_000_000}
+ADVERSARIAL_QUERIES = {
+    "url+punctuation": lambda n: "@http://" + "a" * (n // 2) + "!" * (n // 2),
+    "nested slashes": lambda n: "@" + "a/" * (n // 2),
+    "unbalanced parens": lambda n: "@http://a" + "(a" * (n // 2),
+    "unclosed quotes": lambda n: '@"a ' * (n // 4),
+    "pasted log": lambda n: (
+        "INFO GET http://example.com/api/v1?q=(x) by user@example.com -- see @docs/README.md\n" * (n // 80)
+    ),
+}
+
+
+@benchmark("cli.find_media_references[adversarial]")
+def bench_find_media_references(size):
+    from kani.ext.multimodal_core.cli import find_media_references
+
+    n = MEDIA_QUERY_LENGTHS[size]
+    queries = [make_query(n) for make_query in ADVERSARIAL_QUERIES.values()]
+    return lambda: [list(find_media_references(query)) for query in queries], sum(len(q) for q in queries)
+
+
+# ==== runner ====
+def percentile(values: list[float], q: float) -> float:
+    return float(np.percentile(values, q))
+
+
+def measure(fn: Callable[[], object], nbytes: int, *, repeat: int, min_time: float) -> dict:
+    """Time the function and measure its peak memory usage."""
+    # warmup
+    fn()
+
+    # timing: at least *repeat* runs, and at least *min_time* seconds
+    times = []
+    start = time.perf_counter()
+    while len(times) < repeat or time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+        if len(times) >= repeat * 100:
+            break
+
+    # memory: tracemalloc slows things down, so measure it in a separate run
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    mean = statistics.fmean(times)
+    return {
+        "runs": len(times),
+        "bytes": nbytes,
+        "mean": mean,
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "min": min(times),
+        "max": max(times),
+        "p50": percentile(times, 50),
+        "p90": percentile(times, 90),
+        "p99": percentile(times, 99),
+        "throughput_mbps": nbytes / mean / 1e6 if mean else None,
+        "peak_memory_bytes": peak,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def run(patterns: list[str], sizes: list[str], repeat: int, min_time: float) -> dict:
+    results = {}
+    for bench in BENCHMARKS:
+        for size in bench.sizes:
+            if size not in sizes:
+                continue
+            key = f"{bench.name}/{size}"
+            if patterns and not any(fnmatch.fnmatch(key, f"*{p}*") for p in patterns):
+                continue
+            try:
+                fn, nbytes = bench.setup(size)
+            except SkipBenchmark as e:
+                print(f"{key:<50} skipped ({e})")
+                continue
+            result = measure(fn, nbytes, repeat=repeat, min_time=min_time)
+            results[key] = result
+            print(
+                f"{key:<50} p50 {result['p50'] * 1000:>10.2f} ms   p99 {result['p99'] * 1000:>10.2f} ms   "
+                f"{result['throughput_mbps']:>9.1f} MB/s   peak {result['peak_memory_bytes'] / 1e6:>8.1f} MB"
+            )
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Print a comparison against a baseline run and return the keys of regressed benchmarks."""
+    regressions = []
+    print(f"\nComparison against {baseline['meta'].get('commit') or 'baseline'} (threshold {threshold:.0%}):")
+    for key, result in results.items():
+        if (base := baseline["results"].get(key)) is None:
+            print(f"{key:<50} (new)")
+            continue
+        time_ratio = result["p50"] / base["p50"] if base["p50"] else 1
+        mem_ratio = result["peak_memory_bytes"] / base["peak_memory_bytes"] if base["peak_memory_bytes"] else 1
+        regressed = time_ratio > 1 + threshold or mem_ratio > 1 + threshold
+        flag = "REGRESSION" if regressed else ("faster" if time_ratio < 1 - threshold else "")
+        print(f"{key:<50} time {time_ratio:>6.2f}x   memory {mem_ratio:>6.2f}x   {flag}")
+        if regressed:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="patterns", action="append", default=[], help="Only run benchmarks matching this.")
+    parser.add_argument("--sizes", default=",".join(SIZES), help="Comma-separated fixture sizes to run.")
+    parser.add_argument("--repeat", type=int, default=5, help="The minimum number of timed runs per benchmark.")
+    parser.add_argument("--min-time", type=float, default=0.5, help="The minimum total time per benchmark, in seconds.")
+    parser.add_argument("--output", type=Path, help="Save the results as JSON to this path.")
+    parser.add_argument("--compare", type=Path, help="Compare the results against a previous JSON results file.")
+    parser.add_argument("--threshold", type=float, default=0.1, help="The relative slowdown to flag as a regression.")
+    args = parser.parse_args()
+
+    results = run(args.patterns, args.sizes.split(","), args.repeat, args.min_time)
+    data = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(data, indent=2))
+        print(f"\nSaved results to {args.output}")
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
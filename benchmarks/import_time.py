@@ -0,0 +1,70 @@
+"""
+Measure the import time of kani.ext.multimodal_core and check it against a budget.
+
+kani imports this package (and its CLI helpers) when it is imported itself, so every process using kani pays this cost
+on startup. Each measurement runs in a fresh interpreter with ``-X importtime``, and counts the cumulative time spent
+importing this package's modules (including any third-party modules they import).
+
+Usage::
+
+    python benchmarks/import_time.py --budget 50
+"""
+
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+
+PACKAGE = "kani.ext.multimodal_core"
+IMPORTTIME_RE = re.compile(r"import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)")
+HEAVY_MODULES = ("numpy", "PIL", "pydub", "aiohttp")
+
+
+def measure_once(statement: str) -> tuple[float, list[str]]:
+    """Return the time spent importing this package in the given statement, in ms, and the heavy modules imported."""
+    code = f"{statement}\nimport sys\nprint(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True
+    )
+    total_us = 0
+    # importtime prints modules after the modules they import; reversed, each module comes before its children
+    ancestors = []  # (depth, is one of our modules) of the current module's ancestors
+    for line in reversed(result.stderr.splitlines()):
+        if not (match := IMPORTTIME_RE.match(line)):
+            continue
+        cumulative, depth, module = int(match[2]), len(match[3]), match[4]
+        while ancestors and ancestors[-1][0] >= depth:
+            ancestors.pop()
+        is_ours = module == PACKAGE or module.startswith(f"{PACKAGE}.")
+        # only count the outermost imports of our modules, since cumulative times include children
+        if is_ours and not any(ours for _, ours in ancestors):
+            total_us += cumulative
+        ancestors.append((depth, is_ours))
+    return total_us / 1000, result.stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=50, help="The maximum median import time, in milliseconds.")
+    parser.add_argument("--runs", type=int, default=10, help="The number of fresh interpreters to measure.")
+    parser.add_argument(
+        "--statement", default="import kani", help="The import statement to measure (default: import kani)."
+    )
+    args = parser.parse_args()
+
+    times = []
+    heavy = []
+    for _ in range(args.runs):
+        elapsed, heavy = measure_once(args.statement)
+        times.append(elapsed)
+    median = statistics.median(times)
+    print(f"{PACKAGE} import time: median {median:.1f}ms, min {min(times):.1f}ms, max {max(times):.1f}ms")
+    print(f"heavy modules imported: {', '.join(heavy) or 'none'}")
+    if median > args.budget:
+        print(f"Import time is over budget ({args.budget:.1f}ms)!")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
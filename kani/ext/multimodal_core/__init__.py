@@ -1,6 +1,133 @@
+import importlib
+import sys
+from typing import TYPE_CHECKING
+
+from kani.models import MessagePart
+
 from ._version import __version__
-from .audio import AudioPart
 from .base import BaseMultimodalPart, BinaryFilePart, TextPart
 from .exceptions import *
-from .image import ImagePart
-from .video import VideoPart
+
+# the other public names are loaded lazily, so that importing this package (which kani does on import if it is
+# installed) does not import NumPy, Pillow, pydub, etc. until they are needed
+_LAZY_ATTRS = {
+    "AudioFileResult": ".audio",
+    "AudioPart": ".audio",
+    "set_audio_serialization_format": ".audio",
+    "aencode_parts": ".concurrency",
+    "encode_parts": ".concurrency",
+    "MediaIndex": ".dedup",
+    "MediaMatch": ".dedup",
+    "get_executor": ".executor",
+    "set_executor": ".executor",
+    "set_ffmpeg_concurrency": ".ffmpeg",
+    "ImagePart": ".image",
+    "LoggingCollector": ".instrumentation",
+    "MediaCollector": ".instrumentation",
+    "MediaEvent": ".instrumentation",
+    "OpenTelemetryCollector": ".instrumentation",
+    "get_collector": ".instrumentation",
+    "set_collector": ".instrumentation",
+    "LazyFile": ".lazyfile",
+    "set_max_open_files": ".lazyfile",
+    "MemoryUsage": ".memory",
+    "get_memory_usage": ".memory",
+    "set_memory_budget": ".memory",
+    "VideoMetadata": ".metadata",
+    "MessageLog": ".persistence",
+    "set_metadata_cache_dir": ".metadata",
+    "SharedPart": ".shm",
+    "export_shared": ".shm",
+    "VideoPart": ".video",
+}
+
+__all__ = [
+    "__version__",
+    "BaseMultimodalPart",
+    "BinaryFilePart",
+    "TextPart",
+    "MediaFormatException",
+    "FileChangedException",
+    *_LAZY_ATTRS,
+]
+
+# modules that define MessageParts, which must be imported before loading saved messages containing them
+_PART_MODULES = {f"{__name__}.audio", f"{__name__}.image", f"{__name__}.video"}
+
+if TYPE_CHECKING:
+    from .audio import AudioFileResult, AudioPart, set_audio_serialization_format
+    from .concurrency import aencode_parts, encode_parts
+    from .dedup import MediaIndex, MediaMatch
+    from .executor import get_executor, set_executor
+    from .ffmpeg import set_ffmpeg_concurrency
+    from .image import ImagePart
+    from .instrumentation import (
+        LoggingCollector,
+        MediaCollector,
+        MediaEvent,
+        OpenTelemetryCollector,
+        get_collector,
+        set_collector,
+    )
+    from .lazyfile import LazyFile, set_max_open_files
+    from .memory import MemoryUsage, get_memory_usage, set_memory_budget
+    from .metadata import VideoMetadata, set_metadata_cache_dir
+    from .persistence import MessageLog
+    from .shm import SharedPart, export_shared
+    from .video import VideoPart
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_ATTRS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
+
+
+# ==== lazy part registration ====
+# kani finds the class of each saved MessagePart by looking up its fully qualified name in the private
+# MessagePart._messagepart_registry dict (as of kani 1.10, see tests/test_imports.py), which subclasses are added to
+# when they are defined. To load saved audio, image, and video parts without importing their modules up front, we swap
+# in a dict that imports them on a lookup miss. If kani stops keeping its registry there, we import them eagerly
+# instead, which is slower to start up but always loads saved messages correctly.
+class _LazyPartRegistry(dict):
+    """A MessagePart registry that imports this package's part modules on demand when loading saved messages."""
+
+    def _import_part_module(self, fqn) -> bool:
+        """Import the part module that would define the given type, if it isn't imported yet. Returns whether it was."""
+        module, _, _ = fqn.rpartition(".")
+        if module not in _PART_MODULES or module in sys.modules:
+            return False
+        importlib.import_module(module)
+        return True
+
+    def __missing__(self, fqn):
+        if self._import_part_module(fqn) and dict.__contains__(self, fqn):
+            return self[fqn]
+        raise KeyError(fqn)
+
+    def __contains__(self, fqn):
+        return dict.__contains__(self, fqn) or (self._import_part_module(fqn) and dict.__contains__(self, fqn))
+
+    def get(self, fqn, default=None):
+        return self[fqn] if fqn in self else default
+
+
+def _install_lazy_registry():
+    """Make sure kani can load saved parts of this package's types, importing their modules on demand if we can."""
+    registry = vars(MessagePart).get("_messagepart_registry")
+    if isinstance(registry, _LazyPartRegistry):
+        return
+    if type(registry) is dict:
+        MessagePart._messagepart_registry = _LazyPartRegistry(registry)
+        return
+    for module in sorted(_PART_MODULES):
+        importlib.import_module(module)
+
+
+_install_lazy_registry()
@@ -1,21 +1,57 @@
 """Core MessageParts for Kani multimodal"""
 
 import base64
+import collections
+import functools
+import hashlib
 import io
+import itertools
+import os
+import re
+import struct
+import subprocess
 import wave
-from typing import IO, TYPE_CHECKING
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import IO, TYPE_CHECKING, Iterable, Iterator
 
-import numpy as np
 from kani.utils.typing import PathLike
 from pydantic import Field, model_serializer, model_validator
-from pydub import AudioSegment
 
+from . import memory
 from .base import BaseMultimodalPart
-from .utils import download_media
+from .exceptions import MediaFormatException
+from .executor import run_in_executor
+from .ffmpeg import check_returncode, pipe_ffmpeg
+from .instrumentation import span
+from .utils import download_media, read_data_uri, spool_chunks
 
 if TYPE_CHECKING:
+    import numpy as np
     import torch
 
+AudioFileResult = namedtuple("AudioFileResult", "fp part error")
+"""
+The result of decoding one file with :meth:`AudioPart.from_files`: the path of the file, and either the decoded
+AudioPart (with ``error`` set to None) or the exception raised while decoding it (with ``part`` set to None).
+"""
+
+# format -> the MIME type, ffmpeg container format, ffmpeg encoder, and default bitrate of audio encoded in that format
+_AudioCodec = namedtuple("_AudioCodec", "mime container encoder default_bitrate")
+_CODECS = {
+    "wav": _AudioCodec("audio/wav", "wav", "pcm_s16le", None),
+    "flac": _AudioCodec("audio/flac", "flac", "flac", None),
+    "opus": _AudioCodec("audio/ogg", "ogg", "libopus", "32k"),
+    "mp3": _AudioCodec("audio/mpeg", "mp3", "libmp3lame", "64k"),
+}
+
+_BITRATE_RE = re.compile(r"(\d+(?:\.\d*)?|\.\d+)([kKMG]?)")
+_BITRATE_SUFFIXES = {"": 1, "k": 1000, "K": 1000, "M": 1000000, "G": 1000000000}
+
+# the format that audio data is stored in when serializing parts to JSON (see set_audio_serialization_format)
+_serialization_format = "wav"
+_serialization_bitrate = None
+
 
 class AudioPart(BaseMultimodalPart):
     """
@@ -30,11 +66,19 @@ class AudioPart(BaseMultimodalPart):
     """
 
     raw: bytes = Field(repr=False)
-    """The raw binary data in signed 16-bit little-endian mono PCM format."""
+    """
+    The raw binary data in signed 16-bit little-endian mono PCM format.
+
+    On parts attached from shared memory (see :meth:`.SharedPart.attach`), this is a read-only :class:`memoryview` of
+    the shared data instead of a copy. Use :meth:`as_bytes` to always get :class:`bytes`.
+    """
 
     sample_rate: int
     """The sample rate of the binary data."""
 
+    # (format, bitrate) -> the audio data encoded in that format, cached by as_encoded (and counted towards the budget)
+    _encoded: dict | None = None
+
     # ==== constructors ====
     @classmethod
     def from_b64(cls, data: str, sr: int, **kwargs):
@@ -68,24 +112,141 @@ class AudioPart(BaseMultimodalPart):
         :param sample_width: The sample width, in bytes, of the audio (raw PCM audio only).
         :param channels: The number of channels of the audio (raw PCM audio only).
         """
-        segment = AudioSegment.from_file(
-            fp,
-            format=format,
-            codec=codec,
-            parameters=converter_parameters,
-            frame_rate=sr,
-            sample_width=sample_width,
-            channels=channels,
-        )
-        mono = segment.set_channels(1).set_sample_width(2)
+        from pydub import AudioSegment
+
+        with span("from_file", cls.__name__) as s:
+            segment = AudioSegment.from_file(
+                fp,
+                format=format,
+                codec=codec,
+                parameters=converter_parameters,
+                frame_rate=sr,
+                sample_width=sample_width,
+                channels=channels,
+            )
+            mono = segment.set_channels(1).set_sample_width(2)
+            s.bytes_out = len(mono.raw_data)
         return cls(raw=mono.raw_data, sample_rate=mono.frame_rate, **kwargs)
 
     @classmethod
-    def from_wav_b64_uri(cls, data: str):
-        if not data.startswith("data:audio/wav;base64,"):
+    async def afrom_file(cls, fp: PathLike | IO, **kwargs):
+        """
+        Asynchronous version of :meth:`from_file`, run on the configured executor (see :func:`.set_executor`).
+
+        Keyword arguments are passed to :meth:`from_file`. Open files can only be passed if the executor is a thread
+        pool.
+        """
+        return await run_in_executor(cls.from_file, fp, **kwargs)
+
+    @classmethod
+    def from_files(
+        cls,
+        fps: Iterable[PathLike],
+        *,
+        target_sr: int = None,
+        ordered: bool = True,
+        max_workers: int = None,
+    ) -> Iterator[AudioFileResult]:
+        """
+        Decode many local audio files concurrently on a pool of worker processes, yielding the results as they are
+        decoded.
+
+        Each file is decoded (and resampled, if *target_sr* is set) by a single ``ffmpeg`` process, so this requires
+        ``ffmpeg`` to be installed. A file that fails to decode does not stop the batch; instead, its result has the
+        exception in :attr:`AudioFileResult.error`. Only a few files per worker are decoded ahead of the consumer, so
+        large batches can be streamed without holding every decoded file in memory.
+
+        .. code-block:: python
+
+            for result in AudioPart.from_files(paths, target_sr=16000):
+                if result.error is not None:
+                    print(f"Could not decode {result.fp}: {result.error}")
+                    continue
+                process(result.part)
+
+        :param fps: The paths of the files to decode. The format of each file is detected automatically.
+        :param target_sr: The sample rate to resample the audio to while decoding. If not set, keeps each file's
+            original sample rate.
+        :param ordered: If True (default), yield results in the same order as *fps*. Otherwise, yield results as soon
+            as they are decoded.
+        :param max_workers: The maximum number of worker processes to use (default: the number of CPUs).
+        :returns: An iterator of :class:`AudioFileResult`.
+        """
+        max_workers = max_workers or os.cpu_count() or 1
+        fps = iter(fps)
+        pending = collections.deque()  # (fp, future), in submission order
+        pool = ProcessPoolExecutor(max_workers=max_workers)
+        try:
+
+            def submit(n: int):
+                for fp in itertools.islice(fps, n):
+                    pending.append((fp, pool.submit(_decode_audio_file, fp, target_sr)))
+
+            # keep a couple of files queued per worker so that the workers never wait on the consumer
+            submit(max_workers * 2)
+            while pending:
+                if ordered:
+                    fp, future = pending.popleft()
+                    wait([future])
+                else:
+                    done, _ = wait([future for _, future in pending], return_when=FIRST_COMPLETED)
+                    idx = next(idx for idx, (_, future) in enumerate(pending) if future in done)
+                    fp, future = pending[idx]
+                    del pending[idx]
+                submit(1)
+
+                if (error := future.exception()) is not None:
+                    yield AudioFileResult(fp=fp, part=None, error=error)
+                else:
+                    raw, sr = future.result()
+                    yield AudioFileResult(fp=fp, part=cls(raw=raw, sample_rate=sr), error=None)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    @classmethod
+    def from_encoded(cls, data: bytes, format: str, *, sr: int = None, **kwargs):
+        """
+        Create an AudioPart from audio data in one of the formats supported by :meth:`as_encoded`.
+
+        Unlike :meth:`from_file`, the data is decoded by piping it through a single ``ffmpeg`` process (or in-process,
+        for FLAC data if :mod:`soundfile` is installed) instead of copying it to a temporary file first.
+
+        :param data: The encoded audio data.
+        :param format: The format of the data (``"flac"``, ``"opus"``, ``"mp3"``, or ``"wav"``).
+        :param sr: The sample rate to resample the audio to while decoding. If not set, keeps the sample rate of the
+            encoded audio (note that Opus audio is always decoded at 48 kHz).
+        """
+        _get_codec(format)
+        with span("from_encoded", cls.__name__, bytes_in=len(data)) as s:
+            raw, sample_rate = _decode_audio(data, format, sr)
+            s.bytes_out = len(raw)
+        return cls(raw=raw, sample_rate=sample_rate, **kwargs)
+
+    @classmethod
+    def from_wav_b64_uri(cls, data: str | bytes | IO, **kwargs):
+        """
+        Create an AudioPart from a base64 data URI of WAV data (``data:audio/wav;base64,...``).
+
+        The URI can be passed as a string, bytes, or a text or binary file-like object to read it from. Its data is
+        decoded in chunks, and mono 16-bit WAV data (e.g. from :meth:`as_wav_b64_uri`) is read without converting it.
+        """
+        try:
+            uri = read_data_uri(data)
+        except ValueError:
+            uri = None
+        if uri is None or uri.mime != "audio/wav":
             raise ValueError("Data URI must begin with `data:audio/wav;base64,`")
-        wav_bytes = base64.b64decode(data.removeprefix("data:audio/wav;base64,"))
-        return cls.from_file(io.BytesIO(wav_bytes), format="wav")
+        f = spool_chunks(uri.chunks, max_size=None)
+        try:
+            with wave.open(f, "rb") as wave_data:
+                if wave_data.getnchannels() == 1 and wave_data.getsampwidth() == 2:
+                    raw = wave_data.readframes(wave_data.getnframes())
+                    return cls(raw=raw, sample_rate=wave_data.getframerate(), **kwargs)
+        except (wave.Error, EOFError):
+            # let ffmpeg deal with any other kind of WAV data
+            pass
+        f.seek(0)
+        return cls.from_file(f, format="wav", **kwargs)
 
     @classmethod
     async def from_url(cls, url: str, **kwargs):
@@ -105,17 +266,23 @@ class AudioPart(BaseMultimodalPart):
     # --- raw ---
     def as_bytes(self, sr: int) -> bytes:
         """Return the audio data as signed 16-bit little-endian mono PCM at the given sample rate."""
+        memory.touch(self)
         if sr == self.sample_rate:
-            return self.raw
+            return bytes(self.raw) if isinstance(self.raw, memoryview) else self.raw
         # sample to the specified sr and return
-        segment = AudioSegment(self.raw, sample_width=2, frame_rate=self.sample_rate, channels=1)
-        return segment.set_frame_rate(sr).raw_data
+        from pydub import AudioSegment
+
+        with span("resample", type(self).__name__, bytes_in=len(self.raw)) as s:
+            segment = AudioSegment(self.raw, sample_width=2, frame_rate=self.sample_rate, channels=1)
+            data = segment.set_frame_rate(sr).raw_data
+            s.bytes_out = len(data)
+        return data
 
     def as_b64(self, sr: int) -> str:
         """Return the audio data as Base64-encoded signed 16-bit little-endian mono PCM at the given sample rate."""
         return base64.b64encode(self.as_bytes(sr)).decode()
 
-    def as_ndarray(self, sr: int) -> np.ndarray:
+    def as_ndarray(self, sr: int) -> "np.ndarray":
         """Return the audio data as a 1-dimensional NumPy array of floats at the given sample rate."""
         # equivalence verify
         # $ ffmpeg -i test.mp3 -ac 1 -ar 24000 test.wav
@@ -129,6 +296,8 @@ class AudioPart(BaseMultimodalPart):
         # audio_ints = np.frombuffer(audio_bytes, dtype=np.int16)
         # audio_wav2 = audio_ints / 32768
         # (audio_wav == audio_wav2).all()
+        import numpy as np
+
         audio_ints = np.frombuffer(self.as_bytes(sr), dtype=np.int16)
         return audio_ints / 32768
 
@@ -162,6 +331,7 @@ class AudioPart(BaseMultimodalPart):
     # --- WAV ---
     def as_wav_bytes(self) -> bytes:
         """Return the audio data as WAV data (including header)."""
+        memory.touch(self)
         out_bytes = io.BytesIO()
         with wave.open(out_bytes, "wb") as wave_data:
             wave_data.setnchannels(1)
@@ -175,10 +345,107 @@ class AudioPart(BaseMultimodalPart):
 
     def as_wav_b64_uri(self) -> str:
         """Return the WAV audio data encoded in a web-suitable base64 string."""
-        wav_b64 = base64.b64encode(self.as_wav_bytes()).decode()
+        with span("as_wav_b64_uri", type(self).__name__, bytes_in=len(self.raw)) as s:
+            wav_b64 = base64.b64encode(self.as_wav_bytes()).decode()
+            s.bytes_out = len(wav_b64)
         return f"data:audio/wav;base64,{wav_b64}"
 
+    # --- compressed ---
+    def as_encoded(self, format: str = "flac", bitrate: int | str = None) -> bytes:
+        """
+        Return the audio data encoded in a compressed format, which is much smaller to upload or store than WAV data.
+
+        - ``"flac"``: Lossless FLAC audio, usually about half the size of WAV data.
+        - ``"opus"``: Lossy Opus audio in an Ogg container (32 kbps by default), well suited to speech.
+        - ``"mp3"``: Lossy MP3 audio (64 kbps by default), for providers that don't accept Opus.
+        - ``"wav"``: Uncompressed WAV data (the same as :meth:`as_wav_bytes`).
+
+        FLAC audio is encoded in-process if :mod:`soundfile` is installed. Otherwise, and for lossy formats, the audio
+        is piped through an ``ffmpeg`` process, which must be installed with the format's encoder (``libopus`` or
+        ``libmp3lame`` for lossy formats).
+
+        The encoded data is cached on the part for each format and bitrate, so sending the same audio repeatedly only
+        encodes it once. The cache is cleared if :attr:`raw` or :attr:`sample_rate` are reassigned, and counts towards
+        the memory budget (see :func:`.set_memory_budget`), which drops it when the part is spilled to disk.
+
+        :param format: The format to encode the audio in.
+        :param bitrate: The bitrate of lossy formats, in bits per second or as a string with a ``k``, ``M``, or ``G``
+            suffix (e.g. ``"24k"``). Ignored for lossless formats.
+        """
+        codec = _get_codec(format)
+        if format == "wav":
+            return self.as_wav_bytes()
+        bitrate = _normalize_bitrate(codec, bitrate)
+        memory.touch(self)
+        with span("encode", type(self).__name__) as s:
+            if self._encoded is not None and (data := self._encoded.get((format, bitrate))) is not None:
+                s.cache_hit = True
+            else:
+                s.bytes_in = len(self.raw)
+                data = _encode_audio(self.raw, self.sample_rate, format, bitrate)
+                if self._encoded is None:
+                    self._encoded = {}
+                self._encoded[(format, bitrate)] = data
+                self._update_memoized_size()
+            s.bytes_out = len(data)
+        return data
+
+    def as_encoded_b64_uri(self, format: str = "flac", bitrate: int | str = None) -> str:
+        """Return the audio data encoded in a compressed format (see :meth:`as_encoded`) as a base64 data URI."""
+        encoded_b64 = base64.b64encode(self.as_encoded(format, bitrate)).decode()
+        return f"data:{_CODECS[format].mime};base64,{encoded_b64}"
+
+    # --- async ---
+    async def aas_bytes(self, sr: int) -> bytes:
+        """Asynchronous version of :meth:`as_bytes`, run on the configured executor (see :func:`.set_executor`)."""
+        return await run_in_executor(self.as_bytes, sr)
+
+    async def aas_b64(self, sr: int) -> str:
+        """Asynchronous version of :meth:`as_b64`, run on the configured executor (see :func:`.set_executor`)."""
+        return await run_in_executor(self.as_b64, sr)
+
+    async def aas_ndarray(self, sr: int) -> "np.ndarray":
+        """Asynchronous version of :meth:`as_ndarray`, run on the configured executor (see :func:`.set_executor`)."""
+        return await run_in_executor(self.as_ndarray, sr)
+
+    async def aas_tensor(self, sr: int) -> "torch.Tensor":
+        """Asynchronous version of :meth:`as_tensor`, run on the configured executor (see :func:`.set_executor`)."""
+        return await run_in_executor(self.as_tensor, sr)
+
+    async def aas_wav_bytes(self) -> bytes:
+        """Asynchronous version of :meth:`as_wav_bytes`, run on the configured executor (see :func:`.set_executor`)."""
+        return await run_in_executor(self.as_wav_bytes)
+
+    async def aas_wav_b64_uri(self) -> str:
+        """
+        Asynchronous version of :meth:`as_wav_b64_uri`, run on the configured executor (see :func:`.set_executor`).
+        """
+        return await run_in_executor(self.as_wav_b64_uri)
+
+    async def aas_encoded(self, format: str = "flac", bitrate: int | str = None) -> bytes:
+        """Asynchronous version of :meth:`as_encoded`, run on the configured executor (see :func:`.set_executor`)."""
+        return await run_in_executor(self.as_encoded, format, bitrate)
+
+    async def aas_encoded_b64_uri(self, format: str = "flac", bitrate: int | str = None) -> str:
+        """
+        Asynchronous version of :meth:`as_encoded_b64_uri`, run on the configured executor (see
+        :func:`.set_executor`).
+        """
+        return await run_in_executor(self.as_encoded_b64_uri, format, bitrate)
+
     # ==== helpers ====
+    @functools.cached_property
+    def content_hash(self) -> str:
+        """
+        A hex digest of the audio data and sample rate, suitable for detecting exact duplicates.
+
+        The hash is computed the first time it is accessed and cached on the part afterwards.
+        """
+        the_hash = hashlib.blake2b(digest_size=16)
+        the_hash.update(f"{self.sample_rate}:".encode())
+        the_hash.update(self.raw)
+        return the_hash.hexdigest()
+
     @property
     def duration(self) -> float:
         """The duration of this audio clip, in seconds."""
@@ -202,11 +469,85 @@ class AudioPart(BaseMultimodalPart):
         audio_repr = f"[audio: {self.duration:.3f}s]"
         yield "raw", audio_repr
 
+    # ==== memory management ====
+    def model_post_init(self, context):
+        memory.track(self, len(self.raw))
+
+    def _spill_payload(self, f: IO[bytes]) -> bool:
+        f.write(self.__dict__.pop("raw"))
+        self._drop_memoized_data()
+        return True
+
+    def _restore_payload(self, f: IO[bytes]):
+        self.__dict__["raw"] = f.read()
+
+    def __getattr__(self, item):
+        # the raw data is removed from the instance dict when spilled to disk
+        if item == "raw":
+            return memory.restore(self, item)
+        return super().__getattr__(item)
+
+    def _drop_memoized_data(self):
+        if self._encoded is not None:
+            self._encoded = None
+            self._update_memoized_size()
+        super()._drop_memoized_data()
+
+    def _memoized_size(self) -> int:
+        size = super()._memoized_size()
+        if self._encoded is not None:
+            size += sum(len(data) for data in self._encoded.values())
+        return size
+
+    # ==== copying & pickling ====
+    def __deepcopy__(self, memo=None):
+        # memoryviews of shared memory can't be deep copied, so the copy gets its own bytes instead
+        memo = {} if memo is None else memo
+        if isinstance(raw := self.raw, memoryview):
+            memo[id(raw)] = bytes(raw)
+        return super().__deepcopy__(memo)
+
+    def __getstate__(self):
+        # copy the raw data into the state, in case it is spilled to disk or a view of shared memory
+        state = super().__getstate__()
+        state["__dict__"] = {**state["__dict__"], "raw": bytes(self.raw)}
+        state["__pydantic_private__"] = {**state["__pydantic_private__"], "_encoded": None}
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.model_post_init(None)
+
     # ==== serdes ====
-    @model_serializer(when_used="json")
-    def _serialize_audiopart(self) -> dict[str, str]:
-        """When we serialize to JSON, save the data as a URI"""
-        return {"wav_data": self.as_wav_b64_uri()}
+    @model_serializer(mode="wrap")
+    def _serialize_audiopart(self, nxt, info):
+        """When we serialize to JSON, save the data as a URI (see :func:`set_audio_serialization_format`)"""
+        if not info.mode_is_json():
+            # make sure spilled data is loaded before the default serializer reads the fields
+            if "raw" not in self.__dict__:
+                memory.restore(self, "raw")
+            # parts attached from shared memory hold a view of it, but should dump the same as any other part
+            if isinstance(self.raw, memoryview):
+                return nxt(self.model_copy(update={"raw": bytes(self.raw)}))
+            return nxt(self)
+        with span("serialize", type(self).__name__) as s:
+            fmt = _serialization_format
+            # the memoized payload may have been loaded or saved in another format
+            if (payload := self._get_json_payload()) is None or payload.get("audio_format", "wav") != fmt:
+                s.bytes_in = len(self.raw)
+                if fmt == "wav":
+                    payload = {"wav_data": self.as_wav_b64_uri()}
+                else:
+                    payload = {
+                        "audio_format": fmt,
+                        "sample_rate": self.sample_rate,
+                        "audio_data": self.as_encoded_b64_uri(fmt, _serialization_bitrate),
+                    }
+                self._set_json_payload(payload)
+            else:
+                s.cache_hit = True
+            s.bytes_out = len(payload.get("wav_data") or payload["audio_data"])
+        return payload | self._get_typekey_dict()
 
     # noinspection PyNestedDecorators
     @model_validator(mode="wrap")
@@ -214,5 +555,139 @@ class AudioPart(BaseMultimodalPart):
     def _validate_audiopart(cls, v, nxt):
         """If the value is the URI we saved, try loading it that way"""
         if isinstance(v, dict) and "wav_data" in v:
-            return cls.from_wav_b64_uri(v["wav_data"])
+            with span("deserialize", cls.__name__, bytes_in=len(v["wav_data"])) as s:
+                part = cls.from_wav_b64_uri(v["wav_data"])
+                s.bytes_out = len(part.raw)
+            part._set_json_payload({"wav_data": v["wav_data"]})
+            return part
+        if isinstance(v, dict) and "audio_data" in v:
+            with span("deserialize", cls.__name__, bytes_in=len(v["audio_data"])) as s:
+                encoded = b"".join(read_data_uri(v["audio_data"]).chunks)
+                part = cls.from_encoded(encoded, v["audio_format"], sr=v["sample_rate"])
+                s.bytes_out = len(part.raw)
+            part._set_json_payload({key: v[key] for key in ("audio_format", "sample_rate", "audio_data")})
+            return part
         return nxt(v)
+
+
+def set_audio_serialization_format(format: str = "wav", bitrate: int | str = None):
+    """
+    Set the format that audio data is stored in when AudioParts are serialized to JSON (e.g. when saving a chat
+    history).
+
+    By default, audio is stored as uncompressed WAV data. Use ``"flac"`` to store it losslessly in about half the
+    space, or a lossy format (``"opus"`` or ``"mp3"``) to store it in a fraction of the space (see
+    :meth:`AudioPart.as_encoded`). Audio saved in any of these formats can be loaded regardless of this setting, but
+    versions of this library without this setting can only load WAV data.
+
+    :param format: The format to store audio data in (``"wav"``, ``"flac"``, ``"opus"``, or ``"mp3"``).
+    :param bitrate: The bitrate to encode lossy formats at (see :meth:`AudioPart.as_encoded`).
+    """
+    global _serialization_format, _serialization_bitrate
+    _normalize_bitrate(_get_codec(format), bitrate)
+    _serialization_format = format
+    _serialization_bitrate = bitrate
+
+
+# ==== encoding ====
+def _get_codec(format: str) -> _AudioCodec:
+    try:
+        return _CODECS[format]
+    except KeyError:
+        raise ValueError(f"Unsupported audio format {format!r} (expected one of {', '.join(_CODECS)})") from None
+
+
+def _normalize_bitrate(codec: _AudioCodec, bitrate: int | str | None) -> int | None:
+    """
+    Return the bitrate to encode audio with the given codec at, in bits per second, or None for lossless codecs.
+
+    Bitrates given as ffmpeg strings (e.g. ``"32k"``) are converted, so that equal bitrates share a cache entry.
+    """
+    if codec.default_bitrate is None:
+        return None
+    bitrate = bitrate or codec.default_bitrate
+    if isinstance(bitrate, str):
+        match = _BITRATE_RE.fullmatch(bitrate.strip())
+        if match is None:
+            raise ValueError(f"Invalid bitrate {bitrate!r} (expected bits per second, e.g. 32000 or '32k')")
+        bitrate = float(match[1]) * _BITRATE_SUFFIXES[match[2]]
+    if bitrate <= 0:
+        raise ValueError(f"Invalid bitrate {bitrate!r} (expected a positive number of bits per second)")
+    return round(bitrate)
+
+
+def _import_soundfile():
+    """Return the :mod:`soundfile` module, or None if it (or the libsndfile library) is not installed."""
+    try:
+        import soundfile
+    except (ImportError, OSError):
+        return None
+    return soundfile
+
+
+def _encode_audio(raw: bytes, sample_rate: int, format: str, bitrate: int | None) -> bytes:
+    """Encode signed 16-bit little-endian mono PCM data in a compressed format."""
+    if format == "flac" and (soundfile := _import_soundfile()) is not None:
+        import numpy as np
+
+        out = io.BytesIO()
+        samples = np.frombuffer(raw, dtype="<i2")
+        soundfile.write(out, samples, sample_rate, format="FLAC", subtype="PCM_16")
+        return out.getvalue()
+
+    codec = _CODECS[format]
+    cmd = ["ffmpeg", "-v", "error", "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0"]
+    cmd += ["-c:a", codec.encoder]
+    if bitrate is not None:
+        cmd += ["-b:a", str(bitrate)]
+    return pipe_ffmpeg(cmd + ["-f", codec.container, "-"], raw)
+
+
+def _decode_audio(data: bytes, format: str, target_sr: int | None) -> tuple[bytes, int]:
+    """Decode audio data in a compressed format to signed 16-bit little-endian mono PCM."""
+    if format == "flac" and (soundfile := _import_soundfile()) is not None:
+        samples, sample_rate = soundfile.read(io.BytesIO(data), dtype="int16")
+        # multichannel or resampled audio is left to ffmpeg
+        if samples.ndim == 1 and target_sr in (None, sample_rate):
+            return samples.tobytes(), sample_rate
+
+    cmd = ["ffmpeg", "-v", "error", "-f", _CODECS[format].container, "-i", "pipe:0"]
+    return _split_piped_wav(pipe_ffmpeg(cmd + _pcm_output_args(target_sr), data))
+
+
+# ==== bulk decoding ====
+def _decode_audio_file(fp: PathLike, target_sr: int | None) -> tuple[bytes, int]:
+    """Decode an audio file to signed 16-bit little-endian mono PCM with ffmpeg, in a worker process."""
+    cmd = ["ffmpeg", "-v", "error", "-i", os.fspath(fp)]
+    result = subprocess.run(cmd + _pcm_output_args(target_sr), capture_output=True)
+    check_returncode(result, result.stderr)
+    return _split_piped_wav(result.stdout)
+
+
+def _pcm_output_args(target_sr: int | None) -> list[str]:
+    """The ffmpeg arguments to write the input's audio to stdout as mono 16-bit WAV data."""
+    args = ["-vn", "-ac", "1", "-acodec", "pcm_s16le"]
+    if target_sr is not None:
+        args += ["-ar", str(target_sr)]
+    return args + ["-f", "wav", "-"]
+
+
+def _split_piped_wav(data: bytes) -> tuple[bytes, int]:
+    """
+    Return the PCM data and sample rate of WAV data written by ffmpeg to a pipe.
+
+    ffmpeg can't seek back to fill in the chunk sizes when writing to a pipe, so the data chunk runs to the end.
+    """
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise MediaFormatException("ffmpeg did not output WAV data")
+    offset = 12
+    sample_rate = None
+    while offset + 8 <= len(data):
+        chunk_id = data[offset : offset + 4]
+        (chunk_size,) = struct.unpack_from("<I", data, offset + 4)
+        if chunk_id == b"fmt ":
+            (sample_rate,) = struct.unpack_from("<I", data, offset + 12)
+        elif chunk_id == b"data":
+            return data[offset + 8 :], sample_rate
+        offset += 8 + chunk_size + (chunk_size & 1)
+    raise MediaFormatException("ffmpeg output WAV data without a data chunk")
@@ -1,9 +1,9 @@
 import base64
 import functools
+import hashlib
 import io
 import mimetypes
 import os
-import re
 import tempfile
 import typing
 import zlib
@@ -12,13 +12,166 @@ from kani import MessagePart
 from kani.utils.typing import PathLike
 from pydantic import ConfigDict, model_serializer, model_validator
 
-from .utils import download_media
+from . import memory
+from .executor import run_in_executor
+from .instrumentation import span
+from .lazyfile import LazyFile
+from .utils import download_media, iter_b64_decode, read_data_uri, spool_chunks
+
+HASH_CHUNK_SIZE = 1024 * 1024
+DECOMPRESS_CHUNK_SIZE = 1024 * 1024
 
 
 # ==== bases ====
 class BaseMultimodalPart(MessagePart):
     model_config = ConfigDict(ignored_types=(functools.cached_property,))
 
+    # the JSON payload of the part is memoized, so that saving a long conversation repeatedly doesn't re-encode all
+    # of its media every time; it is dropped when a field is reassigned, or when the payload's fingerprint changes
+    # (see _payload_fingerprint), and counts towards the memory budget
+    _json_payload: dict | None = None
+    _json_fingerprint: typing.Hashable = None
+    # shallow copies share their payload (e.g. an open image or file) and a count of the parts holding it, so that
+    # only the last one closes it
+    _payload_refs: list | None = None
+    # cached properties computed from the payload, which are dropped along with the memoized data when it changes
+    _payload_properties: typing.ClassVar[tuple[str, ...]] = ("content_hash",)
+
+    def __setattr__(self, name, value):
+        if name in type(self).model_fields:
+            self._clear_memoized()
+            # the new value is this part's own
+            self._release_payload()
+        super().__setattr__(name, value)
+
+    def model_copy(self, *, update=None, deep: bool = False):
+        copied = super().model_copy(update=update, deep=deep)
+        if update:
+            copied._clear_memoized()
+        return copied
+
+    # spilled payloads are missing from the instance dict, which pydantic copies directly
+    def __copy__(self):
+        memory.load(self)
+        if self._payload_refs is None:
+            self._payload_refs = [1]
+        self._payload_refs[0] += 1
+        return super().__copy__()
+
+    def __deepcopy__(self, memo=None):
+        memory.load(self)
+        copied = super().__deepcopy__(memo)
+        # a deep copy holds its own payload, which counts towards the memory budget
+        copied._payload_refs = None
+        copied.model_post_init(None)
+        return copied
+
+    def __eq__(self, other):
+        if not isinstance(other, BaseMultimodalPart):
+            return super().__eq__(other)
+        # unlike pydantic, ignore private attributes, which only hold memoized data and bookkeeping
+        # (and read the fields as attributes, which restores spilled payloads)
+        return (
+            type(self) is type(other)
+            and all(getattr(self, name) == getattr(other, name) for name in type(self).model_fields)
+            and self.__pydantic_extra__ == other.__pydantic_extra__
+        )
+
+    def invalidate(self):
+        """
+        Drop the data memoized from the part's payload (e.g. its serialized JSON), so that it is recomputed the next
+        time it is needed.
+
+        This happens automatically when a field is reassigned, or when a change to the payload is detected (e.g. an
+        image being resized in place, or a file being written to). Call this after modifying the payload in a way that
+        is not detected, such as drawing on an image in place.
+        """
+        self._clear_memoized()
+
+    def _clear_memoized(self):
+        """
+        Drop everything memoized from the part's fields, since they changed. Subclasses that memoize other data should
+        extend this, or :meth:`_drop_memoized_data` if it takes up memory.
+        """
+        for name in self._payload_properties:
+            self.__dict__.pop(name, None)
+        self._drop_memoized_data()
+
+    def _drop_memoized_data(self):
+        """
+        Drop the memoized data that takes up memory (e.g. when the part is spilled to disk), keeping small values
+        computed from the payload, like its hash.
+        """
+        if self._json_payload is not None:
+            self._json_payload = None
+            self._update_memoized_size()
+
+    def _memoized_size(self) -> int:
+        """The size of the memoized data held by the part, in bytes. Subclasses that memoize other data extend this."""
+        if self._json_payload is None:
+            return 0
+        return sum(len(value) for value in self._json_payload.values() if isinstance(value, str))
+
+    def _update_memoized_size(self):
+        """Report the size of the part's memoized data, which counts towards the memory budget."""
+        memory.memoize(self, self._memoized_size())
+
+    def _payload_fingerprint(self) -> typing.Hashable:
+        """
+        A cheap value that changes when the part's payload is modified in place. The memoized JSON payload is only
+        reused if the fingerprint is the same as when it was memoized.
+        """
+        return None
+
+    def _get_json_payload(self) -> dict | None:
+        """Return the memoized JSON payload, or None if there is none or it is out of date."""
+        if self._json_payload is not None and self._json_fingerprint != self._payload_fingerprint():
+            self._clear_memoized()
+        return self._json_payload
+
+    def _set_json_payload(self, payload: dict):
+        self._json_payload = payload
+        self._json_fingerprint = self._payload_fingerprint()
+        self._update_memoized_size()
+
+    def _release_payload(self) -> bool:
+        """Stop sharing the payload with the part's copies. Returns whether no other part holds it, to close it."""
+        if (refs := self._payload_refs) is None:
+            return True
+        refs[0] -= 1
+        self._payload_refs = None
+        return refs[0] == 0
+
+    def __getstate__(self):
+        # the memoized payload can be recomputed, so don't send it along with the data (which the unpickled part owns)
+        state = super().__getstate__()
+        if state.get("__pydantic_private__"):
+            state["__pydantic_private__"] = {
+                **state["__pydantic_private__"],
+                "_json_payload": None,
+                "_json_fingerprint": None,
+                "_payload_refs": None,
+            }
+        return state
+
+    async def amodel_dump_json(self, **kwargs) -> str:
+        """
+        Asynchronous version of :meth:`model_dump_json`, run on the configured executor (see :func:`.set_executor`).
+
+        Keyword arguments are passed to :meth:`model_dump_json`.
+        """
+        return await run_in_executor(self.model_dump_json, **kwargs)
+
+    @classmethod
+    async def amodel_validate_json(cls, json_data: str | bytes, **kwargs):
+        """
+        Asynchronous version of :meth:`model_validate_json`, run on the configured executor (see
+        :func:`.set_executor`).
+
+        Keyword arguments are passed to :meth:`model_validate_json`.
+        """
+        return await run_in_executor(cls.model_validate_json, json_data, **kwargs)
+
 
 class BinaryFilePart(BaseMultimodalPart, arbitrary_types_allowed=True):
     """
@@ -38,13 +191,16 @@ class BinaryFilePart(BaseMultimodalPart, arbitrary_types_allowed=True):
 
     # ==== constructors ====
     @classmethod
-    def from_file(cls, fp: PathLike | typing.BinaryIO, mime: str = None, **kwargs):
+    def from_file(cls, fp: PathLike | typing.BinaryIO, mime: str = None, *, lazy: bool = False, **kwargs):
         """
         Create a BinaryFilePart from a local file.
 
         :param fp: The path to the file, or a file-like object.
         :param mime: The MIME file type (https://www.iana.org/assignments/media-types/media-types.xhtml)
             of the file. If not passed, will attempt to guess the filetype from the file name.
+        :param lazy: If True and *fp* is a path, don't keep the file open for the lifetime of the part; instead, open it
+            only while it is being read (see :class:`.LazyFile`). Use this when keeping many file-backed parts around
+            at once, which could otherwise run out of file descriptors. The file must not be modified afterwards.
         """
         # file-like object
         if isinstance(fp, io.IOBase):
@@ -64,8 +220,12 @@ class BinaryFilePart(BaseMultimodalPart, arbitrary_types_allowed=True):
                     " IANA-defined media type (https://www.iana.org/assignments/media-types/media-types.xhtml)."
                 )
 
-        handle = open(fp, mode="rb")
-        return cls(file=handle, mime=mime, **kwargs)
+        with span("from_file", cls.__name__) as s:
+            handle = LazyFile(fp) if lazy else open(fp, mode="rb")
+            part = cls(file=handle, mime=mime, **kwargs)
+            if s:
+                s.bytes_out = part.filesize
+        return part
 
     @classmethod
     def from_bytes(cls, data: bytes, mime: str, **kwargs):
@@ -80,17 +240,25 @@ class BinaryFilePart(BaseMultimodalPart, arbitrary_types_allowed=True):
         return cls(file=handle, mime=mime, **kwargs)
 
     @classmethod
-    def from_b64(cls, data: str, mime: str, **kwargs):
-        """Create a BinaryFilePart from Base64-encoded binary data."""
-        return cls.from_bytes(base64.b64decode(data), mime, **kwargs)
+    def from_b64(cls, data: str | bytes | typing.IO, mime: str, **kwargs):
+        """
+        Create a BinaryFilePart from Base64-encoded binary data.
+
+        The data can be passed as a string, bytes, or a text or binary file-like object to read it from. It is decoded
+        in chunks into memory, or into a temporary file on disk if it is large.
+        """
+        return cls(file=spool_chunks(iter_b64_decode(data)), mime=mime, **kwargs)
 
     @classmethod
-    def from_b64_uri(cls, data: str):
-        if not (prefix_match := re.match("data:(.+);base64,", data)):
-            raise ValueError(
-                "Data URI must begin with a MIME type indicating Base64 encoding (`data:mime/type;base64,`)."
-            )
-        return cls.from_b64(data=data[prefix_match.end() :], mime=prefix_match[1])
+    def from_b64_uri(cls, data: str | bytes | typing.IO, **kwargs):
+        """
+        Create a BinaryFilePart from a base64 data URI (``data:mime/type;base64,...``).
+
+        The URI can be passed as a string, bytes, or a text or binary file-like object to read it from. Only its header
+        is parsed up front; the data is decoded in chunks into memory, or into a temporary file on disk if it is large.
+        """
+        uri = read_data_uri(data)
+        return cls(file=spool_chunks(uri.chunks), mime=uri.mime, **kwargs)
 
     @classmethod
     async def from_url(cls, url: str, *, allowed_mime=("*",), **kwargs):
@@ -109,8 +277,12 @@ class BinaryFilePart(BaseMultimodalPart, arbitrary_types_allowed=True):
     # ==== representations ====
     def as_bytes(self) -> bytes:
         """Return the full raw data. This could consume a lot of memory!"""
-        self.file.seek(0)
-        return self.file.read()
+        memory.touch(self)
+        with span("as_bytes", type(self).__name__) as s:
+            self.file.seek(0)
+            data = self.file.read()
+            s.bytes_out = len(data)
+        return data
 
     def as_b64(self) -> str:
         """
@@ -123,9 +295,38 @@ class BinaryFilePart(BaseMultimodalPart, arbitrary_types_allowed=True):
 
     def as_b64_uri(self) -> str:
         """Get the binary data encoded in a web-suitable base64 string. This could consume a lot of memory!"""
-        return f"data:{self.mime};base64,{self.as_b64()}"
+        with span("as_b64_uri", type(self).__name__) as s:
+            uri = f"data:{self.mime};base64,{self.as_b64()}"
+            s.bytes_out = len(uri)
+        return uri
+
+    # --- async ---
+    async def aas_bytes(self) -> bytes:
+        """Asynchronous version of :meth:`as_bytes`, run on the configured executor (see :func:`.set_executor`)."""
+        return await run_in_executor(self.as_bytes)
+
+    async def aas_b64(self) -> str:
+        """Asynchronous version of :meth:`as_b64`, run on the configured executor (see :func:`.set_executor`)."""
+        return await run_in_executor(self.as_b64)
+
+    async def aas_b64_uri(self) -> str:
+        """Asynchronous version of :meth:`as_b64_uri`, run on the configured executor (see :func:`.set_executor`)."""
+        return await run_in_executor(self.as_b64_uri)
 
     # ==== helpers ====
+    @functools.cached_property
+    def content_hash(self) -> str:
+        """
+        A hex digest of the file's contents, suitable for detecting exact duplicates.
+
+        The hash is computed the first time it is accessed by streaming the file, and is cached on the part afterwards.
+        """
+        the_hash = hashlib.blake2b(digest_size=16)
+        self.file.seek(0)
+        while chunk := self.file.read(HASH_CHUNK_SIZE):
+            the_hash.update(chunk)
+        return the_hash.hexdigest()
+
     @property
     def filesize(self):
         """The size of the file, in bytes."""
@@ -138,12 +339,77 @@ class BinaryFilePart(BaseMultimodalPart, arbitrary_types_allowed=True):
             self.file.seek(0, os.SEEK_END)
             return self.file.tell()
 
+    # ==== memory management ====
+    def model_post_init(self, context):
+        if isinstance(self.file, io.BytesIO):
+            with self.file.getbuffer() as view:
+                memory.track(self, view.nbytes)
+
+    def _spill_payload(self, f: typing.IO[bytes]) -> bool:
+        if not isinstance(self.file, io.BytesIO):
+            # file-backed parts are only tracked for their memoized JSON payload
+            self._drop_memoized_data()
+            return False
+        # in-memory data is moved to an anonymous temporary file for good, which is just as usable
+        # (the memoized JSON payload is dropped too, since it is as large as the data)
+        spooled = tempfile.TemporaryFile()
+        with self.file.getbuffer() as view:
+            spooled.write(view)
+        spooled.seek(self.file.tell())
+        self._drop_memoized_data()
+        self._release_payload()
+        # the contents are unchanged, so bypass our __setattr__, which would also drop the values computed from them
+        super(BaseMultimodalPart, self).__setattr__("file", spooled)
+        return False
+
+    def _payload_fingerprint(self) -> typing.Hashable:
+        file = self.file
+        if isinstance(file, io.BytesIO):
+            # checksumming memory is much cheaper than compressing it
+            with file.getbuffer() as view:
+                return zlib.crc32(view)
+        if isinstance(file, LazyFile):
+            # lazy files refuse to read a file that was modified
+            return None
+        try:
+            stat = os.fstat(file.fileno())
+            return stat.st_size, stat.st_mtime_ns
+        except (io.UnsupportedOperation, OSError):
+            pos = file.tell()
+            size = file.seek(0, os.SEEK_END)
+            file.seek(pos)
+            return size
+
+    # ==== pickling ====
+    # file handles can't be pickled (e.g. to send a part to a process pool), so we pickle the data instead
+    # (lazy files only store their path, so they are pickled as-is)
+    def __getstate__(self):
+        state = super().__getstate__()
+        if not isinstance(self.file, LazyFile):
+            state["__dict__"] = {**state["__dict__"], "file": self.as_bytes()}
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(data := state["__dict__"]["file"], bytes):
+            state["__dict__"] = {**state["__dict__"], "file": io.BytesIO(data)}
+        super().__setstate__(state)
+        self.model_post_init(None)
+
     # ==== serdes ====
     @model_serializer(when_used="json")
     def _serialize_binary_file_part(self) -> dict[str, str]:
         """When we serialize to JSON, save the data as compressed B64."""
-        compressed_b64 = base64.b64encode(zlib.compress(self.as_bytes())).decode()
-        return {"mime": self.mime, "compression": "gzip", "data": compressed_b64}
+        with span("serialize", type(self).__name__) as s:
+            if (payload := self._get_json_payload()) is None:
+                data = self.as_bytes()
+                compressed_b64 = base64.b64encode(zlib.compress(data)).decode()
+                s.bytes_in = len(data)
+                payload = {"mime": self.mime, "compression": "gzip", "data": compressed_b64}
+                self._set_json_payload(payload)
+            else:
+                s.cache_hit = True
+            s.bytes_out = len(payload["data"])
+        return payload | self._get_typekey_dict()
 
     # noinspection PyNestedDecorators
     @model_validator(mode="wrap")
@@ -151,15 +417,34 @@ class BinaryFilePart(BaseMultimodalPart, arbitrary_types_allowed=True):
     def _validate_binary_file_part(cls, v, nxt):
         """If the value is the URI we saved, try loading it that way."""
         if isinstance(v, dict) and "data" in v:
-            if v.get("compression") == "gzip":
-                decompressed = zlib.decompress(base64.b64decode(v["data"]))
-                return cls.from_bytes(mime=v["mime"], data=decompressed)
-            return cls.from_b64(mime=v["mime"], data=v["data"])
+            with span("deserialize", cls.__name__, bytes_in=len(v["data"])) as s:
+                chunks = iter_b64_decode(v["data"])
+                if v.get("compression") == "gzip":
+                    chunks = _decompress_chunks(chunks)
+                part = cls(file=spool_chunks(chunks), mime=v["mime"])
+                if s:
+                    s.bytes_out = part.filesize
+            # we already have the part's payload, so saving it again is free
+            part._set_json_payload({key: v[key] for key in ("mime", "compression", "data") if key in v})
+            return part
         return nxt(v)
 
     # ==== lifecycle ====
     def __del__(self):
-        self.file.close()
+        if self._release_payload():
+            self.file.close()
+
+
+def _decompress_chunks(chunks: typing.Iterable[bytes]) -> typing.Iterator[bytes]:
+    """Decompress chunks of zlib-compressed data, without decompressing more than a chunk's worth at a time."""
+    decompressor = zlib.decompressobj()
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk, DECOMPRESS_CHUNK_SIZE)
+            chunk = decompressor.unconsumed_tail
+    yield decompressor.flush()
+    if not decompressor.eof:
+        raise zlib.error("The compressed data is incomplete.")
 
 
 # ==== text ====
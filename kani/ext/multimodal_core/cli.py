@@ -3,20 +3,20 @@ CLI helpers for chatting with kani from terminal. Gets conditionally imported by
 installed to provide multimodal support.
 """
 
+import functools
 import logging
 import mimetypes
 import pathlib
 import re
 import sys
 import warnings
+from collections import namedtuple
+from typing import Iterator
 
 from kani.models import MessagePartType
 
-from .audio import AudioPart
 from .base import TextPart
-from .image import ImagePart
 from .utils import get_mime_type
-from .video import VideoPart
 
 _is_notebook = "ipykernel" in sys.modules
 
@@ -28,39 +28,281 @@ log = logging.getLogger(__name__)
 # https://gist.github.com/gruber/8891611
 WEB_REGEX = r"""((?:https?:(?:/{1,3}|[a-z0-9%])|[a-z0-9.\-]+[.](?:com|net|org|edu|gov|mil|aero|asia|biz|cat|coop|info|int|jobs|mobi|museum|name|post|pro|tel|travel|xxx|ac|ad|ae|af|ag|ai|al|am|an|ao|aq|ar|as|at|au|aw|ax|az|ba|bb|bd|be|bf|bg|bh|bi|bj|bm|bn|bo|br|bs|bt|bv|bw|by|bz|ca|cc|cd|cf|cg|ch|ci|ck|cl|cm|cn|co|cr|cs|cu|cv|cx|cy|cz|dd|de|dj|dk|dm|do|dz|ec|ee|eg|eh|er|es|et|eu|fi|fj|fk|fm|fo|fr|ga|gb|gd|ge|gf|gg|gh|gi|gl|gm|gn|gp|gq|gr|gs|gt|gu|gw|gy|hk|hm|hn|hr|ht|hu|id|ie|il|im|in|io|iq|ir|is|it|je|jm|jo|jp|ke|kg|kh|ki|km|kn|kp|kr|kw|ky|kz|la|lb|lc|li|lk|lr|ls|lt|lu|lv|ly|ma|mc|md|me|mg|mh|mk|ml|mm|mn|mo|mp|mq|mr|ms|mt|mu|mv|mw|mx|my|mz|na|nc|ne|nf|ng|ni|nl|no|np|nr|nu|nz|om|pa|pe|pf|pg|ph|pk|pl|pm|pn|pr|ps|pt|pw|py|qa|re|ro|rs|ru|rw|sa|sb|sc|sd|se|sg|sh|si|sj|Ja|sk|sl|sm|sn|so|sr|ss|st|su|sv|sx|sy|sz|tc|td|tf|tg|th|tj|tk|tl|tm|tn|to|tp|tr|tt|tv|tw|tz|ua|ug|uk|us|uy|uz|va|vc|ve|vg|vi|vn|vu|wf|ws|ye|yt|yu|za|zm|zw)/)(?:[^\s()<>{}\[\]]+|\([^\s()]*?\([^\s()]+\)[^\s()]*?\)|\([^\s]+?\))+(?:\([^\s()]*?\([^\s()]+\)[^\s()]*?\)|\([^\s]+?\)|[^\s`!()\[\]{};:'".,<>?«»“”‘’])|(?:(?<!@)[a-z0-9]+(?:[.\-][a-z0-9]+)*[.](?:com|net|org|edu|gov|mil|aero|asia|biz|cat|coop|info|int|jobs|mobi|museum|name|post|pro|tel|travel|xxx|ac|ad|ae|af|ag|ai|al|am|an|ao|aq|ar|as|at|au|aw|ax|az|ba|bb|bd|be|bf|bg|bh|bi|bj|bm|bn|bo|br|bs|bt|bv|bw|by|bz|ca|cc|cd|cf|cg|ch|ci|ck|cl|cm|cn|co|cr|cs|cu|cv|cx|cy|cz|dd|de|dj|dk|dm|do|dz|ec|ee|eg|eh|er|es|et|eu|fi|fj|fk|fm|fo|fr|ga|gb|gd|ge|gf|gg|gh|gi|gl|gm|gn|gp|gq|gr|gs|gt|gu|gw|gy|hk|hm|hn|hr|ht|hu|id|ie|il|im|in|io|iq|ir|is|it|je|jm|jo|jp|ke|kg|kh|ki|km|kn|kp|kr|kw|ky|kz|la|lb|lc|li|lk|lr|ls|lt|lu|lv|ly|ma|mc|md|me|mg|mh|mk|ml|mm|mn|mo|mp|mq|mr|ms|mt|mu|mv|mw|mx|my|mz|na|nc|ne|nf|ng|ni|nl|no|np|nr|nu|nz|om|pa|pe|pf|pg|ph|pk|pl|pm|pn|pr|ps|pt|pw|py|qa|re|ro|rs|ru|rw|sa|sb|sc|sd|se|sg|sh|si|sj|Ja|sk|sl|sm|sn|so|sr|ss|st|su|sv|sx|sy|sz|tc|td|tf|tg|th|tj|tk|tl|tm|tn|to|tp|tr|tt|tv|tw|tz|ua|ug|uk|us|uy|uz|va|vc|ve|vg|vi|vn|vu|wf|ws|ye|yt|yu|za|zm|zw)\b/?(?!@)))"""  # noqa: E501
 # @formatter:on
-MEDIA_RE = re.compile(
+MEDIA_PATTERN = (
     r"(?<!\S)@(?:"  # not after a non-WS character (to prevent catching email addresses etc)
     rf"(?P<url>{WEB_REGEX})"  # URL
     r"|(?P<path>/?(\S+?/)*([^/\s]+\.[^/\s]+))"  # path, no quotes
     r"|(?P<path_quot>\"/?([^\"]+?/)*([^/\"]+\.[^/\s\"]+)\")"  # path with quotes
-    r")",
-    re.IGNORECASE,
+    r")"
 )
+"""
+The reference regex for media references in a CLI query. This backtracks catastrophically on some inputs (e.g. a long
+URL followed by punctuation), so :func:`find_media_references` implements the same grammar in linear time instead.
+The compiled regex is still available as ``MEDIA_RE`` (compiled on first access, since compiling it is slow).
+"""
+
+MediaReference = namedtuple("MediaReference", "start end url path path_quot")
+"""
+A media reference found in a CLI query by :func:`find_media_references`. Exactly one of ``url``, ``path`` (an unquoted
+path), or ``path_quot`` (a quoted path, including the quotes) is set; the others are None. The text of the reference
+(including the ``@``) is ``query[start:end]``.
+"""
+
+
+def __getattr__(name):
+    if name == "MEDIA_RE":
+        value = globals()["MEDIA_RE"] = re.compile(MEDIA_PATTERN, re.IGNORECASE)
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# ==== media reference tokenizer ====
+# these small regexes match the corresponding pieces of WEB_REGEX; none of them can backtrack more than linearly
+_WS_RE = re.compile(r"\s")
+_SCHEME_RE = re.compile(r"https?:", re.IGNORECASE)
+_SCHEME_CHAR_RE = re.compile(r"[a-z0-9%]", re.IGNORECASE)
+_HOST_CHARS_RE = re.compile(r"[a-z0-9.\-]*", re.IGNORECASE)
+# characters that can appear in a URL outside of parentheses, and that a URL can end with
+_URL_CHARS = frozenset("()<>{}[]")
+_URL_END_EXCLUDED = frozenset("`!()[]{};:'\".,<>?«»“”‘’")
+
+
+@functools.cache
+def _host_re() -> re.Pattern:
+    # the TLD alternation in WEB_REGEX
+    tlds = WEB_REGEX.split("[.](?:", 1)[1].split(")", 1)[0]
+    return re.compile(rf"[a-z0-9.\-]+[.](?:{tlds})", re.IGNORECASE)
+
+
+def find_media_references(query: str) -> Iterator[MediaReference]:
+    """
+    Find the media referenced by ``@url``, ``@path``, or ``@"quoted path"`` in a CLI query, in linear time.
+
+    This finds exactly the same references as ``MEDIA_RE.finditer(query)`` would (see :data:`MEDIA_PATTERN`).
+    """
+    n = len(query)
+    pos = 0
+    quotes = _QuoteIndex(query)
+    while (at := query.find("@", pos)) != -1:
+        pos = at + 1
+        # not after a non-whitespace character (to prevent catching email addresses etc)
+        if at and not query[at - 1].isspace():
+            continue
+        start = at + 1
+        token_end = ws.start() if (ws := _WS_RE.search(query, start)) else n
+        if (end := _match_url(query, start, token_end)) is not None:
+            yield MediaReference(at, end, query[start:end], None, None)
+        elif (end := _match_path(query, start, token_end)) is not None:
+            yield MediaReference(at, end, None, query[start:end], None)
+        elif (end := quotes.match_quoted_path(start)) is not None:
+            yield MediaReference(at, end, None, None, query[start:end])
+        else:
+            continue
+        pos = end
+
+
+def _match_url(query: str, start: int, end: int) -> int | None:
+    """
+    Return the end of the URL at *start* (within the whitespace-delimited token ending at *end*), or None.
+
+    WEB_REGEX is a prefix (a scheme, or a domain ending in a TLD and a slash) followed by ``(?:X)+F``, where each X is a
+    run of URL characters or a parenthesized group, and F is a character a URL can end with or a parenthesized group.
+    The regex returns the first parse in backtracking order; we find the same one by computing, for each position in
+    the token, the end of the first match of ``(?:X)*F`` from there (working backwards through the token).
+    """
+    bodies = []  # the positions after each possible prefix, in the order the regex tries them
+    if scheme := _SCHEME_RE.match(query, start, end):
+        after = scheme.end()
+        slashes = 0
+        while slashes < 3 and after + slashes < end and query[after + slashes] == "/":
+            slashes += 1
+        bodies.extend(after + i for i in range(slashes, 0, -1))
+        if _SCHEME_CHAR_RE.match(query, after, end):
+            bodies.append(after + 1)
+    host_end = _HOST_CHARS_RE.match(query, start, end).end()
+    if host_end < end and query[host_end] == "/" and _host_re().fullmatch(query, start, host_end):
+        bodies.append(host_end + 1)
+    if not bodies:
+        return None
+
+    matcher = _UrlBodyMatcher(query, min(bodies), end)
+    for body_start in bodies:
+        if (url_end := matcher.match_body(body_start)) is not None:
+            return url_end
+    return None
+
+
+class _UrlBodyMatcher:
+    """Finds where ``(?:X)+F`` (see :func:`_match_url`) matches in a token, the way the backtracking regex would."""
+
+    def __init__(self, query: str, start: int, end: int):
+        self.query = query
+        self.end = end
+        size = end - start + 1
+        self.offset = start
+        # the end of the first match of (?:X)*F at each position, or None
+        self.tail_end: list[int | None] = [None] * size
+        # for each position, the end of the first ")" at or after it (i.e. the shortest "\([^\s]+?\)" ending there)
+        # from which (?:X)*F matches, and the end of the first ")" at all
+        self.next_good_close: list[int | None] = [None] * (size + 1)
+        self.next_close: list[int | None] = [None] * (size + 1)
+        # for each position, the position of the next parenthesis (or the end of the token)
+        self.next_paren: list[int] = [end] * (size + 1)
+
+        run_end = end  # the end of the current run of URL characters
+        run_best = None  # the last place in the current run of URL characters that a URL could end
+        for p in range(end - 1, start - 1, -1):
+            i = p - start
+            c = query[p]
+            self.next_paren[i] = p if c in "()" else self.next_paren[i + 1]
+            if c not in _URL_CHARS:
+                if p + 1 == end or query[p + 1] in _URL_CHARS:
+                    run_end = p + 1
+                    run_best = None
+                if run_best is None and c not in _URL_END_EXCLUDED:
+                    run_best = p + 1
+                # X takes as much of the run as it can; otherwise, F ends at the last character it can
+                after_run = self._tail(run_end)
+                self.tail_end[i] = after_run if after_run is not None else run_best
+            elif c == "(":
+                nested = self._nested_group_end(p)
+                if nested is not None and self._tail(nested) is not None:
+                    self.tail_end[i] = self._tail(nested)
+                elif (good_close := self._next(self.next_good_close, p + 2)) is not None:
+                    self.tail_end[i] = self._tail(good_close)
+                elif nested is not None:
+                    self.tail_end[i] = nested
+                else:
+                    self.tail_end[i] = self._next(self.next_close, p + 2)
+            if c == ")":
+                self.next_close[i] = p + 1
+                self.next_good_close[i] = p + 1 if self._tail(p + 1) is not None else self.next_good_close[i + 1]
+            else:
+                self.next_close[i] = self.next_close[i + 1]
+                self.next_good_close[i] = self.next_good_close[i + 1]
+
+    def match_body(self, p: int) -> int | None:
+        """The end of the first match of (?:X)+F at *p*, which needs at least one X before F."""
+        if p >= self.end:
+            return None
+        c = self.query[p]
+        if c not in _URL_CHARS:
+            return self._tail(p + 1)
+        if c == "(":
+            nested = self._nested_group_end(p)
+            if nested is not None and self._tail(nested) is not None:
+                return self._tail(nested)
+            if (good_close := self._next(self.next_good_close, p + 2)) is not None:
+                return self._tail(good_close)
+        return None
+
+    def _tail(self, p: int) -> int | None:
+        return self.tail_end[p - self.offset] if p < self.end else None
+
+    def _next(self, table: list, p: int) -> int | None:
+        return table[p - self.offset] if p < self.end else None
+
+    def _nested_group_end(self, p: int) -> int | None:
+        r"""The end of "\([^\s()]*?\([^\s()]+\)[^\s()]*?\)" at *p*, or None."""
+        inner_open = self.next_paren[p + 1 - self.offset] if p + 1 < self.end else self.end
+        if inner_open >= self.end or self.query[inner_open] != "(":
+            return None
+        inner_close = self.next_paren[inner_open + 1 - self.offset] if inner_open + 1 < self.end else self.end
+        if inner_close == inner_open + 1 or inner_close >= self.end or self.query[inner_close] != ")":
+            return None
+        outer_close = self.next_paren[inner_close + 1 - self.offset] if inner_close + 1 < self.end else self.end
+        if outer_close >= self.end or self.query[outer_close] != ")":
+            return None
+        return outer_close + 1
+
+
+def _match_path(query: str, start: int, end: int) -> int | None:
+    """
+    Return the end of the unquoted path at *start*, or None.
+
+    The regex tries the path's components from last to first, and matches up to the end of the first one with a dot
+    that isn't its first or last character.
+    """
+    component_end = end
+    while True:
+        slash = query.rfind("/", start, component_end)
+        component_start = slash + 1 if slash != -1 else start
+        if query.find(".", component_start + 1, component_end - 1) != -1:
+            return component_end
+        if slash == -1:
+            return None
+        component_end = slash
+
+
+class _QuoteIndex:
+    """
+    Matches quoted paths, remembering where the next quote is so that many references without a closing quote don't
+    each search the rest of the query.
+    """
+
+    def __init__(self, query: str):
+        self.query = query
+        self.searched_from = len(query) + 1
+        self.close = -1
+        self.last_slash = -1
+        self.last_dot = -1
+        self.dot_suffix_ok = False
+
+    def match_quoted_path(self, start: int) -> int | None:
+        """Return the end of the quoted path at *start*, or None."""
+        query = self.query
+        if start >= len(query) or query[start] != '"':
+            return None
+        self._find_close(start + 1)
+        if self.close == -1:
+            return None
+        # the last component (after the last slash) needs a dot after its first character, with no whitespace after it
+        component_start = max(self.last_slash + 1, start + 1)
+        if self.last_dot <= component_start or not self.dot_suffix_ok:
+            return None
+        return self.close + 1
+
+    def _find_close(self, content_start: int):
+        if self.searched_from <= content_start and (self.close == -1 or self.close >= content_start):
+            return
+        query = self.query
+        self.searched_from = content_start
+        self.close = query.find('"', content_start)
+        if self.close == -1:
+            return
+        self.last_slash = query.rfind("/", content_start, self.close)
+        self.last_dot = query.rfind(".", content_start, self.close - 1)
+        self.dot_suffix_ok = self.last_dot != -1 and not _WS_RE.search(query, self.last_dot + 1, self.close)
 
 
 # ==== parsing helpers ====
 async def parts_from_cli_query(query: str) -> list[MessagePartType]:
     """Parse a string with paths to media prepended by ``@`` into the right messageparts."""
+    from .audio import AudioPart
+    from .image import ImagePart
+    from .video import VideoPart
+
     query_parts = []
     last_idx = 0
-    for media_match in MEDIA_RE.finditer(query):
+    for media_ref in find_media_references(query):
         # push everything between the end of the last path and the start of this one to the parts
-        query_parts.append(query[last_idx : media_match.start()])
-        last_idx = media_match.end()
+        query_parts.append(query[last_idx : media_ref.start])
+        last_idx = media_ref.end
+        ref_text = query[media_ref.start : media_ref.end]
 
         # if a path:
-        if not media_match["url"]:
+        if not media_ref.url:
             # ensure the path is valid
-            if path := media_match["path"]:
+            if path := media_ref.path:
                 fp = pathlib.Path(path)
             else:
-                fp = pathlib.Path(media_match["path_quot"].strip('"'))
+                fp = pathlib.Path(media_ref.path_quot.strip('"'))
 
             # if not valid, push the string to parts
             log.debug(f"Found path: {fp}")
             if not (fp.exists() and fp.is_file()):
                 warnings.warn(f"The given path ({fp}) either does not exist or is not a valid file.")
-                query_parts.append(media_match[0])
+                query_parts.append(ref_text)
             # otherwise, push a media part depending on the filetype
             else:
                 mime, _ = mimetypes.guess_type(fp.name)
@@ -75,10 +317,10 @@ async def parts_from_cli_query(query: str) -> list[MessagePartType]:
                         f"I could not understand the filetype of the given file: {fp}\n(expected MIME type to be one of"
                         f" image/*, audio/*, or video/*, but got {mime})"
                     )
-                    query_parts.append(media_match[0])
+                    query_parts.append(ref_text)
         # if a url:
         else:
-            url = media_match["url"]
+            url = media_ref.url
             # try getting the MIME type
             mime = await get_mime_type(url)
 
@@ -95,7 +337,7 @@ async def parts_from_cli_query(query: str) -> list[MessagePartType]:
                     f"I could not understand the filetype of the given URL: {url}\n(expected MIME type to be one of"
                     f" image/*, audio/*, or video/*, but got {mime})"
                 )
-                query_parts.append(media_match[0])
+                query_parts.append(ref_text)
 
     # and make sure the rest of the query is in the parts
     query_parts.append(query[last_idx:])
@@ -114,6 +356,10 @@ def display_media(
     :param parts: The list of parts to display.
     :param show_text: Whether to echo text parts or only display media parts.
     """
+    from .audio import AudioPart
+    from .image import ImagePart
+    from .video import VideoPart
+
     # show each part in an IPython display
     for part in parts:
         if isinstance(part, (str, TextPart)):
@@ -144,6 +390,10 @@ def display_media_ipython(
     """
     from IPython.display import Audio, Image, Video, display
 
+    from .audio import AudioPart
+    from .image import ImagePart
+    from .video import VideoPart
+
     # show each part in an IPython display
     for part in parts:
         if isinstance(part, (str, TextPart)):
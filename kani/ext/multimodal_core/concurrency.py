@@ -0,0 +1,82 @@
+"""Helpers for processing many multimodal parts concurrently."""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
+from .audio import AudioPart
+from .base import BinaryFilePart
+from .image import ImagePart
+
+EncodablePart = ImagePart | AudioPart | BinaryFilePart
+
+
+# ==== batch encoding ====
+def _encode_part(part: EncodablePart, format: str) -> str:
+    """Encode a single part as a web-suitable base64 string."""
+    if isinstance(part, ImagePart):
+        return part.as_b64_uri(format)
+    if isinstance(part, AudioPart):
+        return part.as_wav_b64_uri()
+    return part.as_b64_uri()
+
+
+def _unique_parts(parts: list[EncodablePart]) -> list[EncodablePart]:
+    """
+    Return the distinct part objects in the given list, in order of first appearance.
+
+    The same part object must not be encoded concurrently since its file-like object has a single read position.
+    """
+    seen = {}
+    for part in parts:
+        if not isinstance(part, (ImagePart, AudioPart, BinaryFilePart)):
+            raise TypeError(f"Expected an ImagePart, AudioPart, or BinaryFilePart, but got {type(part)!r}.")
+        seen.setdefault(id(part), part)
+    return list(seen.values())
+
+
+def _default_workers(n_parts: int) -> int:
+    return max(1, min(n_parts, os.cpu_count() or 1))
+
+
+def encode_parts(parts: Iterable[EncodablePart], *, format: str = "png", max_workers: int = None) -> list[str]:
+    """
+    Encode many parts as web-suitable base64 strings concurrently on a thread pool.
+
+    Each part is encoded the same way as calling its own method: :meth:`.ImagePart.as_b64_uri`,
+    :meth:`.AudioPart.as_wav_b64_uri`, or :meth:`.BinaryFilePart.as_b64_uri`. Image encoding, compression, and base64
+    encoding all release the GIL, so this scales with the number of available cores.
+
+    :param parts: The parts to encode.
+    :param format: The format to encode image parts in.
+    :param max_workers: The maximum number of threads to use (default: the number of CPUs).
+    :returns: The encoded data URIs, in the same order as the given parts.
+    """
+    parts = list(parts)
+    unique = _unique_parts(parts)
+    if len(unique) <= 1 or max_workers == 1:
+        encoded = {id(part): _encode_part(part, format) for part in unique}
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers or _default_workers(len(unique))) as pool:
+            results = pool.map(_encode_part, unique, [format] * len(unique))
+            encoded = {id(part): result for part, result in zip(unique, results)}
+    return [encoded[id(part)] for part in parts]
+
+
+async def aencode_parts(parts: Iterable[EncodablePart], *, format: str = "png", max_workers: int = None) -> list[str]:
+    """
+    Encode many parts as web-suitable base64 strings concurrently on a thread pool, without blocking the event loop.
+
+    See :func:`encode_parts` for details.
+    """
+    parts = list(parts)
+    unique = _unique_parts(parts)
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=max_workers or _default_workers(len(unique)))
+    try:
+        results = await asyncio.gather(*(loop.run_in_executor(pool, _encode_part, part, format) for part in unique))
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    encoded = {id(part): result for part, result in zip(unique, results)}
+    return [encoded[id(part)] for part in parts]
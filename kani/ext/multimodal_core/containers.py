@@ -0,0 +1,423 @@
+"""
+Pure-Python parsers for the headers of common video containers (ISO-BMFF/MP4 and Matroska/WebM).
+
+These read only the few header bytes needed to determine a video's metadata, which is much faster than spawning
+ffprobe. Anything they do not recognize returns None, so that callers can fall back to ffprobe.
+"""
+
+import logging
+import os
+import struct
+from fractions import Fraction
+from typing import IO
+
+from .metadata import VideoMetadata
+
+log = logging.getLogger(__name__)
+
+# don't read absurdly large header boxes into memory; these are almost certainly not what we're looking for
+MAX_HEADER_SIZE = 64 * 1024 * 1024
+
+
+def parse_container_metadata(file: IO) -> VideoMetadata | None:
+    """
+    Read the metadata of the video in the given seekable file from its container headers.
+
+    Returns None if the container is not recognized or does not contain the required information (e.g. a fragmented
+    MP4 or a live WebM without a duration).
+    """
+    try:
+        file.seek(0)
+        magic = file.read(8)
+        if len(magic) < 8:
+            return None
+        if magic[:4] == b"\x1a\x45\xdf\xa3":
+            return _parse_matroska(file)
+        if magic[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"pdin"):
+            return _parse_isobmff(file)
+    except (struct.error, ValueError, EOFError, UnicodeDecodeError, OverflowError):
+        log.debug("Could not parse container headers", exc_info=True)
+    return None
+
+
+def _read_exactly(file: IO, n: int) -> bytes:
+    if n > MAX_HEADER_SIZE:
+        raise ValueError(f"Header too large ({n} bytes)")
+    data = file.read(n)
+    if len(data) < n:
+        raise EOFError
+    return data
+
+
+def _frame_rate_str(rate: Fraction | None) -> str:
+    """Format a frame rate like ffprobe does."""
+    if rate is None:
+        return "0/0"
+    return f"{rate.numerator}/{rate.denominator}"
+
+
+def _make_metadata(duration: float, streams: list[dict]) -> VideoMetadata:
+    # ffprobe reports durations at microsecond precision
+    return VideoMetadata.from_ffprobe({"format": {"duration": round(duration, 6)}, "streams": streams})
+
+
+# ==== ISO-BMFF (mp4, mov, m4v, 3gp) ====
+MP4_CODECS = {
+    "avc1": "h264",
+    "avc3": "h264",
+    "hvc1": "hevc",
+    "hev1": "hevc",
+    "av01": "av1",
+    "vp08": "vp8",
+    "vp09": "vp9",
+    "mp4v": "mpeg4",
+    "jpeg": "mjpeg",
+    "apch": "prores",
+    "apcn": "prores",
+    "apcs": "prores",
+    "apco": "prores",
+    "ap4h": "prores",
+    "mp4a": "aac",
+    "Opus": "opus",
+    "fLaC": "flac",
+    ".mp3": "mp3",
+    "ac-3": "ac3",
+    "ec-3": "eac3",
+    "alac": "alac",
+    "tx3g": "mov_text",
+    "wvtt": "webvtt",
+}
+MP4_HANDLERS = {"vide": "video", "soun": "audio", "sbtl": "subtitle", "text": "subtitle", "subt": "subtitle"}
+
+
+def _iter_boxes(data: bytes, start: int = 0, end: int = None):
+    """Iterate over the (type, payload start, payload end) of the boxes in an in-memory buffer."""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, pos)
+        header_size = 8
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", data, pos + 8)
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size or pos + size > end:
+            raise ValueError("Invalid box size")
+        yield box_type.decode("latin-1"), pos + header_size, pos + size
+        pos += size
+
+
+def _find_box(data: bytes, path: list[str], start: int = 0, end: int = None) -> tuple[int, int] | None:
+    """Find the payload bounds of the first box at the given path of nested box types."""
+    for box_type, payload_start, payload_end in _iter_boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return payload_start, payload_end
+            return _find_box(data, path[1:], payload_start, payload_end)
+    return None
+
+
+def _read_duration(data: bytes, start: int, end: int) -> tuple[int, int] | None:
+    """Read the (timescale, duration) from the payload of an mvhd or mdhd box, or None if it is too short."""
+    if start >= end:
+        return None
+    # version 1 boxes have 64-bit creation/modification times and duration
+    fmt, offset = (">IQ", 20) if data[start] == 1 else (">II", 12)
+    if start + offset + struct.calcsize(fmt) > end:
+        return None
+    return struct.unpack_from(fmt, data, start + offset)
+
+
+def _parse_isobmff(file: IO) -> VideoMetadata | None:
+    # walk the top-level boxes, seeking past the media data, until we find the moov box
+    file.seek(0, os.SEEK_END)
+    file_end = file.tell()
+    pos = 0
+    moov = None
+    while pos + 8 <= file_end:
+        file.seek(pos)
+        size, box_type = struct.unpack(">I4s", _read_exactly(file, 8))
+        header_size = 8
+        if size == 1:
+            (size,) = struct.unpack(">Q", _read_exactly(file, 8))
+            header_size = 16
+        elif size == 0:
+            size = file_end - pos
+        if size < header_size:
+            return None
+        if box_type == b"moov":
+            moov = _read_exactly(file, size - header_size)
+            break
+        pos += size
+    if moov is None:
+        return None
+
+    # movie header: overall duration
+    if (mvhd := _find_box(moov, ["mvhd"])) is None or (header := _read_duration(moov, *mvhd)) is None:
+        return None
+    timescale, duration = header
+    # fragmented mp4s have no duration in the movie header
+    if not timescale or not duration or duration == 0xFFFFFFFF:
+        return None
+
+    streams = []
+    for box_type, trak_start, trak_end in _iter_boxes(moov):
+        if box_type != "trak":
+            continue
+        stream = _parse_mp4_track(moov, trak_start, trak_end)
+        if stream is not None:
+            streams.append({"index": len(streams), **stream})
+    return _make_metadata(duration / timescale, streams)
+
+
+def _parse_mp4_track(moov: bytes, start: int, end: int) -> dict | None:
+    if (mdia := _find_box(moov, ["mdia"], start, end)) is None:
+        return None
+    hdlr = _find_box(moov, ["hdlr"], *mdia)
+    handler = moov[hdlr[0] + 8 : hdlr[0] + 12].decode("latin-1") if hdlr else None
+    stream = {"codec_type": MP4_HANDLERS.get(handler, "data")}
+
+    # sample description: codec and dimensions/audio format
+    stbl = _find_box(moov, ["minf", "stbl"], *mdia)
+    if stbl is None:
+        return stream
+    if (stsd := _find_box(moov, ["stsd"], *stbl)) is not None:
+        entry_count = struct.unpack_from(">I", moov, stsd[0] + 4)[0]
+        entry = stsd[0] + 8
+        if entry_count and entry + 8 <= stsd[1]:
+            fourcc = moov[entry + 4 : entry + 8].decode("latin-1")
+            stream["codec_name"] = MP4_CODECS.get(fourcc, fourcc.strip().lower())
+            if stream["codec_type"] == "video":
+                stream["width"], stream["height"] = struct.unpack_from(">HH", moov, entry + 32)
+            elif stream["codec_type"] == "audio":
+                channels = struct.unpack_from(">H", moov, entry + 24)[0]
+                sample_rate = struct.unpack_from(">I", moov, entry + 32)[0] >> 16
+                stream["channels"] = channels
+                stream["sample_rate"] = str(sample_rate)
+
+    # average frame rate: number of samples / media duration
+    if stream["codec_type"] == "video":
+        rate = None
+        mdhd = _find_box(moov, ["mdhd"], *mdia)
+        stts = _find_box(moov, ["stts"], *stbl)
+        if mdhd is not None and stts is not None and (header := _read_duration(moov, *mdhd)) is not None:
+            timescale, duration = header
+            (n_entries,) = struct.unpack_from(">I", moov, stts[0] + 4)
+            n_samples = sum(struct.unpack_from(f">{n_entries * 2}I", moov, stts[0] + 8)[::2])
+            if timescale and duration and n_samples:
+                rate = Fraction(n_samples * timescale, duration)
+        stream["avg_frame_rate"] = _frame_rate_str(rate)
+    return stream
+
+
+# ==== Matroska/WebM ====
+EBML_SEGMENT = 0x18538067
+EBML_SEEK_HEAD = 0x114D9B74
+EBML_SEEK = 0x4DBB
+EBML_SEEK_ID = 0x53AB
+EBML_SEEK_POSITION = 0x53AC
+EBML_INFO = 0x1549A966
+EBML_TIMESTAMP_SCALE = 0x2AD7B1
+EBML_DURATION = 0x4489
+EBML_TRACKS = 0x1654AE6B
+EBML_TRACK_ENTRY = 0xAE
+EBML_TRACK_TYPE = 0x83
+EBML_CODEC_ID = 0x86
+EBML_DEFAULT_DURATION = 0x23E383
+EBML_VIDEO = 0xE0
+EBML_PIXEL_WIDTH = 0xB0
+EBML_PIXEL_HEIGHT = 0xBA
+EBML_AUDIO = 0xE1
+EBML_SAMPLING_FREQUENCY = 0xB5
+EBML_CHANNELS = 0x9F
+EBML_CLUSTER = 0x1F43B675
+
+MATROSKA_TRACK_TYPES = {1: "video", 2: "audio", 17: "subtitle"}
+MATROSKA_CODECS = {
+    "V_VP8": "vp8",
+    "V_VP9": "vp9",
+    "V_AV1": "av1",
+    "V_MPEG4/ISO/AVC": "h264",
+    "V_MPEGH/ISO/HEVC": "hevc",
+    "V_MPEG4/ISO/SP": "mpeg4",
+    "V_MPEG4/ISO/ASP": "mpeg4",
+    "V_MJPEG": "mjpeg",
+    "V_PRORES": "prores",
+    "A_OPUS": "opus",
+    "A_VORBIS": "vorbis",
+    "A_AAC": "aac",
+    "A_FLAC": "flac",
+    "A_MPEG/L3": "mp3",
+    "A_AC3": "ac3",
+    "A_EAC3": "eac3",
+    "S_TEXT/UTF8": "subrip",
+    "S_TEXT/WEBVTT": "webvtt",
+    "S_TEXT/ASS": "ass",
+}
+
+
+def _read_vint(data: bytes, pos: int, keep_marker: bool) -> tuple[int, int, bool]:
+    """Read an EBML variable-length integer; returns (value, new position, whether all value bits are set)."""
+    if pos >= len(data):
+        raise EOFError
+    first = data[pos]
+    if first == 0:
+        raise ValueError("Invalid EBML variable-length integer")
+    length = 8 - first.bit_length() + 1
+    if pos + length > len(data):
+        raise EOFError
+    value = first if keep_marker else first & (0xFF >> length)
+    for b in data[pos + 1 : pos + length]:
+        value = (value << 8) | b
+    all_ones = value == (1 << (7 * length)) - 1
+    return value, pos + length, all_ones and not keep_marker
+
+
+def _read_element_header(file: IO) -> tuple[int, int | None, int]:
+    """Read an EBML element header from a file; returns (id, data size or None if unknown, header size)."""
+    head = file.read(12)
+    if not head:
+        raise EOFError
+    element_id, pos, _ = _read_vint(head, 0, keep_marker=True)
+    size, pos, unknown = _read_vint(head, pos, keep_marker=False)
+    file.seek(pos - len(head), os.SEEK_CUR)
+    return element_id, None if unknown else size, pos
+
+
+def _iter_elements(data: bytes, start: int = 0, end: int = None):
+    """Iterate over the (id, payload start, payload end) of the EBML elements in an in-memory buffer."""
+    end = len(data) if end is None else end
+    pos = start
+    while pos < end:
+        element_id, pos, _ = _read_vint(data, pos, keep_marker=True)
+        size, pos, _ = _read_vint(data, pos, keep_marker=False)
+        yield element_id, pos, min(pos + size, end)
+        pos += size
+
+
+def _uint(data: bytes, start: int, end: int) -> int:
+    return int.from_bytes(data[start:end], "big")
+
+
+def _float(data: bytes, start: int, end: int) -> float:
+    if end - start == 4:
+        return struct.unpack_from(">f", data, start)[0]
+    if end - start == 8:
+        return struct.unpack_from(">d", data, start)[0]
+    return 0.0
+
+
+def _parse_matroska(file: IO) -> VideoMetadata | None:
+    # skip the EBML header and find the segment
+    file.seek(0)
+    element_id, size, _ = _read_element_header(file)
+    if size is None:
+        return None
+    file.seek(size, os.SEEK_CUR)
+    element_id, segment_size, _ = _read_element_header(file)
+    if element_id != EBML_SEGMENT:
+        return None
+    segment_start = file.tell()
+    file.seek(0, os.SEEK_END)
+    segment_end = file.tell() if segment_size is None else min(segment_start + segment_size, file.tell())
+
+    # walk the top-level elements of the segment until we have the info and tracks, or reach the media data
+    # if the info or tracks come after the media data, use the seek head to find them
+    info = tracks = None
+    seek_positions = {}
+    pos = segment_start
+    while pos < segment_end and (info is None or tracks is None):
+        file.seek(pos)
+        element_id, size, header_size = _read_element_header(file)
+        if element_id == EBML_CLUSTER or size is None:
+            missing = [i for i, v in ((EBML_INFO, info), (EBML_TRACKS, tracks)) if v is None]
+            if not all(i in seek_positions for i in missing):
+                return None
+            for i in missing:
+                file.seek(segment_start + seek_positions[i])
+                found_id, found_size, _ = _read_element_header(file)
+                if found_id != i or found_size is None:
+                    return None
+                if i == EBML_INFO:
+                    info = _read_exactly(file, found_size)
+                else:
+                    tracks = _read_exactly(file, found_size)
+            break
+        if element_id == EBML_INFO:
+            info = _read_exactly(file, size)
+        elif element_id == EBML_TRACKS:
+            tracks = _read_exactly(file, size)
+        elif element_id == EBML_SEEK_HEAD:
+            seek_positions.update(_parse_seek_head(_read_exactly(file, size)))
+        pos += header_size + size
+    if info is None or tracks is None:
+        return None
+
+    # info: duration
+    timestamp_scale = 1_000_000
+    duration = None
+    for element_id, start, end in _iter_elements(info):
+        if element_id == EBML_TIMESTAMP_SCALE:
+            timestamp_scale = _uint(info, start, end)
+        elif element_id == EBML_DURATION:
+            duration = _float(info, start, end)
+    if not duration:
+        return None
+
+    # tracks
+    streams = []
+    for element_id, start, end in _iter_elements(tracks):
+        if element_id == EBML_TRACK_ENTRY:
+            streams.append({"index": len(streams), **_parse_matroska_track(tracks, start, end)})
+    return _make_metadata(duration * timestamp_scale / 1e9, streams)
+
+
+def _parse_seek_head(data: bytes) -> dict[int, int]:
+    positions = {}
+    for element_id, start, end in _iter_elements(data):
+        if element_id != EBML_SEEK:
+            continue
+        seek_id = seek_position = None
+        for child_id, child_start, child_end in _iter_elements(data, start, end):
+            if child_id == EBML_SEEK_ID:
+                seek_id = _uint(data, child_start, child_end)
+            elif child_id == EBML_SEEK_POSITION:
+                seek_position = _uint(data, child_start, child_end)
+        if seek_id is not None and seek_position is not None:
+            positions.setdefault(seek_id, seek_position)
+    return positions
+
+
+def _parse_matroska_track(data: bytes, start: int, end: int) -> dict:
+    stream = {}
+    track_type = None
+    default_duration = None
+    for element_id, child_start, child_end in _iter_elements(data, start, end):
+        if element_id == EBML_TRACK_TYPE:
+            track_type = _uint(data, child_start, child_end)
+        elif element_id == EBML_CODEC_ID:
+            codec_id = data[child_start:child_end].rstrip(b"\0").decode("ascii")
+            codec_name = MATROSKA_CODECS.get(codec_id)
+            if codec_name is None and codec_id.startswith("A_AAC"):
+                codec_name = "aac"
+            stream["codec_name"] = codec_name or codec_id.lower()
+        elif element_id == EBML_DEFAULT_DURATION:
+            default_duration = _uint(data, child_start, child_end)
+        elif element_id == EBML_VIDEO:
+            for video_id, video_start, video_end in _iter_elements(data, child_start, child_end):
+                if video_id == EBML_PIXEL_WIDTH:
+                    stream["width"] = _uint(data, video_start, video_end)
+                elif video_id == EBML_PIXEL_HEIGHT:
+                    stream["height"] = _uint(data, video_start, video_end)
+        elif element_id == EBML_AUDIO:
+            for audio_id, audio_start, audio_end in _iter_elements(data, child_start, child_end):
+                if audio_id == EBML_SAMPLING_FREQUENCY:
+                    stream["sample_rate"] = str(round(_float(data, audio_start, audio_end)))
+                elif audio_id == EBML_CHANNELS:
+                    stream["channels"] = _uint(data, audio_start, audio_end)
+    stream["codec_type"] = MATROSKA_TRACK_TYPES.get(track_type, "data")
+    if stream["codec_type"] == "video":
+        rate = Fraction(1_000_000_000, default_duration) if default_duration else None
+        stream["avg_frame_rate"] = _frame_rate_str(rate)
+    return stream
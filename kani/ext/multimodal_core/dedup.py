@@ -0,0 +1,97 @@
+"""Helpers for detecting duplicate media across a conversation."""
+
+from collections import namedtuple
+from typing import Iterable
+
+from kani import ChatMessage, MessagePart
+
+from .base import BaseMultimodalPart
+
+MediaMatch = namedtuple("MediaMatch", "part distance")
+"""
+A previously seen part that a queried part duplicates.
+
+``distance`` is 0 for an exact content match, or the Hamming distance between the perceptual hashes of two images for a
+near-duplicate match.
+"""
+
+
+class MediaIndex:
+    """
+    An index of the media parts in a conversation, used to detect exact and near-duplicate media.
+
+    Exact duplicates are detected using each part's ``content_hash``. Near-duplicate images are detected by comparing
+    each :class:`.ImagePart`'s ``perceptual_hash``. Hashes are cached on the parts themselves, so rebuilding an index
+    over the same parts on every request is cheap.
+
+    .. code-block:: python
+
+        index = MediaIndex()
+        for part in parts:
+            if match := index.add(part):
+                ...  # reference or drop ``part``, which duplicates ``match.part``
+    """
+
+    def __init__(self, *, near_threshold: int | None = 4):
+        """
+        :param near_threshold: The maximum Hamming distance (0-64) between two images' perceptual hashes for them to be
+            considered near-duplicates. Pass ``None`` to only detect exact duplicates.
+        """
+        self.near_threshold = near_threshold
+        self._by_content_hash: dict[str, MessagePart] = {}
+        self._perceptual_hashes: list[tuple[int, MessagePart]] = []
+
+    @classmethod
+    def from_messages(cls, messages: Iterable[ChatMessage], **kwargs) -> "MediaIndex":
+        """Create an index containing all media parts in the given messages, in order."""
+        index = cls(**kwargs)
+        for msg in messages:
+            for part in msg.parts:
+                index.add(part)
+        return index
+
+    def find(self, part: MessagePart) -> MediaMatch | None:
+        """
+        Find a part in the index that the given part duplicates, without adding it.
+
+        Exact matches are preferred over near-duplicate matches. Returns None if the part is not a duplicate (or is not
+        a media part).
+        """
+        content_hash = getattr(part, "content_hash", None)
+        if content_hash is None:
+            return None
+        if (existing := self._by_content_hash.get(content_hash)) is not None:
+            return MediaMatch(part=existing, distance=0)
+        if self.near_threshold is None or (phash := getattr(part, "perceptual_hash", None)) is None:
+            return None
+        best = None
+        for other_hash, other in self._perceptual_hashes:
+            distance = (phash ^ other_hash).bit_count()
+            if distance <= self.near_threshold and (best is None or distance < best.distance):
+                best = MediaMatch(part=other, distance=distance)
+        return best
+
+    def add(self, part: MessagePart) -> MediaMatch | None:
+        """
+        Add a part to the index, and return the previously seen part it duplicates (if any).
+
+        Non-media parts (e.g. strings) are ignored. Duplicates are not added to the index, so matches always refer to
+        the first occurrence of a piece of media.
+        """
+        if not isinstance(part, BaseMultimodalPart):
+            return None
+        if (match := self.find(part)) is not None:
+            return match
+        content_hash = getattr(part, "content_hash", None)
+        if content_hash is None:
+            return None
+        self._by_content_hash[content_hash] = part
+        if self.near_threshold is not None and (phash := getattr(part, "perceptual_hash", None)) is not None:
+            self._perceptual_hashes.append((phash, part))
+        return None
+
+    def __contains__(self, part: MessagePart) -> bool:
+        return self.find(part) is not None
+
+    def __len__(self):
+        return len(self._by_content_hash)
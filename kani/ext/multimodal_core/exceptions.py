@@ -1,7 +1,11 @@
 from kani.exceptions import KaniException
 
-__all__ = ("MediaFormatException",)
+__all__ = ("MediaFormatException", "FileChangedException")
 
 
 class MediaFormatException(KaniException):
     """Encountered an invalid MIME type dowloading or processing multimodal media."""
+
+
+class FileChangedException(KaniException):
+    """A file backing a lazily loaded part was changed on disk after the part was created."""
@@ -0,0 +1,36 @@
+"""The executor that the asynchronous (``a``-prefixed) part methods run their blocking work on."""
+
+import asyncio
+import functools
+from concurrent.futures import Executor
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+_executor: Executor | None = None
+
+
+def set_executor(executor: Executor | None):
+    """
+    Set the executor that asynchronous part methods (e.g. :meth:`.ImagePart.aas_b64_uri`) run their blocking work on,
+    or None to use the running event loop's default executor (default).
+
+    Both thread pools and process pools are supported. With a process pool, parts are pickled to send them to the
+    worker processes; file-backed parts send their data, so a thread pool is usually a better fit for large files.
+    The executor is not shut down by this library.
+    """
+    global _executor
+    _executor = executor
+
+
+def get_executor() -> Executor | None:
+    """Get the executor set by :func:`set_executor`, or None if the event loop's default executor is used."""
+    return _executor
+
+
+async def run_in_executor(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Run a blocking function on the configured executor without blocking the event loop, and return its result."""
+    loop = asyncio.get_running_loop()
+    if kwargs:
+        fn = functools.partial(fn, **kwargs)
+    return await loop.run_in_executor(_executor, fn, *args)
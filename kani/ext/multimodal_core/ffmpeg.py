@@ -0,0 +1,166 @@
+"""Helpers for piping multimodal parts through ffmpeg subprocesses."""
+
+import asyncio
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import weakref
+from typing import IO, Iterator
+
+from .exceptions import MediaFormatException
+from .lazyfile import LazyFile
+
+
+@contextlib.contextmanager
+def seekable_fileno(file: IO) -> Iterator[int]:
+    """
+    Yield a file descriptor positioned at the start of the given file's data, suitable for a subprocess' stdin.
+
+    If the file is on disk (including a :class:`.LazyFile`), a new file descriptor is opened so that multiple
+    subprocesses reading the same file do not share a file offset. Otherwise (e.g. for a BytesIO), the data is copied
+    to a temporary file first, since ffmpeg needs to seek in some containers (e.g. MP4s with the index at the end),
+    which it cannot do in a pipe.
+    """
+    if isinstance(file, LazyFile):
+        fileno = file.open_fileno()
+        try:
+            yield fileno
+        finally:
+            os.close(fileno)
+        return
+
+    try:
+        fileno = file.fileno()
+    except io.UnsupportedOperation:
+        with tempfile.TemporaryFile() as tmp:
+            file.seek(0)
+            shutil.copyfileobj(file, tmp)
+            tmp.flush()
+            tmp.seek(0)
+            yield tmp.fileno()
+        return
+
+    # reopen the file by name if we can
+    name = getattr(file, "name", None)
+    if isinstance(name, str):
+        try:
+            new_fileno = os.open(name, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        except OSError:
+            pass
+        else:
+            try:
+                if os.path.samestat(os.fstat(new_fileno), os.fstat(fileno)):
+                    yield new_fileno
+                    return
+            finally:
+                os.close(new_fileno)
+
+    # otherwise, share the file descriptor
+    file.seek(0)
+    yield fileno
+
+
+@contextlib.contextmanager
+def popen_with_input(cmd: list[str], file: IO, **kwargs) -> Iterator[subprocess.Popen]:
+    """
+    Start a subprocess that reads the given file-like object from its stdin, and clean it up afterwards.
+
+    Keyword arguments are passed to :class:`subprocess.Popen`.
+    """
+    with seekable_fileno(file) as fileno:
+        proc = subprocess.Popen(cmd, stdin=fileno, **kwargs)
+        try:
+            yield proc
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            for stream in (proc.stdout, proc.stderr):
+                if stream is not None:
+                    stream.close()
+            proc.wait()
+
+
+def check_returncode(proc: subprocess.Popen | subprocess.CompletedProcess, stderr: bytes | str = b""):
+    """Raise a :exc:`.MediaFormatException` if the given finished process exited with an error."""
+    if proc.returncode:
+        if isinstance(stderr, bytes):
+            stderr = stderr.decode(errors="replace")
+        name = proc.args[0] if hasattr(proc, "args") else "ffmpeg"
+        raise MediaFormatException(f"{name} exited with code {proc.returncode}: {stderr.strip()[-1000:]}")
+
+
+# ==== bounded worker pool ====
+# ffmpeg encoders are multithreaded already, so running many at once just thrashes the CPU
+_max_concurrency = 2
+_thread_semaphore = threading.BoundedSemaphore(_max_concurrency)
+_async_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def set_ffmpeg_concurrency(limit: int):
+    """
+    Set the maximum number of heavy ffmpeg jobs (e.g. :meth:`.VideoPart.transcode`) that may run at once (default 2).
+
+    The limit applies separately to synchronous calls (across all threads) and to asynchronous calls in each event
+    loop. Jobs that are already running are not affected.
+    """
+    global _max_concurrency, _thread_semaphore
+    if limit < 1:
+        raise ValueError("The ffmpeg concurrency limit must be at least 1.")
+    _max_concurrency = limit
+    _thread_semaphore = threading.BoundedSemaphore(limit)
+    _async_semaphores.clear()
+
+
+def _get_async_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    if (semaphore := _async_semaphores.get(loop)) is None:
+        semaphore = _async_semaphores[loop] = asyncio.Semaphore(_max_concurrency)
+    return semaphore
+
+
+def run_ffmpeg(cmd: list[str], file: IO):
+    """Run an ffmpeg command reading the given file from stdin, waiting for a slot in the worker pool."""
+    with _thread_semaphore, seekable_fileno(file) as fileno:
+        result = subprocess.run(cmd, stdin=fileno, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    check_returncode(result, result.stderr)
+
+
+def pipe_ffmpeg(cmd: list[str], data: bytes) -> bytes:
+    """
+    Run an ffmpeg command with the given data on stdin and return its stdout, waiting for a slot in the worker pool.
+    """
+    with _thread_semaphore:
+        result = subprocess.run(cmd, input=data, capture_output=True)
+    check_returncode(result, result.stderr)
+    return result.stdout
+
+
+async def arun_ffmpeg(cmd: list[str], file: IO):
+    """Run an ffmpeg command reading the given file from stdin as an async subprocess in the worker pool."""
+    async with _get_async_semaphore():
+        # getting a file descriptor may copy the whole file to a temporary file, so do it off the event loop
+        stack = contextlib.ExitStack()
+        enter = asyncio.ensure_future(asyncio.to_thread(stack.enter_context, seekable_fileno(file)))
+        try:
+            fileno = await asyncio.shield(enter)
+        except BaseException:
+            # the copy can't be interrupted, so clean it up once it is done
+            enter.add_done_callback(lambda _: stack.close())
+            raise
+        with stack:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdin=fileno, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+            )
+            try:
+                _, stderr = await proc.communicate()
+            except asyncio.CancelledError:
+                proc.kill()
+                await proc.wait()
+                raise
+    check_returncode(proc, stderr)
@@ -1,18 +1,23 @@
 import base64
+import functools
+import hashlib
 import io
 import mimetypes
-import re
-from typing import IO, TYPE_CHECKING
+import pickle
+from typing import IO, TYPE_CHECKING, ClassVar, Hashable, Literal, Sequence
 
-import numpy as np
 from PIL import Image
 from kani.utils.typing import PathLike
 from pydantic import model_serializer, model_validator
 
+from . import memory
 from .base import BaseMultimodalPart
-from .utils import download_media
+from .executor import run_in_executor
+from .instrumentation import span
+from .utils import download_media, read_data_uri, spool_chunks
 
 if TYPE_CHECKING:
+    import numpy as np
     import torch
 
 
@@ -30,13 +35,16 @@ class ImagePart(BaseMultimodalPart, arbitrary_types_allowed=True):
     image: Image.Image
     """The PIL Image object containing the referenced image."""
 
+    _payload_properties: ClassVar[tuple[str, ...]] = ("content_hash", "perceptual_hash")
+
     # ==== constructors ====
     @classmethod
     def from_file(cls, fp: PathLike | IO, **kwargs):
         """
         Create an ImagePart from a local image file. The file format will be automatically detected.
         """
-        return cls(image=Image.open(fp), **kwargs)
+        with span("from_file", cls.__name__):
+            return cls(image=Image.open(fp), **kwargs)
 
     @classmethod
     def from_bytes(cls, data: bytes, **kwargs):
@@ -49,13 +57,20 @@ class ImagePart(BaseMultimodalPart, arbitrary_types_allowed=True):
         return cls.from_bytes(base64.b64decode(data), **kwargs)
 
     @classmethod
-    def from_b64_uri(cls, data: str):
-        if not (match := re.match("data:(image/.+);base64,(.*)", data)):
+    def from_b64_uri(cls, data: str | bytes | IO, **kwargs):
+        """
+        Create an ImagePart from a base64 data URI with an image MIME type (``data:image/*;base64,...``).
+
+        The URI can be passed as a string, bytes, or a text or binary file-like object to read it from. Its data is
+        decoded in chunks, so decoding a large URI doesn't make any full copies of it.
+        """
+        try:
+            uri = read_data_uri(data)
+        except ValueError:
+            uri = None
+        if uri is None or not uri.mime.startswith("image/"):
             raise ValueError("Data URI must begin with an image MIME type (`data:image/*;base64,`)")
-        mime = match[1]
-        extensions = [e.removeprefix(".") for e in mimetypes.guess_all_extensions(mime, strict=False)]
-        img_bytes = base64.b64decode(match[2])
-        return cls.from_bytes(img_bytes, formats=extensions or None)
+        return cls(image=Image.open(spool_chunks(uri.chunks, max_size=None)), **kwargs)
 
     @classmethod
     async def from_url(cls, url: str, **kwargs):
@@ -74,9 +89,13 @@ class ImagePart(BaseMultimodalPart, arbitrary_types_allowed=True):
     # ==== representations ====
     def as_bytes(self, format: str = "png") -> bytes:
         """Return the raw image data in the given format."""
-        f = io.BytesIO()
-        self.image.save(f, format=format)
-        return f.getvalue()
+        memory.touch(self)
+        with span("as_bytes", type(self).__name__) as s:
+            f = io.BytesIO()
+            self.image.save(f, format=format)
+            data = f.getvalue()
+            s.bytes_out = len(data)
+        return data
 
     def as_b64(self, format: str = "png") -> str:
         """
@@ -89,11 +108,14 @@ class ImagePart(BaseMultimodalPart, arbitrary_types_allowed=True):
 
     def as_b64_uri(self, format: str = "png") -> str:
         """Get the binary image data encoded in a web-suitable base64 string."""
-        format = format.lower()
-        mime = Image.MIME.get(format, mimetypes.types_map.get(f".{format}", f"image/{format}"))
-        return f"data:{mime};base64,{self.as_b64(format)}"
+        with span("as_b64_uri", type(self).__name__) as s:
+            format = format.lower()
+            mime = Image.MIME.get(format, mimetypes.types_map.get(f".{format}", f"image/{format}"))
+            uri = f"data:{mime};base64,{self.as_b64(format)}"
+            s.bytes_out = len(uri)
+        return uri
 
-    def as_ndarray(self) -> np.ndarray:
+    def as_ndarray(self) -> "np.ndarray":
         """
         Get the pixel-wise image data as a NumPy array (h*w*c).
 
@@ -102,8 +124,88 @@ class ImagePart(BaseMultimodalPart, arbitrary_types_allowed=True):
             Note that this array is in (height, width, channels) dimensionality, unlike :meth:`as_tensor` which
             return a tensor in (channels, height, width) dimensionality.
         """
+        import numpy as np
+
+        memory.touch(self)
         return np.asarray(self.image)
 
+    def to_array(
+        self,
+        size: tuple[int, int] = None,
+        *,
+        mode: str = "RGB",
+        layout: Literal["CHW", "HWC"] = "CHW",
+        dtype: "np.typing.DTypeLike" = "float32",
+        mean: float | Sequence[float] = None,
+        std: float | Sequence[float] = None,
+        out: "np.ndarray" = None,
+        resample: Image.Resampling = Image.Resampling.BICUBIC,
+    ) -> "np.ndarray":
+        """
+        Get the pixel-wise image data as a NumPy array ready for model input, optionally resized and normalized.
+
+        Conversion, scaling, normalization, and transposition are fused into as few passes as possible, writing the
+        result directly into the output array. This does not require PyTorch; the result can be wrapped as a tensor
+        with ``torch.from_numpy``.
+
+        For floating-point dtypes, 8-bit pixel values are first rescaled to [0, 1], then normalized as
+        ``(x - mean) / std`` per channel. For integer dtypes, the pixel values are copied as-is.
+
+        :param size: The size to resize the image to, in pixels (width, height). If not set, keeps the original size.
+        :param mode: The Pillow mode to convert the image to (e.g. ``"RGB"`` or ``"L"``).
+        :param layout: Whether to return the array in (channels, height, width) or (height, width, channels)
+            dimensionality. Single-channel images still have a channel dimension of size 1.
+        :param dtype: The dtype of the returned array. Ignored if *out* is passed.
+        :param mean: The mean to subtract, either a single value or one value per channel.
+        :param std: The standard deviation to divide by, either a single value or one value per channel.
+        :param out: A preallocated array to write the result into. Its shape must match the output shape.
+        :param resample: The Pillow resampling filter to use when resizing.
+        """
+        import numpy as np
+
+        if layout not in ("CHW", "HWC"):
+            raise ValueError(f"layout must be 'CHW' or 'HWC', got {layout!r}")
+        memory.touch(self)
+
+        img = self.image
+        if img.mode != mode:
+            img = img.convert(mode)
+        if size is not None and img.size != tuple(size):
+            img = img.resize(size, resample)
+
+        pixels = np.asarray(img)
+        if pixels.ndim == 2:
+            pixels = pixels[:, :, np.newaxis]
+        # this is a view; the ufuncs below will handle the transposition while writing to the output
+        src = pixels.transpose(2, 0, 1) if layout == "CHW" else pixels
+        n_channels = pixels.shape[2]
+
+        if out is None:
+            out = np.empty(src.shape, dtype=dtype)
+        elif out.shape != src.shape:
+            raise ValueError(f"Expected output array of shape {src.shape}, but got {out.shape}")
+
+        # integers: just copy (with a cast)
+        if not np.issubdtype(out.dtype, np.floating):
+            if mean is not None or std is not None:
+                raise ValueError("mean and std can only be used with floating-point dtypes")
+            np.copyto(out, src, casting="unsafe")
+            return out
+
+        # floats: fold rescaling and normalization into a single multiply-add:
+        # (x * rescale - mean) / std = x * (rescale / std) + (-mean / std)
+        rescale = 1 / 255 if pixels.dtype == np.uint8 else 1
+        mean = np.broadcast_to(np.asarray(0 if mean is None else mean, dtype=np.float64), (n_channels,))
+        std = np.broadcast_to(np.asarray(1 if std is None else std, dtype=np.float64), (n_channels,))
+        scale = (rescale / std).astype(out.dtype)
+        bias = (-mean / std).astype(out.dtype)
+        if layout == "CHW":
+            scale = scale[:, np.newaxis, np.newaxis]
+            bias = bias[:, np.newaxis, np.newaxis]
+        np.multiply(src, scale, out=out, casting="unsafe")
+        np.add(out, bias, out=out)
+        return out
+
     def as_tensor(self) -> "torch.Tensor":
         """
         Get the pixel-wises image data as a PyTorch tensor (c*h*w).
@@ -121,9 +223,68 @@ class ImagePart(BaseMultimodalPart, arbitrary_types_allowed=True):
                 " to use `.as_tensor`."
             ) from None
 
+        memory.touch(self)
         return pil_to_tensor(self.image)
 
+    # --- async ---
+    async def aas_bytes(self, format: str = "png") -> bytes:
+        """Asynchronous version of :meth:`as_bytes`, run on the configured executor (see :func:`.set_executor`)."""
+        return await run_in_executor(self.as_bytes, format)
+
+    async def aas_b64(self, format: str = "png") -> str:
+        """Asynchronous version of :meth:`as_b64`, run on the configured executor (see :func:`.set_executor`)."""
+        return await run_in_executor(self.as_b64, format)
+
+    async def aas_b64_uri(self, format: str = "png") -> str:
+        """Asynchronous version of :meth:`as_b64_uri`, run on the configured executor (see :func:`.set_executor`)."""
+        return await run_in_executor(self.as_b64_uri, format)
+
+    async def ato_array(self, size: tuple[int, int] = None, **kwargs) -> "np.ndarray":
+        """
+        Asynchronous version of :meth:`to_array`, run on the configured executor (see :func:`.set_executor`).
+
+        Keyword arguments are passed to :meth:`to_array`.
+        """
+        return await run_in_executor(self.to_array, size, **kwargs)
+
+    async def aas_tensor(self) -> "torch.Tensor":
+        """Asynchronous version of :meth:`as_tensor`, run on the configured executor (see :func:`.set_executor`)."""
+        return await run_in_executor(self.as_tensor)
+
     # ==== helpers ====
+    @functools.cached_property
+    def content_hash(self) -> str:
+        """
+        A hex digest of the image's pixel data, suitable for detecting exact duplicates.
+
+        The hash covers the decoded pixels, mode, and size of the image (rather than a specific file encoding), so the
+        same image loaded from a PNG and from a lossless re-encode of it will hash identically. It is computed the
+        first time it is accessed and cached on the part afterwards.
+        """
+        the_hash = hashlib.blake2b(digest_size=16)
+        the_hash.update(f"{self.image.mode}:{self.image.width}x{self.image.height}:".encode())
+        the_hash.update(self.image.tobytes())
+        return the_hash.hexdigest()
+
+    @functools.cached_property
+    def perceptual_hash(self) -> int:
+        """
+        A 64-bit difference hash (dHash) of the image, suitable for detecting near-duplicate images.
+
+        Visually similar images (e.g. rescaled or re-compressed copies) will have hashes with a small Hamming distance
+        (see :meth:`hash_distance`). It is computed the first time it is accessed and cached on the part afterwards.
+        """
+        import numpy as np
+
+        thumbnail = self.image.convert("L").resize((9, 8), Image.Resampling.BOX)
+        pixels = np.asarray(thumbnail, dtype=np.int16)
+        bits = pixels[:, 1:] > pixels[:, :-1]
+        return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+    def hash_distance(self, other: "ImagePart") -> int:
+        """The Hamming distance between this image's and another image's :attr:`perceptual_hash` (0-64)."""
+        return (self.perceptual_hash ^ other.perceptual_hash).bit_count()
+
     @property
     def size(self) -> tuple[int, int]:
         """The size of the image, in pixels (width, height)."""
@@ -131,17 +292,84 @@ class ImagePart(BaseMultimodalPart, arbitrary_types_allowed=True):
 
     @property
     def mime(self) -> str:
-        """The MIME filetype of the image."""
+        """
+        The MIME filetype of the image.
+
+        Images that were not loaded from a file (e.g. created in memory) have no format, and are reported as PNG, the
+        default format of :meth:`as_bytes`.
+        """
         img_format = self.image.format
+        if img_format is None:
+            return "image/png"
         return Image.MIME.get(
             img_format, mimetypes.types_map.get(f".{img_format.lower()}", f"image/{img_format.lower()}")
         )
 
+    # ==== memory management ====
+    def model_post_init(self, context):
+        # only the current frame of an image survives spilling, so animations stay in memory
+        if getattr(self.image, "n_frames", 1) == 1:
+            bytes_per_band = 4 if self.image.mode in ("I", "F") else 1
+            memory.track(self, self.image.width * self.image.height * len(self.image.getbands()) * bytes_per_band)
+
+    def _spill_payload(self, f: IO[bytes]) -> bool:
+        if getattr(self.image, "n_frames", 1) > 1:
+            # animations are only tracked for their memoized JSON payload
+            self._drop_memoized_data()
+            return False
+        image = self.__dict__.pop("image")
+        self._drop_memoized_data()
+        pickle.dump((image.format, image), f, protocol=pickle.HIGHEST_PROTOCOL)
+        return True
+
+    def _payload_fingerprint(self) -> Hashable:
+        # resizing the image in place (e.g. with thumbnail) or seeking to another frame is detected, but drawing on it
+        # is not
+        image = self.image
+        return image.size, image.mode, image.tell() if getattr(image, "n_frames", 1) > 1 else 0
+
+    def _restore_payload(self, f: IO[bytes]):
+        img_format, image = pickle.load(f)
+        image.format = img_format
+        self.__dict__["image"] = image
+
+    def __getattr__(self, item):
+        # the image is removed from the instance dict when spilled to disk
+        if item == "image":
+            return memory.restore(self, item)
+        return super().__getattr__(item)
+
+    # ==== pickling ====
+    # PIL doesn't pickle an image's format, which we need for its MIME type
+    def __getstate__(self):
+        state = super().__getstate__()
+        image = self.image
+        state["__dict__"] = {**state["__dict__"], "image": image}
+        state["image_format"] = image.format
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.image.format = state.get("image_format")
+        self.model_post_init(None)
+
     # ==== serdes ====
-    @model_serializer(when_used="json")
-    def _serialize_imagepart(self) -> dict[str, str]:
+    @model_serializer(mode="wrap")
+    def _serialize_imagepart(self, nxt, info):
         """When we serialize to JSON, save the data as a URI"""
-        return {"img_data": self.as_b64_uri()}
+        if not info.mode_is_json():
+            # make sure a spilled image is loaded before the default serializer reads the fields
+            if "image" not in self.__dict__:
+                memory.restore(self, "image")
+            return nxt(self)
+        with span("serialize", type(self).__name__) as s:
+            if (payload := self._get_json_payload()) is None:
+                payload = {"img_data": self.as_b64_uri()}
+                self._set_json_payload(payload)
+            else:
+                s.cache_hit = True
+            s.bytes_out = len(payload["img_data"])
+        return payload | self._get_typekey_dict()
 
     # noinspection PyNestedDecorators
     @model_validator(mode="wrap")
@@ -149,9 +377,14 @@ class ImagePart(BaseMultimodalPart, arbitrary_types_allowed=True):
     def _validate_imagepart(cls, v, nxt):
         """If the value is the URI we saved, try loading it that way"""
         if isinstance(v, dict) and "img_data" in v:
-            return cls.from_b64_uri(v["img_data"])
+            with span("deserialize", cls.__name__, bytes_in=len(v["img_data"])):
+                part = cls.from_b64_uri(v["img_data"])
+            part._set_json_payload({"img_data": v["img_data"]})
+            return part
         return nxt(v)
 
     # ==== lifecycle ====
     def __del__(self):
-        self.image.close()
+        # don't load a spilled image just to close it
+        if self._release_payload() and (image := self.__dict__.get("image")) is not None:
+            image.close()
@@ -0,0 +1,207 @@
+"""
+Lightweight instrumentation hooks for media conversions and downloads.
+
+By default, no collector is installed and instrumentation costs a single global lookup per operation. Install a
+:class:`MediaCollector` with :func:`set_collector` to receive a :class:`MediaEvent` for each instrumented operation.
+
+Operations can be nested: for example, serializing a :class:`.BinaryFilePart` reads its data with ``as_bytes``, which
+emits its own event before the ``serialize`` event. To total bytes or durations without counting them twice, only sum
+the events with ``depth == 0``.
+"""
+
+import abc
+import contextvars
+import logging
+import time
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+MediaEvent = namedtuple(
+    "MediaEvent",
+    "operation part_type bytes_in bytes_out duration cache_hit error depth",
+    defaults=(None, None, None, 0),
+)
+"""
+A record of a single instrumented media operation.
+
+- **operation** (*str*): The name of the operation (e.g. ``"as_bytes"``, ``"resample"``, ``"download"``).
+- **part_type** (*str | None*): The name of the part class the operation was performed on, if any.
+- **bytes_in** (*int | None*): The size of the operation's input, in bytes, if known.
+- **bytes_out** (*int | None*): The size of the operation's output, in bytes, if known.
+- **duration** (*float*): The wall-clock duration of the operation, in seconds.
+- **cache_hit** (*bool | None*): Whether the result was served from a cache, for operations that use one.
+- **error** (*str | None*): The name of the exception raised by the operation, if it failed.
+- **depth** (*int*): The number of instrumented operations this one ran inside of (e.g. 1 for an ``as_bytes`` call
+  made while serializing a part), or 0 for a top-level operation. The bytes and durations of nested operations are
+  included in their parents', so only top-level events should be summed.
+"""
+
+
+class MediaCollector(abc.ABC):
+    """
+    Base class for instrumentation collectors.
+
+    Subclasses must implement :meth:`record`, which is called synchronously at the end of every instrumented
+    operation in whichever thread ran it, so it should be fast and thread-safe (e.g. by appending to a queue).
+    """
+
+    @abc.abstractmethod
+    def record(self, event: MediaEvent):
+        """Handle a finished media operation."""
+
+
+class LoggingCollector(MediaCollector):
+    """A collector that logs every media operation to a :mod:`logging` logger."""
+
+    def __init__(self, logger: logging.Logger = log, level: int = logging.DEBUG):
+        """
+        :param logger: The logger to log to (default ``kani.ext.multimodal_core.instrumentation``).
+        :param level: The level to log events at (default DEBUG).
+        """
+        self.logger = logger
+        self.level = level
+
+    def record(self, event: MediaEvent):
+        self.logger.log(
+            self.level,
+            f"{event.part_type or 'media'}.{event.operation} took {event.duration * 1000:.2f}ms"
+            f" (in={event.bytes_in}, out={event.bytes_out}, cache_hit={event.cache_hit}, error={event.error},"
+            f" depth={event.depth})",
+        )
+
+
+class OpenTelemetryCollector(MediaCollector):
+    """
+    A collector that exports each media operation as an OpenTelemetry span.
+
+    Spans are created with the operation's real start and end times, as children of whichever span is current in the
+    thread that ran the operation. Requires the ``opentelemetry-api`` package.
+    """
+
+    def __init__(self, tracer=None):
+        """
+        :param tracer: The OpenTelemetry tracer to create spans with. Defaults to a tracer from the global tracer
+            provider.
+        """
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise ImportError(
+                "OpenTelemetry is not installed in your environment. Please install `opentelemetry-api` to use the"
+                " OpenTelemetryCollector."
+            ) from None
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer("kani.ext.multimodal_core")
+
+    def record(self, event: MediaEvent):
+        end_time = time.time_ns()
+        span = self.tracer.start_span(
+            f"{event.part_type or 'media'}.{event.operation}", start_time=end_time - int(event.duration * 1e9)
+        )
+        attributes = {
+            "media.operation": event.operation,
+            "media.part_type": event.part_type,
+            "media.bytes_in": event.bytes_in,
+            "media.bytes_out": event.bytes_out,
+            "media.cache_hit": event.cache_hit,
+            "media.depth": event.depth,
+        }
+        span.set_attributes({k: v for k, v in attributes.items() if v is not None})
+        if event.error is not None:
+            span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, event.error))
+        span.end(end_time=end_time)
+
+
+# ==== spans ====
+_collector: MediaCollector | None = None
+# the number of spans open in the current context, so that nested operations can be told apart
+_depth: contextvars.ContextVar[int] = contextvars.ContextVar("_depth", default=0)
+
+
+def set_collector(collector: MediaCollector | None):
+    """Install a collector to receive instrumentation events for all media operations, or None to disable it."""
+    global _collector
+    _collector = collector
+
+
+def get_collector() -> MediaCollector | None:
+    """Get the currently installed collector, or None if instrumentation is disabled."""
+    return _collector
+
+
+class _Span:
+    """Times a media operation and reports it to the collector when it exits."""
+
+    __slots__ = ("collector", "operation", "part_type", "bytes_in", "bytes_out", "cache_hit", "_start", "_token")
+
+    def __init__(self, collector: MediaCollector, operation: str, part_type: str | None, bytes_in: int | None):
+        self.collector = collector
+        self.operation = operation
+        self.part_type = part_type
+        self.bytes_in = bytes_in
+        self.bytes_out = None
+        self.cache_hit = None
+
+    def __bool__(self):
+        return True
+
+    def __enter__(self):
+        self._token = _depth.set(_depth.get() + 1)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        duration = time.perf_counter() - self._start
+        _depth.reset(self._token)
+        event = MediaEvent(
+            operation=self.operation,
+            part_type=self.part_type,
+            bytes_in=self.bytes_in,
+            bytes_out=self.bytes_out,
+            duration=duration,
+            cache_hit=self.cache_hit,
+            error=exc_type.__name__ if exc_type is not None else None,
+            depth=_depth.get(),
+        )
+        try:
+            self.collector.record(event)
+        except Exception:
+            log.exception("Exception in media instrumentation collector")
+
+
+class _NullSpan:
+    """
+    A span that does nothing, used when no collector is installed.
+
+    It is falsy, so that callers can skip computing expensive attributes with ``if span: ...``. Attribute writes go to
+    a single shared instance and are never read.
+    """
+
+    __slots__ = ("bytes_in", "bytes_out", "cache_hit")
+
+    def __bool__(self):
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return None
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(operation: str, part_type: str = None, bytes_in: int = None) -> _Span | _NullSpan:
+    """
+    Instrument a media operation, as a context manager. Set ``bytes_out`` or ``cache_hit`` on the returned span to
+    report them::
+
+        with span("as_bytes", type(self).__name__) as s:
+            data = ...
+            s.bytes_out = len(data)
+    """
+    if _collector is None:
+        return _NULL_SPAN
+    return _Span(_collector, operation, part_type, bytes_in)
@@ -0,0 +1,194 @@
+"""
+A read-only file-like object that stores a path instead of holding an open file, for parts created with
+``from_file(..., lazy=True)``.
+
+The file is opened only while it is being read. Open handles are kept in a pool shared by all lazy files, so that
+repeated reads of recently used files don't reopen them, while the total number of open file descriptors stays bounded
+(see :func:`set_max_open_files`).
+"""
+
+import contextlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterator
+
+from kani.utils.typing import PathLike
+
+from .exceptions import FileChangedException
+
+
+class LazyFile(io.RawIOBase):
+    """
+    A read-only binary file backed by a path on disk, which is opened only while it is being read.
+
+    The file's size and modification time are recorded when the LazyFile is created. If the file is later changed on
+    disk, reading it raises a :exc:`.FileChangedException` rather than silently returning different data.
+    """
+
+    def __init__(self, path: PathLike):
+        super().__init__()
+        self.path = os.path.abspath(os.fspath(path))
+        stat = os.stat(self.path)
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self._pos = 0
+        # reads of one file share its pooled handle's offset
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.path
+
+    def __repr__(self):
+        return f"<{type(self).__name__} path={self.path!r} size={self.size}>"
+
+    # ==== io ====
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        self._checkClosed()
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        self._checkClosed()
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence ({whence!r})")
+        if pos < 0:
+            raise ValueError(f"Negative seek position {pos}")
+        self._pos = pos
+        return pos
+
+    def readinto(self, buffer) -> int:
+        self._checkClosed()
+        with self._lock, _pool.handle(self) as f:
+            f.seek(self._pos)
+            n = f.readinto(buffer)
+        self._pos += n
+        return n
+
+    def readall(self) -> bytes:
+        self._checkClosed()
+        with self._lock, _pool.handle(self) as f:
+            f.seek(self._pos)
+            data = f.read()
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        if not self.closed:
+            _pool.discard(self)
+        super().close()
+
+    # ==== helpers ====
+    def open_fileno(self) -> int:
+        """
+        Open and return a new file descriptor for the file (e.g. for a subprocess' stdin), positioned at the start.
+        The caller is responsible for closing it.
+        """
+        self._checkClosed()
+        fileno = os.open(self.path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            self._validate(os.fstat(fileno))
+        except BaseException:
+            os.close(fileno)
+            raise
+        return fileno
+
+    def _validate(self, stat: os.stat_result):
+        if stat.st_size != self.size or stat.st_mtime_ns != self.mtime_ns:
+            raise FileChangedException(f"The file at {self.path!r} has changed since it was loaded.")
+
+    # ==== pickling ====
+    # the path is sent instead of the data, so this is only valid on the same machine
+    def __getstate__(self):
+        self._checkClosed()
+        return {"path": self.path, "size": self.size, "mtime_ns": self.mtime_ns, "pos": self._pos}
+
+    def __setstate__(self, state):
+        super().__init__()
+        self.path = state["path"]
+        self.size = state["size"]
+        self.mtime_ns = state["mtime_ns"]
+        self._pos = state["pos"]
+        self._lock = threading.Lock()
+
+
+class _HandlePool:
+    """A bounded pool of open handles to LazyFiles, closing the least recently used handles when it is full."""
+
+    def __init__(self, max_handles: int):
+        self.max_handles = max_handles
+        self._lock = threading.Lock()
+        # id(LazyFile) -> open handle, from least to most recently used
+        self._handles: "OrderedDict[int, io.FileIO]" = OrderedDict()
+        # ids of LazyFiles whose handles are being read from, which must not be closed
+        self._in_use: set[int] = set()
+
+    @contextlib.contextmanager
+    def handle(self, file: LazyFile) -> Iterator[io.FileIO]:
+        key = id(file)
+        with self._lock:
+            f = self._handles.get(key)
+            if f is None:
+                f = io.FileIO(file.path, "r")
+                try:
+                    file._validate(os.fstat(f.fileno()))
+                except BaseException:
+                    f.close()
+                    raise
+                self._handles[key] = f
+            else:
+                # a pooled handle keeps referring to the file we validated even if the path is replaced, but the file
+                # may still have been modified in place
+                file._validate(os.fstat(f.fileno()))
+                self._handles.move_to_end(key)
+            self._in_use.add(key)
+        try:
+            yield f
+        finally:
+            with self._lock:
+                self._in_use.discard(key)
+                self._evict()
+
+    def discard(self, file: LazyFile):
+        """Close the pooled handle of a LazyFile that is being closed, if any."""
+        with self._lock:
+            if (f := self._handles.pop(id(file), None)) is not None:
+                f.close()
+
+    def _evict(self):
+        """Close the least recently used idle handles until the pool is within its limit. Must hold the lock."""
+        for key in list(self._handles):
+            if len(self._handles) <= self.max_handles:
+                break
+            if key not in self._in_use:
+                self._handles.pop(key).close()
+
+
+_pool = _HandlePool(max_handles=64)
+
+
+def set_max_open_files(limit: int):
+    """
+    Set the maximum number of file handles that lazy parts (created with ``from_file(..., lazy=True)``) keep open
+    between reads (default 64). Set it to 0 to close every file as soon as it has been read.
+
+    A handle that is being read from is never closed, so more files may be open briefly while many are read at once.
+    """
+    if limit < 0:
+        raise ValueError("The open file limit must be non-negative.")
+    with _pool._lock:
+        _pool.max_handles = limit
+        _pool._evict()
@@ -0,0 +1,259 @@
+"""
+A process-wide registry of the media payloads held in memory by live parts, which can spill the least recently used
+payloads to disk when a memory budget is exceeded.
+
+Parts register themselves when they are created (see :func:`track`). Parts that can be spilled implement two methods:
+
+- ``_spill_payload(f)``, which writes the part's payload to the given binary file and drops it (and its memoized JSON
+  payload) from memory. It returns whether the payload needs to be restored from the file later.
+- ``_restore_payload(f)``, which reads the payload back from the file written by ``_spill_payload``.
+
+Parts also report the size of the data they memoize (see :func:`memoize`), which counts towards the budget while one
+is set and is dropped when they are spilled.
+
+Spilled payloads are restored transparently the next time they are accessed (see :func:`restore`).
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict, namedtuple
+
+from .instrumentation import span
+
+log = logging.getLogger(__name__)
+
+MemoryUsage = namedtuple(
+    "MemoryUsage", "budget bytes_in_memory parts_in_memory bytes_spilled parts_spilled spills restores"
+)
+"""
+A snapshot of the memory held by live media parts.
+
+- **budget** (*int | None*): The configured memory budget, in bytes, or None if there is no budget.
+- **bytes_in_memory** (*int*): The total size of the payloads held in memory by live parts (and their memoized JSON
+  payloads, while a budget is set), in bytes.
+- **parts_in_memory** (*int*): The number of live parts whose payloads or memoized data are held in memory.
+- **bytes_spilled** (*int*): The total size of the payloads of live parts currently spilled to disk, in bytes.
+- **parts_spilled** (*int*): The number of live parts whose payloads are currently spilled to disk.
+- **spills** (*int*): The total number of times a payload has been spilled to disk.
+- **restores** (*int*): The total number of times a spilled payload has been loaded back into memory.
+"""
+
+
+class _Entry:
+    __slots__ = ("ref", "nbytes", "memo_nbytes", "spill_path")
+
+    def __init__(self, ref: weakref.ref, nbytes: int):
+        self.ref = ref
+        self.nbytes = nbytes
+        self.memo_nbytes = 0
+        self.spill_path = None
+
+
+_lock = threading.RLock()
+_budget: int | None = None
+# parts with payloads in memory, keyed by id, from least to most recently used
+_in_memory: "OrderedDict[int, _Entry]" = OrderedDict()
+# parts with payloads spilled to disk that can be restored, keyed by id
+_spilled: dict[int, _Entry] = {}
+# ids of the parts that have a finalizer registered to untrack them, so that each part only registers one
+_finalized: set[int] = set()
+_bytes_in_memory = 0
+_bytes_spilled = 0
+_n_spills = 0
+_n_restores = 0
+
+
+def set_memory_budget(max_bytes: int | None):
+    """
+    Set the maximum number of bytes that live ImageParts, AudioParts, and in-memory BinaryFileParts may hold in memory,
+    or None to disable the budget (default).
+
+    When the budget is exceeded, the payloads of the least recently used parts are spilled to temporary files, and are
+    transparently loaded back into memory the next time they are accessed. The serialized JSON that parts memoize
+    counts towards the budget too, and is dropped when they are spilled. In-memory BinaryFileParts (e.g. created with
+    :meth:`.BinaryFilePart.from_bytes`) are moved to a temporary file permanently instead. A single part larger than
+    the budget is kept in memory while it is in use.
+
+    Setting a lower budget spills payloads immediately if needed.
+    """
+    global _budget
+    if max_bytes is not None and max_bytes < 0:
+        raise ValueError("The memory budget must be non-negative.")
+    with _lock:
+        _budget = max_bytes
+        _enforce_budget()
+
+
+def get_memory_usage() -> MemoryUsage:
+    """Get a snapshot of the memory held by live media parts, and how much has been spilled to disk."""
+    with _lock:
+        return MemoryUsage(
+            budget=_budget,
+            bytes_in_memory=_bytes_in_memory,
+            parts_in_memory=len(_in_memory),
+            bytes_spilled=_bytes_spilled,
+            parts_spilled=len(_spilled),
+            spills=_n_spills,
+            restores=_n_restores,
+        )
+
+
+# ==== part hooks ====
+def track(part, nbytes: int):
+    """Register a newly created part holding *nbytes* of payload in memory, spilling other parts if needed."""
+    global _bytes_in_memory
+    key = id(part)
+    with _lock:
+        _in_memory[key] = _Entry(weakref.ref(part), nbytes)
+        _bytes_in_memory += nbytes
+        _finalize_once(part, key)
+        _enforce_budget(keep=key)
+
+
+def memoize(part, nbytes: int):
+    """
+    Set the size of the data memoized by a part (e.g. its serialized JSON), which counts towards the budget while one
+    is set.
+    """
+    global _bytes_in_memory
+    key = id(part)
+    # without a budget there is nothing to enforce, so only uncharge data memoized while there was one
+    if _budget is None and ((entry := _in_memory.get(key)) is None or not entry.memo_nbytes):
+        return
+    with _lock:
+        if _budget is None:
+            nbytes = 0
+        if (entry := _in_memory.get(key)) is None:
+            # spilled parts have dropped their memoized data
+            if not nbytes or key in _spilled:
+                return
+            # e.g. a file-backed part, whose payload isn't in memory
+            entry = _in_memory[key] = _Entry(weakref.ref(part), 0)
+            _finalize_once(part, key)
+        _bytes_in_memory += nbytes - entry.memo_nbytes
+        entry.memo_nbytes = nbytes
+        if not entry.nbytes and not nbytes:
+            del _in_memory[key]
+            return
+        _in_memory.move_to_end(key)
+        _enforce_budget(keep=key)
+
+
+def touch(part):
+    """Mark a part as recently used."""
+    if _budget is None:
+        return
+    key = id(part)
+    with _lock:
+        if key in _in_memory:
+            _in_memory.move_to_end(key)
+
+
+def restore(part, name: str):
+    """
+    Load a part's spilled payload back into memory, and return its attribute with the given name.
+
+    Raises AttributeError if the part has no such attribute (i.e., it was not spilled).
+    """
+    with _lock:
+        # another thread may have restored it while we waited for the lock
+        if name not in part.__dict__:
+            load(part)
+        if name not in part.__dict__:
+            raise AttributeError(f"{type(part).__name__!r} object has no attribute {name!r}")
+        return part.__dict__[name]
+
+
+def load(part):
+    """Load a part's payload back into memory if it is spilled to disk (e.g. before copying the part's fields)."""
+    global _bytes_in_memory, _bytes_spilled, _n_restores
+    key = id(part)
+    with _lock:
+        entry = _spilled.get(key)
+        if entry is None or entry.ref() is not part:
+            return
+        with span("restore", type(part).__name__, bytes_in=entry.nbytes), open(entry.spill_path, "rb") as f:
+            part._restore_payload(f)
+        _remove_spill_file(entry)
+        del _spilled[key]
+        _bytes_spilled -= entry.nbytes
+        _in_memory[key] = entry
+        _bytes_in_memory += entry.nbytes
+        _n_restores += 1
+        _enforce_budget(keep=key)
+
+
+# ==== internals ====
+def _enforce_budget(keep: int = None):
+    """Spill the least recently used payloads until we are within budget. Must be called with the lock held."""
+    if _budget is None:
+        return
+    for key in list(_in_memory):
+        if _bytes_in_memory <= _budget:
+            break
+        if key != keep:
+            _spill(key)
+
+
+def _spill(key: int):
+    """Spill the payload of the part with the given key to disk. Must be called with the lock held."""
+    global _bytes_in_memory, _bytes_spilled, _n_spills
+    entry = _in_memory.pop(key)
+    memo_nbytes = entry.memo_nbytes
+    _bytes_in_memory -= entry.nbytes + memo_nbytes
+    # spilling drops the part's memoized data
+    entry.memo_nbytes = 0
+    part = entry.ref()
+    if part is None:
+        return
+    fd, entry.spill_path = tempfile.mkstemp(prefix="kani-multimodal-", suffix=".spill")
+    try:
+        with span("spill", type(part).__name__, bytes_in=entry.nbytes), open(fd, "wb") as f:
+            needs_restore = part._spill_payload(f)
+    except Exception:
+        # keep it in memory rather than failing whatever operation triggered the spill
+        log.warning(f"Could not spill the payload of {type(part).__name__} to disk", exc_info=True)
+        _remove_spill_file(entry)
+        entry.memo_nbytes = memo_nbytes
+        _in_memory[key] = entry
+        _in_memory.move_to_end(key, last=False)
+        _bytes_in_memory += entry.nbytes + memo_nbytes
+        return
+    _n_spills += 1
+    if needs_restore:
+        _spilled[key] = entry
+        _bytes_spilled += entry.nbytes
+    else:
+        _remove_spill_file(entry)
+
+
+def _finalize_once(part, key: int):
+    """Untrack the part when it is garbage collected, at most once per part. Must be called with the lock held."""
+    if key not in _finalized:
+        _finalized.add(key)
+        weakref.finalize(part, _untrack, key)
+
+
+def _untrack(key: int):
+    """Called when a tracked part is garbage collected."""
+    global _bytes_in_memory, _bytes_spilled
+    with _lock:
+        _finalized.discard(key)
+        if (entry := _in_memory.pop(key, None)) is not None:
+            _bytes_in_memory -= entry.nbytes + entry.memo_nbytes
+        elif (entry := _spilled.pop(key, None)) is not None:
+            _bytes_spilled -= entry.nbytes
+            _remove_spill_file(entry)
+
+
+def _remove_spill_file(entry: _Entry):
+    if entry.spill_path is None:
+        return
+    try:
+        os.unlink(entry.spill_path)
+    except OSError:
+        pass
+    entry.spill_path = None
@@ -0,0 +1,192 @@
+"""Video metadata, and a persistent cross-process cache of it to avoid re-running ffprobe on the same files."""
+
+import contextlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import IO
+
+from kani.utils.typing import PathLike
+from pydantic import BaseModel
+
+from .lazyfile import LazyFile
+
+log = logging.getLogger(__name__)
+
+CACHE_DIR_ENV_VAR = "KANI_MULTIMODAL_CACHE_DIR"
+
+
+class VideoMetadata(BaseModel):
+    """Container-level metadata about a video file."""
+
+    duration: float
+    """The duration of the video, in seconds."""
+
+    resolution: tuple[int, int] | None = None
+    """The resolution of the first video stream, in pixels (width, height)."""
+
+    codec: str | None = None
+    """The codec of the first video stream (e.g. ``"h264"``)."""
+
+    fps: float | None = None
+    """The average frame rate of the first video stream, in frames per second."""
+
+    streams: list[dict] = []
+    """
+    The layout of all streams in the file, as dicts with at least a ``codec_type`` key (``"video"``, ``"audio"``,
+    etc.) and other codec-dependent keys (e.g. ``codec_name``, ``width``, ``height``, ``sample_rate``, ``channels``).
+    """
+
+    @classmethod
+    def from_ffprobe(cls, data: dict) -> "VideoMetadata":
+        """Create a VideoMetadata from the JSON output of ffprobe's ``-show_entries format:stream``."""
+        streams = data.get("streams", [])
+        video = next((s for s in streams if s.get("codec_type") == "video"), None)
+        resolution = codec = fps = None
+        if video is not None:
+            if "width" in video and "height" in video:
+                resolution = (int(video["width"]), int(video["height"]))
+            codec = video.get("codec_name")
+            fps = _parse_frame_rate(video.get("avg_frame_rate"))
+        return cls(
+            duration=float(data["format"]["duration"]), resolution=resolution, codec=codec, fps=fps, streams=streams
+        )
+
+
+def _parse_frame_rate(rate: str | None) -> float | None:
+    """Parse an ffprobe frame rate (e.g. "30000/1001") into a float, or None if it is unknown."""
+    if not rate:
+        return None
+    num, _, den = rate.partition("/")
+    try:
+        value = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return value or None
+
+
+# ==== persistent cache ====
+class MetadataCache:
+    """
+    A persistent cache of :class:`VideoMetadata`, stored in an SQLite database.
+
+    The database can be safely shared by multiple threads and processes on the same machine. Errors reading or writing
+    the cache are logged and otherwise ignored, so a broken cache never prevents metadata from being computed.
+    """
+
+    def __init__(self, cache_dir: PathLike):
+        """
+        :param cache_dir: The directory to store the cache database in. Will be created if it does not exist.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.cache_dir / "metadata.sqlite3"
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # connections are cheap, and using one per operation keeps us safe across threads and forks
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if not self._initialized:
+            with self._init_lock:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS video_metadata (key TEXT PRIMARY KEY, data TEXT NOT NULL, created REAL)"
+                )
+                conn.commit()
+                self._initialized = True
+        return conn
+
+    def get(self, key: str) -> VideoMetadata | None:
+        """Return the cached metadata for the given key, or None if it is not cached."""
+        try:
+            with contextlib.closing(self._connect()) as conn:
+                row = conn.execute("SELECT data FROM video_metadata WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            log.warning(f"Could not read from metadata cache at {self.db_path}", exc_info=True)
+            return None
+        if row is None:
+            return None
+        try:
+            return VideoMetadata.model_validate_json(row[0])
+        except ValueError:
+            # e.g. written by an incompatible version, or corrupted; drop it so it is recomputed
+            log.warning(f"Discarding invalid entry {key!r} in metadata cache at {self.db_path}", exc_info=True)
+            self.delete(key)
+            return None
+
+    def set(self, key: str, metadata: VideoMetadata):
+        """Save the metadata for the given key to the cache."""
+        try:
+            with contextlib.closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO video_metadata (key, data, created) VALUES (?, ?, ?)",
+                    (key, metadata.model_dump_json(), time.time()),
+                )
+        except sqlite3.Error:
+            log.warning(f"Could not write to metadata cache at {self.db_path}", exc_info=True)
+
+    def delete(self, key: str):
+        """Remove the metadata for the given key from the cache, if present."""
+        try:
+            with contextlib.closing(self._connect()) as conn, conn:
+                conn.execute("DELETE FROM video_metadata WHERE key = ?", (key,))
+        except sqlite3.Error:
+            log.warning(f"Could not write to metadata cache at {self.db_path}", exc_info=True)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM video_metadata")
+
+
+_cache: MetadataCache | None = None
+_cache_configured = False
+
+
+def set_metadata_cache_dir(cache_dir: PathLike | None):
+    """
+    Set the directory to persist the video metadata cache in, or None to disable the persistent cache.
+
+    By default, the cache directory is read from the ``KANI_MULTIMODAL_CACHE_DIR`` environment variable, and the
+    persistent cache is disabled if it is not set.
+    """
+    global _cache, _cache_configured
+    if cache_dir is None:
+        _cache = None
+    else:
+        _cache = MetadataCache(cache_dir)
+    _cache_configured = True
+
+
+def get_metadata_cache() -> MetadataCache | None:
+    """Get the current persistent metadata cache, or None if it is disabled."""
+    if not _cache_configured:
+        set_metadata_cache_dir(os.environ.get(CACHE_DIR_ENV_VAR))
+    return _cache
+
+
+def file_cache_key(file: IO) -> str | None:
+    """
+    Return a cache key for the given file based on its path, size, and modification time, if it is a file on disk.
+
+    Returns None for files not on disk (e.g. a BytesIO) or anonymous temporary files.
+    """
+    if isinstance(file, LazyFile):
+        return json.dumps(["file", os.path.realpath(file.path), file.size, file.mtime_ns])
+    name = getattr(file, "name", None)
+    if not isinstance(name, str):
+        return None
+    try:
+        stat = os.fstat(file.fileno())
+        # make sure the name still refers to the file we have open
+        if not os.path.samestat(stat, os.stat(name)):
+            return None
+    except (OSError, ValueError, io.UnsupportedOperation):
+        return None
+    return json.dumps(["file", os.path.realpath(name), stat.st_size, stat.st_mtime_ns])
@@ -0,0 +1,123 @@
+"""Incremental saving of chat histories containing media, so that each save only writes the new messages."""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from pathlib import Path
+from typing import Sequence
+
+from kani import ChatMessage
+from kani.utils.typing import PathLike
+
+log = logging.getLogger(__name__)
+
+
+class MessageLog:
+    """
+    An append-only JSON Lines file of chat messages, for saving a conversation after every turn.
+
+    Each call to :meth:`save` only serializes and appends the messages that were added since the last save, so the
+    cost of saving is proportional to the new content rather than the length of the conversation. If the history was
+    changed in some other way (e.g. messages were removed), the file is rewritten instead; since media parts memoize
+    their serialized data, this is still much cheaper than serializing the history from scratch.
+
+    .. code-block:: python
+
+        message_log = MessageLog("conversation.jsonl")
+        ai.chat_history = message_log.load()  # if resuming
+        async for msg in ai.full_round(query):
+            ...
+        message_log.save(ai.chat_history)
+
+    Messages are compared by identity to find which ones were saved already, so messages that are mutated in place
+    after they were saved won't be saved again.
+    """
+
+    def __init__(self, fp: PathLike):
+        """
+        :param fp: The path to the file to save messages to. It is created when messages are first saved.
+        """
+        self.fp = Path(fp)
+        self._lock = threading.Lock()
+        # the messages that are in the file, in order
+        self._saved: list[weakref.ref] = []
+
+    def save(self, messages: Sequence[ChatMessage]) -> int:
+        """
+        Save the given messages (e.g. a kani's chat history), appending the ones that are not yet in the file.
+
+        :returns: The number of messages written.
+        """
+        with self._lock:
+            n_saved = len(self._saved)
+            if len(messages) >= n_saved and all(ref() is msg for ref, msg in zip(self._saved, messages)):
+                new_messages = messages[n_saved:]
+                mode = "a"
+            else:
+                log.debug(f"The saved history in {self.fp} changed, rewriting it")
+                new_messages = messages
+                mode = "w"
+                self._saved = []
+
+            lines = [msg.model_dump_json() + "\n" for msg in new_messages]
+            if mode == "a":
+                with open(self.fp, "a", encoding="utf-8") as f:
+                    f.writelines(lines)
+            else:
+                _atomic_write(self.fp, lines)
+            self._saved.extend(weakref.ref(msg) for msg in new_messages)
+            return len(new_messages)
+
+    def load(self) -> list[ChatMessage]:
+        """
+        Load the messages saved in the file, and remember them as saved (so saving a history that extends them only
+        appends the new messages). Returns an empty list if the file does not exist.
+
+        If the last line of the file is incomplete (e.g. the process was killed while saving), it is skipped.
+        """
+        with self._lock:
+            if not self.fp.exists():
+                self._saved = []
+                return []
+            with open(self.fp, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+            messages = []
+            for idx, line in enumerate(lines):
+                if not line:
+                    continue
+                try:
+                    messages.append(ChatMessage.model_validate_json(line))
+                except ValueError:
+                    if idx < len(lines) - 1 or _is_valid_json(line):
+                        raise
+                    log.warning(f"Skipping the incomplete last message in {self.fp}")
+                    # make sure the next save doesn't append to the partial line
+                    _atomic_write(self.fp, [f"{complete}\n" for complete in lines[:idx]])
+            self._saved = [weakref.ref(msg) for msg in messages]
+            return messages
+
+
+def _is_valid_json(line: str) -> bool:
+    try:
+        json.loads(line)
+    except ValueError:
+        return False
+    return True
+
+
+def _atomic_write(fp: Path, lines: list[str]):
+    """Write the lines to a file, replacing it only once they have all been written."""
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{fp.name}.", dir=fp.parent)
+    try:
+        with open(fd, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        if fp.exists():
+            shutil.copymode(fp, tmp_path)
+        os.replace(tmp_path, fp)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,278 @@
+"""
+Send parts to other processes (e.g. a process pool) through shared memory, instead of pickling their data through a
+pipe.
+
+.. code-block:: python
+
+    def process(shared: SharedPart):
+        part = shared.attach()
+        ...
+
+    with export_shared(part) as shared:
+        pool.submit(process, shared).result()
+"""
+
+import io
+import os
+import sys
+import threading
+import weakref
+from multiprocessing.shared_memory import SharedMemory
+
+from .base import BinaryFilePart
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class SharedPart:
+    """
+    A handle to a part exported to shared memory by :func:`export_shared`.
+
+    The handle itself is small, so it can be pickled cheaply and sent to another process, which can then
+    :meth:`attach` it to get a copy of the part backed by the shared memory.
+
+    The process that exported the part owns the shared memory segment, and must keep this handle alive until every
+    process is done attaching it. The segment is freed when the handle is :meth:`unlink`\\ ed, when it is used as a
+    context manager and the block exits, or when the exporting process' handle is garbage collected. Parts that were
+    already attached stay valid after the segment is unlinked.
+    """
+
+    def __init__(self, part_type: type, kind: str, name: str, nbytes: int, fields: dict):
+        self.part_type = part_type
+        """The type of the exported part."""
+        self.kind = kind
+        self.name = name
+        """The name of the shared memory segment."""
+        self.nbytes = nbytes
+        """The size of the part's data in the shared memory segment, in bytes."""
+        self.fields = fields
+        # only set in the exporting process
+        self._finalizer = None
+
+    def attach(self) -> BinaryFilePart:
+        """
+        Return a copy of the exported part backed by the shared memory segment.
+
+        The part's data is a read-only view of the shared memory rather than a copy for AudioParts (whose ``raw`` data
+        is a :class:`memoryview`), BinaryFileParts, and ImageParts in modes that Pillow can map directly (e.g. RGBA, L,
+        or P images; other modes are copied once while loading).
+
+        This should be called in the exporting process or a process it started (e.g. with :mod:`multiprocessing` or
+        :mod:`concurrent.futures`).
+        """
+        shm = _attach_segment(self.name)
+        try:
+            part = self._attach(shm.buf[: self.nbytes].toreadonly())
+        except BaseException:
+            _detach_segment(self.name)
+            raise
+        weakref.finalize(part, _detach_segment, self.name)
+        return part
+
+    def unlink(self):
+        """
+        Free the shared memory segment. Parts that were already attached stay valid until they are garbage collected.
+
+        This does nothing if called in a process other than the one that exported the part.
+        """
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.unlink()
+
+    def __repr__(self):
+        return f"<{type(self).__name__} of {self.part_type.__name__} name={self.name!r} nbytes={self.nbytes}>"
+
+    # ==== pickling ====
+    # only the exporting process may unlink the segment
+    def __getstate__(self):
+        return {**self.__dict__, "_finalizer": None}
+
+    # ==== internals ====
+    def _attach(self, view: memoryview):
+        fields = self.fields.copy()
+        if self.kind == "audio":
+            # skip validation, which would copy the raw data into bytes
+            return self.part_type.model_construct(raw=view, **fields)
+        if self.kind == "image":
+            from PIL import Image
+
+            mode, size, fmt = fields.pop("mode"), fields.pop("size"), fields.pop("format")
+            palette, info = fields.pop("palette"), fields.pop("info")
+            image = Image.frombuffer(mode, size, view, "raw", mode, 0, 1)
+            if palette is not None:
+                image.putpalette(*palette)
+            image.info.update(info)
+            image.format = fmt
+            return self.part_type(image=image, **fields)
+        if self.kind == "encoded_image":
+            return self.part_type.from_bytes(view, **fields)
+        return self.part_type(file=_SharedMemoryFile(view), **fields)
+
+
+def export_shared(part: BinaryFilePart) -> SharedPart:
+    """
+    Copy the data of an AudioPart, ImagePart, or BinaryFilePart (including VideoParts) into a new shared memory
+    segment, and return a handle that can be sent to other processes to :meth:`~SharedPart.attach` the part there
+    without copying its data again.
+
+    The handle should be used as a context manager or :meth:`~SharedPart.unlink`\\ ed explicitly once the other
+    processes have attached the part, or the segment stays allocated until the handle is garbage collected.
+    """
+    from .audio import AudioPart
+    from .image import ImagePart
+
+    part_type = type(part)
+    if isinstance(part, AudioPart):
+        kind, data, fields = "audio", part.raw, {"sample_rate": part.sample_rate}
+        handled = {"raw", "sample_rate"}
+    elif isinstance(part, ImagePart):
+        image = part.image
+        if getattr(image, "n_frames", 1) == 1:
+            kind, data = "image", image.tobytes()
+            palette = (image.getpalette(image.palette.mode), image.palette.mode) if image.palette else None
+            fields = {
+                "mode": image.mode,
+                "size": image.size,
+                "format": image.format,
+                "palette": palette,
+                "info": image.info,
+            }
+        else:
+            # the frames of animated images can only be mapped one at a time, so send the encoded image instead
+            kind, data, fields = "encoded_image", part.as_bytes(), {}
+        handled = {"image"}
+    elif isinstance(part, BinaryFilePart):
+        kind, data, fields = "file", None, {"mime": part.mime}
+        handled = {"file", "mime"}
+    else:
+        raise TypeError(f"{part_type.__name__} cannot be exported to shared memory.")
+    # keep any fields that subclasses add
+    for name in part_type.model_fields:
+        if name not in handled:
+            fields[name] = getattr(part, name)
+
+    nbytes = len(data) if data is not None else part.filesize
+    # shared memory segments can't be empty
+    shm = SharedMemory(create=True, size=max(nbytes, 1))
+    try:
+        if data is not None:
+            shm.buf[:nbytes] = data
+        else:
+            _copy_file_to(part.file, shm.buf[:nbytes])
+    except BaseException:
+        _unlink_segment(shm)
+        raise
+    shared = SharedPart(part_type, kind, shm.name, nbytes, fields)
+    shared._finalizer = weakref.finalize(shared, _unlink_segment, shm)
+    return shared
+
+
+class _SharedMemoryFile(io.RawIOBase):
+    """A read-only binary file over a view of a shared memory segment."""
+
+    def __init__(self, view: memoryview):
+        super().__init__()
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        self._checkClosed()
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        self._checkClosed()
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            pos = len(self._view) + offset
+        else:
+            raise ValueError(f"Invalid whence ({whence!r})")
+        if pos < 0:
+            raise ValueError(f"Negative seek position {pos}")
+        self._pos = pos
+        return pos
+
+    def readinto(self, buffer) -> int:
+        self._checkClosed()
+        chunk = self._view[self._pos : self._pos + len(buffer)]
+        n = len(chunk)
+        memoryview(buffer).cast("B")[:n] = chunk
+        self._pos += n
+        return n
+
+    def close(self):
+        super().close()
+        # drop our reference to the shared memory so that it can be unmapped
+        self._view = memoryview(b"")
+
+
+def _copy_file_to(file: io.IOBase, buffer: memoryview):
+    file.seek(0)
+    offset = 0
+    while offset < len(buffer):
+        n = file.readinto(buffer[offset : offset + COPY_CHUNK_SIZE])
+        if not n:
+            raise EOFError("The file ended before its reported size.")
+        offset += n
+
+
+def _unlink_segment(shm: SharedMemory):
+    try:
+        shm.close()
+    except BufferError:
+        # the exporting process attached it too; the mapping is freed once those parts are gone
+        pass
+    shm.unlink()
+
+
+# ==== attached segments ====
+# segments attached in this process are shared by all parts attached from them: name -> [segment, number of parts]
+_attach_lock = threading.Lock()
+_attached: dict[str, list] = {}
+# segments with no parts left, which can't be unmapped while views of them (e.g. a part's image) are still alive
+_releasing: list[SharedMemory] = []
+
+
+def _attach_segment(name: str) -> SharedMemory:
+    with _attach_lock:
+        _close_released()
+        if (entry := _attached.get(name)) is None:
+            # the exporting process' resource tracker (which processes it starts share) cleans up leaked segments
+            kwargs = {"track": False} if sys.version_info >= (3, 13) else {}
+            entry = _attached[name] = [SharedMemory(name=name, **kwargs), 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def _detach_segment(name: str):
+    with _attach_lock:
+        entry = _attached[name]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _attached[name]
+            _releasing.append(entry[0])
+        _close_released()
+
+
+def _close_released():
+    """Unmap the released segments that have no views left. Must be called with the lock held."""
+    for shm in _releasing.copy():
+        try:
+            shm.close()
+        except BufferError:
+            # this is called when a part is garbage collected, but before its data is; we'll try again next time
+            continue
+        _releasing.remove(shm)
@@ -1,12 +1,14 @@
+import base64
 import fnmatch
+import io
 import logging
 import mimetypes
+import tempfile
 from collections import namedtuple
-from typing import IO
-
-import aiohttp
+from typing import IO, Iterable, Iterator
 
 from .exceptions import MediaFormatException
+from .instrumentation import span
 
 log = logging.getLogger(__name__)
 
@@ -23,6 +25,8 @@ async def get_mime_type(url) -> str:
         return mime
 
     # HEAD request
+    import aiohttp
+
     async with aiohttp.ClientSession() as session:
         async with session.head(url, allow_redirects=True) as resp:
             return resp.content_type
@@ -44,14 +48,112 @@ async def download_media(url: str, f: IO, *, allowed_mime=("image/*", "audio/*",
     """
     if not allowed_mime:
         raise ValueError("Expected at least one allowed MIME type")
+    import aiohttp
+
     log.debug(f"Downloading media from url: {url}")
     bytes_downloaded = 0
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            mime = resp.content_type
-            if not any(fnmatch.fnmatch(mime, pat) for pat in allowed_mime):
-                raise MediaFormatException(f"Invalid MIME type: Expected one of {allowed_mime!r}, got {mime!r}")
-            async for chunk in resp.content.iter_chunked(4096):
-                f.write(chunk)
-                bytes_downloaded += len(chunk)
+    with span("download") as s:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as resp:
+                mime = resp.content_type
+                if not any(fnmatch.fnmatch(mime, pat) for pat in allowed_mime):
+                    raise MediaFormatException(f"Invalid MIME type: Expected one of {allowed_mime!r}, got {mime!r}")
+                async for chunk in resp.content.iter_chunked(4096):
+                    f.write(chunk)
+                    bytes_downloaded += len(chunk)
+        s.bytes_in = bytes_downloaded
     return DownloadResult(mime=mime, bytes_downloaded=bytes_downloaded)
+
+
+# ==== data URIs ====
+# the number of characters of base64 data to decode at a time (a multiple of 4)
+B64_CHUNK_SIZE = 1024 * 1024
+# data decoded into a file is moved from memory to a temporary file on disk once it is larger than this
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+# the longest header (``data:mime/type;params;base64,``) we look for before giving up
+_MAX_HEADER_SIZE = 1024
+_B64_WHITESPACE = b" \t\n\r\x0b\x0c"
+
+DataURI = namedtuple("DataURI", "mime chunks")
+
+
+def read_data_uri(data: str | bytes | IO) -> DataURI:
+    """
+    Parse the header of a base64 data URI (``data:mime/type;base64,...``), and return its MIME type and an iterator
+    over its decoded data.
+
+    Only the header is parsed up front. The data is decoded in chunks as the iterator is consumed, so decoding a large
+    URI never holds more than a chunk of it in memory at once (besides the input itself).
+
+    :param data: The data URI, as a string, bytes, or a text or binary file-like object to read it from.
+    :raises ValueError: if the data is not a base64 data URI, or its data is not valid base64.
+    """
+    chunks = _iter_ascii_chunks(data)
+    header = b""
+    while (end := header.find(b",")) == -1 and len(header) <= _MAX_HEADER_SIZE:
+        if (chunk := next(chunks, None)) is None:
+            break
+        header += chunk
+    prefix = header[:end]
+    if end == -1 or not prefix.startswith(b"data:") or not prefix.endswith(b";base64") or len(prefix) <= 12:
+        raise ValueError("Data URI must begin with a MIME type indicating Base64 encoding (`data:mime/type;base64,`).")
+    mime = prefix[5:-7].decode()
+    return DataURI(mime=mime, chunks=_decode_b64_chunks(_prepend(header[end + 1 :], chunks)))
+
+
+def iter_b64_decode(data: str | bytes | IO) -> Iterator[bytes]:
+    """
+    Decode base64 data in chunks, ignoring whitespace (e.g. line breaks).
+
+    :param data: The base64 data, as a string, bytes, or a text or binary file-like object to read it from.
+    """
+    return _decode_b64_chunks(_iter_ascii_chunks(data))
+
+
+def spool_chunks(chunks: Iterable[bytes], max_size: int | None = SPOOL_MAX_SIZE) -> IO[bytes]:
+    """
+    Write chunks of data to a new in-memory file, which is moved to a temporary file on disk once it is larger than
+    *max_size* bytes (or never, if it is None). Returns the file, positioned at the start.
+    """
+    f = io.BytesIO()
+    for chunk in chunks:
+        f.write(chunk)
+        if max_size is not None and isinstance(f, io.BytesIO) and f.tell() > max_size:
+            spooled = tempfile.TemporaryFile()
+            with f.getbuffer() as view:
+                spooled.write(view)
+            f = spooled
+    f.seek(0)
+    return f
+
+
+def _iter_ascii_chunks(data: str | bytes | IO) -> Iterator[bytes]:
+    if isinstance(data, str):
+        for idx in range(0, len(data), B64_CHUNK_SIZE):
+            yield data[idx : idx + B64_CHUNK_SIZE].encode("ascii")
+    elif isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data).cast("B")
+        for idx in range(0, len(view), B64_CHUNK_SIZE):
+            yield bytes(view[idx : idx + B64_CHUNK_SIZE])
+    else:
+        while chunk := data.read(B64_CHUNK_SIZE):
+            yield chunk.encode("ascii") if isinstance(chunk, str) else chunk
+
+
+def _prepend(first: bytes, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    yield first
+    yield from chunks
+
+
+def _decode_b64_chunks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    # base64 decodes in groups of 4 characters, so carry the remainder of each chunk over to the next
+    carry = b""
+    for chunk in chunks:
+        chunk = carry + chunk.translate(None, _B64_WHITESPACE)
+        n = len(chunk) - len(chunk) % 4
+        if n:
+            yield base64.b64decode(chunk[:n], validate=True)
+        carry = chunk[n:]
+    if carry:
+        # raises an error about the incorrect padding
+        base64.b64decode(carry, validate=True)
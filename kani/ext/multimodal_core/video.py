@@ -1,13 +1,67 @@
-import io
+import asyncio
+import heapq
 import json
+import os
+import re
 import subprocess
-from typing import TYPE_CHECKING
+import tempfile
+import threading
+import weakref
+from collections import namedtuple
+from typing import TYPE_CHECKING, Iterator
 
 from .base import BinaryFilePart
+from .containers import parse_container_metadata
+from .executor import run_in_executor
+from .ffmpeg import arun_ffmpeg, check_returncode, popen_with_input, run_ffmpeg, seekable_fileno
+from .instrumentation import span
+from .metadata import VideoMetadata, file_cache_key, get_metadata_cache
 
 if TYPE_CHECKING:
     import torch
 
+    from .audio import AudioPart
+
+Keyframe = namedtuple("Keyframe", "timestamp part")
+"""
+A distinct frame extracted from a video: the time it appears at, in seconds (or None if ffmpeg did not report it),
+and the frame as an ImagePart.
+"""
+
+_SHOWINFO_PTS_RE = re.compile(rb"pts_time:\s*(-?[\d.]+)")
+
+TranscodeCodec = namedtuple("TranscodeCodec", "encoder args quality_args suffix mime audio_encoder")
+TRANSCODE_CODECS = {
+    "h264": TranscodeCodec(
+        "libx264", ["-preset", "veryfast", "-pix_fmt", "yuv420p"], ["-crf", "23"], ".mp4", "video/mp4", "aac"
+    ),
+    "hevc": TranscodeCodec(
+        "libx265",
+        ["-preset", "veryfast", "-pix_fmt", "yuv420p", "-tag:v", "hvc1"],
+        ["-crf", "28"],
+        ".mp4",
+        "video/mp4",
+        "aac",
+    ),
+    "vp9": TranscodeCodec(
+        "libvpx-vp9",
+        ["-deadline", "realtime", "-cpu-used", "8", "-row-mt", "1", "-pix_fmt", "yuv420p"],
+        ["-crf", "32", "-b:v", "0"],
+        ".webm",
+        "video/webm",
+        "libopus",
+    ),
+    "av1": TranscodeCodec(
+        "libaom-av1",
+        ["-cpu-used", "8", "-row-mt", "1", "-pix_fmt", "yuv420p"],
+        ["-crf", "30", "-b:v", "0"],
+        ".mp4",
+        "video/mp4",
+        "aac",
+    ),
+}
+"""The codecs supported by :meth:`VideoPart.transcode`, and how to encode them."""
+
 
 class VideoPart(BinaryFilePart, arbitrary_types_allowed=True):
     """
@@ -22,8 +76,7 @@ class VideoPart(BinaryFilePart, arbitrary_types_allowed=True):
     or :meth:`as_tensor`.
     """
 
-    _duration: float = None
-    _resolution: tuple[int, int] = None
+    _metadata: VideoMetadata = None
 
     # ==== constructors ====
     @classmethod
@@ -75,41 +128,403 @@ class VideoPart(BinaryFilePart, arbitrary_types_allowed=True):
         )
         return clips.data.squeeze(dim=1)
 
+    def keyframes(
+        self,
+        max_frames: int = 16,
+        *,
+        threshold: float = 0.1,
+        size: tuple[int, int] = None,
+        fps: float = 1,
+        keyframes_only: bool = False,
+    ) -> list[Keyframe]:
+        """
+        Extract the visually distinct frames of the video as ImageParts, dropping redundant frames.
+
+        The video is decoded at a low resolution and sampled at *fps*. Each frame is compared to the last distinct
+        frame, and is considered a new scene if the mean absolute pixel difference between them (from 0 to 1) is at
+        least *threshold*. If more than *max_frames* distinct frames are found, the first frame and the frames with the
+        largest scene changes are kept.
+
+        This requires ``ffmpeg`` to be installed.
+
+        :param max_frames: The maximum number of frames to return (at least 1).
+        :param threshold: The minimum difference (0-1) between a frame and the last distinct frame for it to be
+            considered distinct.
+        :param size: The size to decode and return frames at, in pixels (width, height). Defaults to the video's
+            resolution, downscaled so that its longer side is at most 512 pixels.
+        :param fps: The number of frames per second to sample (default 1). Ignored if *keyframes_only* is set.
+        :param keyframes_only: If set, only decode the video's keyframes (I-frames) instead of sampling at a fixed
+            rate. This is much faster for long videos, but may miss scene changes between keyframes.
+        :returns: A list of :class:`Keyframe` in chronological order.
+        """
+        if max_frames < 1:
+            raise ValueError(f"max_frames must be at least 1, got {max_frames}")
+        import numpy as np
+        from PIL import Image
+
+        from .image import ImagePart
+
+        if size is None:
+            width, height = self.resolution
+            scale = min(1, 512 / max(width, height))
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        width, height = size
+        frame_size = width * height * 3
+
+        # decode scaled rgb24 frames to stdout; showinfo logs the timestamp of each output frame to stderr
+        filters = f"scale={width}:{height},showinfo"
+        if keyframes_only:
+            cmd = ["ffmpeg", "-hide_banner", "-nostats", "-skip_frame", "nokey", "-i", "-", "-fps_mode", "passthrough"]
+        else:
+            cmd = ["ffmpeg", "-hide_banner", "-nostats", "-i", "-"]
+            filters = f"fps={fps},{filters}"
+        cmd += ["-an", "-vf", filters, "-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+
+        timestamps = []
+        stderr_tail = []
+        first_frame = None
+        last_distinct = None
+        # min-heap of (score, idx, frame) for the most distinct frames after the first
+        candidates = []
+        with popen_with_input(cmd, self.file, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc:
+
+            def read_stderr():
+                for line in proc.stderr:
+                    if match := _SHOWINFO_PTS_RE.search(line):
+                        timestamps.append(float(match[1]))
+                    else:
+                        stderr_tail[:] = [*stderr_tail[-9:], line]
+
+            stderr_reader = threading.Thread(target=read_stderr, daemon=True)
+            stderr_reader.start()
+
+            idx = 0
+            while len(data := proc.stdout.read(frame_size)) == frame_size:
+                frame = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+                if first_frame is None:
+                    first_frame = last_distinct = frame
+                else:
+                    score = np.abs(frame.astype(np.int16) - last_distinct).mean() / 255
+                    if score >= threshold:
+                        last_distinct = frame
+                        if max_frames > 1:
+                            entry = (score, idx, frame)
+                            if len(candidates) < max_frames - 1:
+                                heapq.heappush(candidates, entry)
+                            else:
+                                heapq.heappushpop(candidates, entry)
+                idx += 1
+
+            proc.wait()
+            stderr_reader.join()
+            check_returncode(proc, b"".join(stderr_tail))
+
+        if first_frame is None:
+            return []
+        frames = [(0, first_frame)] + sorted((idx, frame) for _, idx, frame in candidates)
+        return [
+            Keyframe(
+                timestamp=self._keyframe_timestamp(timestamps, idx, fps, keyframes_only),
+                part=ImagePart(image=Image.fromarray(frame)),
+            )
+            for idx, frame in frames
+        ]
+
+    @staticmethod
+    def _keyframe_timestamp(timestamps: list[float], idx: int, fps: float, keyframes_only: bool) -> float | None:
+        """The timestamp of the *idx*-th decoded frame, estimated from the sampling rate if showinfo did not log it."""
+        if idx < len(timestamps):
+            return timestamps[idx]
+        # keyframes are irregularly spaced, so their timestamps can't be estimated
+        if keyframes_only:
+            return None
+        return idx / fps
+
+    def as_audio(self, sr: int = 16000) -> "AudioPart":
+        """
+        Extract the video's audio track as an AudioPart, downmixed to mono at the given sample rate.
+
+        The audio is decoded by piping the video through ``ffmpeg`` directly into memory, without writing any
+        intermediate files. This requires ``ffmpeg`` to be installed.
+
+        :param sr: The sample rate to extract the audio at (default 16kHz).
+        """
+        from .audio import AudioPart
+
+        with popen_with_input(
+            self._audio_extract_cmd(sr), self.file, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        ) as proc:
+            raw, stderr = proc.communicate()
+            check_returncode(proc, stderr)
+        return AudioPart(raw=raw, sample_rate=sr)
+
+    def iter_audio(self, sr: int = 16000, chunk_duration: float = 30) -> Iterator["AudioPart"]:
+        """
+        Extract the video's audio track as a stream of AudioParts, each *chunk_duration* seconds long (except for the
+        last one).
+
+        Like :meth:`as_audio`, but only holds one chunk of decoded audio in memory at a time, which is useful for long
+        recordings. This requires ``ffmpeg`` to be installed.
+
+        :param sr: The sample rate to extract the audio at (default 16kHz).
+        :param chunk_duration: The duration of each chunk, in seconds.
+        """
+        from .audio import AudioPart
+
+        chunk_size = max(1, round(chunk_duration * sr)) * 2
+        # spool stderr to a file so that it can't fill up a pipe while we're reading stdout
+        with (
+            tempfile.TemporaryFile() as stderr,
+            popen_with_input(self._audio_extract_cmd(sr), self.file, stdout=subprocess.PIPE, stderr=stderr) as proc,
+        ):
+            while raw := proc.stdout.read(chunk_size):
+                yield AudioPart(raw=raw, sample_rate=sr)
+            proc.wait()
+            stderr.seek(0)
+            check_returncode(proc, stderr.read())
+
+    # --- async ---
+    async def aas_tensor(self, fps: float = 1, start: float = None, end: float = None) -> "torch.Tensor":
+        """Asynchronous version of :meth:`as_tensor`, run on the configured executor (see :func:`.set_executor`)."""
+        return await run_in_executor(self.as_tensor, fps, start, end)
+
+    async def akeyframes(self, max_frames: int = 16, **kwargs) -> list[Keyframe]:
+        """
+        Asynchronous version of :meth:`keyframes`, run on the configured executor (see :func:`.set_executor`).
+
+        Keyword arguments are passed to :meth:`keyframes`.
+        """
+        return await run_in_executor(self.keyframes, max_frames, **kwargs)
+
+    async def aas_audio(self, sr: int = 16000) -> "AudioPart":
+        """Asynchronous version of :meth:`as_audio`, run on the configured executor (see :func:`.set_executor`)."""
+        return await run_in_executor(self.as_audio, sr)
+
+    # --- transcoding ---
+    def transcode(
+        self,
+        *,
+        max_bytes: int = None,
+        max_height: int = None,
+        fps: float = None,
+        codec: str = None,
+        audio_bitrate: int = 128_000,
+    ) -> "VideoPart":
+        """
+        Re-encode the video to fit within the given size, resolution, and frame rate budget.
+
+        If the video already satisfies all the given constraints, it is returned as-is without re-encoding. Otherwise,
+        it is transcoded by ``ffmpeg`` into a new VideoPart backed by a temporary file. When *max_bytes* is given, the
+        video bitrate is chosen to fit the budget; since encoders can overshoot their target bitrate, a second,
+        lower-bitrate pass is made if the first output is too large. This is a best-effort limit.
+
+        Transcoding jobs run in a bounded worker pool (see :func:`.set_ffmpeg_concurrency`); if the pool is full, this
+        method blocks until a slot is available. This requires ``ffmpeg`` to be installed.
+
+        :param max_bytes: The maximum file size of the output, in bytes.
+        :param max_height: The maximum height of the output, in pixels. The aspect ratio is preserved.
+        :param fps: The maximum frame rate of the output, in frames per second.
+        :param codec: The video codec to use (one of ``"h264"``, ``"hevc"``, ``"vp9"``, or ``"av1"``). If set, videos
+            in any other codec are always transcoded. Defaults to h264 if transcoding is required.
+        :param audio_bitrate: The bitrate to encode the audio at, in bits per second.
+        """
+        if not self._needs_transcode(max_bytes=max_bytes, max_height=max_height, fps=fps, codec=codec):
+            return self
+        codec = codec or "h264"
+        video_bitrate = self._budget_video_bitrate(max_bytes, audio_bitrate)
+        out_path = _temp_output_path(TRANSCODE_CODECS[codec].suffix)
+        try:
+            for _ in range(2):
+                cmd = self._transcode_cmd(out_path, max_height, fps, codec, video_bitrate, audio_bitrate)
+                run_ffmpeg(cmd, self.file)
+                if (video_bitrate := _retry_bitrate(out_path, max_bytes, video_bitrate)) is None:
+                    break
+        except BaseException:
+            os.unlink(out_path)
+            raise
+        return _from_transcoded(out_path, TRANSCODE_CODECS[codec].mime)
+
+    async def atranscode(
+        self,
+        *,
+        max_bytes: int = None,
+        max_height: int = None,
+        fps: float = None,
+        codec: str = None,
+        audio_bitrate: int = 128_000,
+    ) -> "VideoPart":
+        """
+        Like :meth:`transcode`, but runs ffmpeg as an async subprocess without blocking the event loop.
+
+        If the worker pool for the current event loop is full, this waits until a slot is available.
+        """
+        needs_transcode = await asyncio.to_thread(
+            self._needs_transcode, max_bytes=max_bytes, max_height=max_height, fps=fps, codec=codec
+        )
+        if not needs_transcode:
+            return self
+        codec = codec or "h264"
+        video_bitrate = self._budget_video_bitrate(max_bytes, audio_bitrate)
+        out_path = _temp_output_path(TRANSCODE_CODECS[codec].suffix)
+        try:
+            for _ in range(2):
+                cmd = self._transcode_cmd(out_path, max_height, fps, codec, video_bitrate, audio_bitrate)
+                await arun_ffmpeg(cmd, self.file)
+                if (video_bitrate := _retry_bitrate(out_path, max_bytes, video_bitrate)) is None:
+                    break
+        except BaseException:
+            os.unlink(out_path)
+            raise
+        return _from_transcoded(out_path, TRANSCODE_CODECS[codec].mime)
+
+    def _needs_transcode(self, *, max_bytes: int, max_height: int, fps: float, codec: str) -> bool:
+        """Whether the video exceeds any of the given constraints."""
+        if codec is not None and codec not in TRANSCODE_CODECS:
+            raise ValueError(f"Unsupported codec {codec!r}, expected one of {list(TRANSCODE_CODECS)}")
+        metadata = self.metadata
+        return bool(
+            (max_bytes is not None and self.filesize > max_bytes)
+            or (max_height is not None and metadata.resolution is not None and metadata.resolution[1] > max_height)
+            or (fps is not None and metadata.fps is not None and metadata.fps > fps + 0.01)
+            or (codec is not None and metadata.codec != codec)
+        )
+
+    def _has_audio(self) -> bool:
+        return any(stream.get("codec_type") == "audio" for stream in self.metadata.streams)
+
+    def _budget_video_bitrate(self, max_bytes: int | None, audio_bitrate: int) -> int | None:
+        """The video bitrate that fits the video within *max_bytes*, or None for constant quality."""
+        if max_bytes is None:
+            return None
+        duration = self.metadata.duration
+        # leave a bit of room for container overhead
+        total_bitrate = max_bytes * 8 * 0.95 / duration
+        if self._has_audio():
+            total_bitrate -= audio_bitrate
+        return max(int(total_bitrate), 16_000)
+
+    def _transcode_cmd(
+        self,
+        out_path: str,
+        max_height: int | None,
+        fps: float | None,
+        codec: str,
+        video_bitrate: int | None,
+        audio_bitrate: int,
+    ) -> list[str]:
+        spec = TRANSCODE_CODECS[codec]
+        cmd = ["ffmpeg", "-v", "error", "-y", "-i", "-", "-map", "0:v:0", "-map", "0:a:0?"]
+        filters = []
+        if max_height is not None:
+            filters.append(f"scale=-2:'min(ih,{max_height})'")
+        if fps is not None and self.metadata.fps is not None and self.metadata.fps > fps:
+            filters.append(f"fps={fps}")
+        if filters:
+            cmd += ["-vf", ",".join(filters)]
+        cmd += ["-c:v", spec.encoder, *spec.args]
+        if video_bitrate is None:
+            cmd += spec.quality_args
+        else:
+            cmd += ["-b:v", str(video_bitrate), "-maxrate", str(video_bitrate), "-bufsize", str(video_bitrate * 2)]
+        cmd += ["-c:a", spec.audio_encoder, "-b:a", str(audio_bitrate)]
+        if spec.suffix == ".mp4":
+            cmd += ["-movflags", "+faststart"]
+        cmd.append(out_path)
+        return cmd
+
+    # --- audio ---
+    @staticmethod
+    def _audio_extract_cmd(sr: int) -> list[str]:
+        """The ffmpeg command to decode the audio read from stdin to signed 16-bit little-endian mono PCM."""
+        return ["ffmpeg", "-v", "error", "-i", "-", "-vn", "-ac", "1", "-ar", str(sr), "-f", "s16le", "-"]
+
     # ==== helpers ====
-    def _ffprobe(self):
-        """Run ffprobe to get the relevant metadata, and cache it"""
+    def _ffprobe(self) -> VideoMetadata:
+        """Run ffprobe to get the video's metadata."""
         ffprobe_cmd = [
             "ffprobe",
             "-v",
             "error",
-            "-select_streams",
-            "v:0",
             "-show_entries",
-            "format=duration:stream=width,height",
+            "format=duration:stream=index,codec_type,codec_name,width,height,avg_frame_rate,sample_rate,channels",
             "-of",
             "json",
             "-",
         ]
-        # if we have a file descriptor, pass that to the subprocess instead of reading
-        try:
-            fileno = self.file.fileno()
+        with span("ffprobe", type(self).__name__), seekable_fileno(self.file) as fileno:
             result = subprocess.run(ffprobe_cmd, stdin=fileno, capture_output=True)
-        except io.UnsupportedOperation:
-            result = subprocess.run(ffprobe_cmd, input=self.as_bytes(), capture_output=True)
-        data = json.loads(result.stdout)
-        self._duration = float(data["format"]["duration"])
-        self._resolution = (int(data["streams"][0]["width"]), int(data["streams"][0]["height"]))
+        check_returncode(result, result.stderr)
+        return VideoMetadata.from_ffprobe(json.loads(result.stdout))
+
+    @property
+    def metadata(self) -> VideoMetadata:
+        """
+        The container metadata of this video (duration, resolution, codec, frame rate, and stream layout).
+
+        For MP4/MOV and Matroska/WebM files, the metadata is read directly from the container headers. Otherwise, it
+        is read using ``ffprobe``. If a persistent metadata cache is configured (see :func:`.set_metadata_cache_dir`),
+        ffprobe results are shared between processes, keyed by the file's path, size, and modification time for files
+        on disk, or the :attr:`content_hash` for other files. In all cases, the metadata is cached on the part once
+        loaded.
+        """
+        if self._metadata is not None:
+            return self._metadata
+
+        with span("metadata", type(self).__name__) as s:
+            self._metadata = parse_container_metadata(self.file)
+            if self._metadata is not None:
+                return self._metadata
+
+            cache = get_metadata_cache()
+            if cache is None:
+                self._metadata = self._ffprobe()
+                return self._metadata
+
+            cache_key = file_cache_key(self.file) or f"hash:{self.content_hash}"
+            self._metadata = cache.get(cache_key)
+            s.cache_hit = self._metadata is not None
+            if self._metadata is None:
+                self._metadata = self._ffprobe()
+                cache.set(cache_key, self._metadata)
+            return self._metadata
+
+    def _clear_memoized(self):
+        super()._clear_memoized()
+        self._metadata = None
 
     @property
     def duration(self) -> float:
         """The duration of this video, in seconds."""
-        if self._duration is None:
-            self._ffprobe()
-        return self._duration
+        return self.metadata.duration
 
     @property
     def resolution(self) -> tuple[int, int]:
         """The resolution of the video's first frame, in pixels (width, height)."""
-        if self._resolution is None:
-            self._ffprobe()
-        return self._resolution
+        return self.metadata.resolution
+
+
+# ==== transcoding helpers ====
+def _temp_output_path(suffix: str) -> str:
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        return f.name
+
+
+def _retry_bitrate(out_path: str, max_bytes: int | None, video_bitrate: int | None) -> int | None:
+    """If the transcoded output is over budget, return a lower bitrate to retry with; otherwise None."""
+    if max_bytes is None or video_bitrate is None:
+        return None
+    size = os.path.getsize(out_path)
+    if size <= max_bytes:
+        return None
+    return max(int(video_bitrate * max_bytes / size * 0.9), 16_000)
+
+
+def _from_transcoded(out_path: str, mime: str) -> VideoPart:
+    """Create a VideoPart from a transcoded temporary file, and make sure the file is deleted when we're done."""
+    part = VideoPart.from_file(out_path, mime=mime)
+    try:
+        # on POSIX, the file stays readable through our handle until it is closed
+        os.unlink(out_path)
+    except OSError:
+        weakref.finalize(part, os.unlink, out_path)
+    return part
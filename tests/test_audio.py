@@ -1,9 +1,10 @@
 import math
 from pathlib import Path
 
+import pytest
 import soundfile
 import torchaudio
-from kani.ext.multimodal_core.audio import AudioPart
+from kani.ext.multimodal_core.audio import AudioPart, set_audio_serialization_format
 
 from .utils import REPO_ROOT
 
@@ -57,3 +58,61 @@ def test_roundtrip_json():
     audio_part1 = AudioPart.from_file(TEST_AUDIO_PATH_WAV)
     audio_part2 = AudioPart.model_validate_json(audio_part1.model_dump_json())
     assert audio_part1.raw == audio_part2.raw
+
+
+def test_encoded():
+    audio_part = AudioPart.from_file(TEST_AUDIO_PATH_WAV)
+    flac = audio_part.as_encoded("flac")
+    assert len(flac) < len(audio_part.as_wav_bytes())
+    assert audio_part.as_encoded("flac") is flac
+    assert AudioPart.from_encoded(flac, "flac").raw == audio_part.raw
+
+    opus = audio_part.as_encoded("opus", bitrate="24k")
+    assert len(opus) < len(flac)
+    decoded = AudioPart.from_encoded(opus, "opus", sr=24000)
+    assert math.isclose(decoded.duration, audio_part.duration, abs_tol=0.05)
+
+    # equal bitrates share a cache entry, and lossless formats ignore the bitrate
+    assert audio_part.as_encoded("opus", bitrate=24000) is opus
+    assert audio_part.as_encoded("flac", bitrate="24k") is flac
+    with pytest.raises(ValueError):
+        audio_part.as_encoded("opus", bitrate="fast")
+
+    # changing the audio clears the cache
+    audio_part.sr = 16000
+    assert audio_part.as_encoded("flac") is not flac
+
+
+def test_roundtrip_json_encoded():
+    audio_part1 = AudioPart.from_file(TEST_AUDIO_PATH_WAV)
+    set_audio_serialization_format("flac")
+    try:
+        data = audio_part1.model_dump_json()
+        assert "audio/flac" in data
+        audio_part2 = AudioPart.model_validate_json(data)
+        assert audio_part1.raw == audio_part2.raw
+        assert audio_part1.sample_rate == audio_part2.sample_rate
+    finally:
+        set_audio_serialization_format("wav")
+    # loaded parts are saved in the configured format
+    assert "wav_data" in audio_part2.model_dump_json()
+
+
+def test_from_files(tmp_path):
+    bad_path = tmp_path / "bad.mp3"
+    bad_path.write_bytes(b"not audio")
+    paths = [TEST_AUDIO_PATH_WAV, bad_path, TEST_AUDIO_PATH_MP3]
+
+    results = list(AudioPart.from_files(paths, max_workers=2))
+    assert [r.fp for r in results] == paths
+    assert results[0].part.raw == TEST_AUDIO_PATH_PCM.read_bytes()
+    assert results[0].part.sample_rate == 24000
+    assert results[1].part is None and results[1].error is not None
+    assert results[2].part.sample_rate == 44100
+
+    resampled = list(AudioPart.from_files(paths, target_sr=16000, ordered=False))
+    assert sorted(r.fp for r in resampled) == sorted(paths)
+    for result in resampled:
+        if result.error is None:
+            assert result.part.sample_rate == 16000
+            assert math.isclose(result.part.duration, len(TEST_AUDIO_PATH_PCM.read_bytes()) / 48000, abs_tol=0.1)
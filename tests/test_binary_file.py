@@ -1,6 +1,13 @@
+import base64
+import io
+import os
+import pickle
 from pathlib import Path
 
+import pytest
+from kani.ext.multimodal_core import FileChangedException, set_max_open_files
 from kani.ext.multimodal_core.base import BinaryFilePart
+from kani.ext.multimodal_core.utils import spool_chunks
 
 from .utils import REPO_ROOT
 
@@ -25,7 +32,60 @@ def test_roundtrip_b64_uri():
     assert part1.as_bytes() == part2.as_bytes()
 
 
+def test_b64_uri_streaming():
+    part1 = BinaryFilePart.from_file(TEST_FILE_PATH)
+    uri = part1.as_b64_uri()
+    # line-wrapped base64 is accepted too
+    wrapped = f"data:{part1.mime};base64,{base64.encodebytes(part1.as_bytes()).decode()}"
+    for data in (uri.encode(), io.StringIO(uri), io.BytesIO(uri.encode()), wrapped):
+        part2 = BinaryFilePart.from_b64_uri(data)
+        assert part2.mime == part1.mime
+        assert part1.as_bytes() == part2.as_bytes()
+
+    with pytest.raises(ValueError):
+        BinaryFilePart.from_b64_uri(f"data:{part1.mime},hello")
+    with pytest.raises(ValueError):
+        BinaryFilePart.from_b64_uri(uri[:-1]).as_bytes()
+
+    # large data is spooled to disk
+    spooled = spool_chunks([b"a" * 10, b"b" * 10], max_size=15)
+    assert not isinstance(spooled, io.BytesIO)
+    assert spooled.read() == b"a" * 10 + b"b" * 10
+
+
 def test_roundtrip_json():
     part1 = BinaryFilePart.from_file(TEST_FILE_PATH)
     part2 = BinaryFilePart.model_validate_json(part1.model_dump_json())
     assert part1.as_bytes() == part2.as_bytes()
+
+
+def test_lazy_from_file():
+    part1 = BinaryFilePart.from_file(TEST_FILE_PATH)
+    part2 = BinaryFilePart.from_file(TEST_FILE_PATH, lazy=True)
+    assert part2.filesize == part1.filesize
+    assert part2.as_bytes() == part1.as_bytes()
+    assert part2.content_hash == part1.content_hash
+
+    # the file is not held open between reads
+    set_max_open_files(0)
+    try:
+        fd_count = len(os.listdir("/proc/self/fd")) if os.path.isdir("/proc/self/fd") else None
+        parts = [BinaryFilePart.from_file(TEST_FILE_PATH, lazy=True) for _ in range(16)]
+        assert all(part.as_bytes()[:4] == b"%PDF" for part in parts)
+        if fd_count is not None:
+            assert len(os.listdir("/proc/self/fd")) == fd_count
+    finally:
+        set_max_open_files(64)
+
+    part3 = pickle.loads(pickle.dumps(part2))
+    assert part3.as_bytes() == part1.as_bytes()
+
+
+def test_lazy_file_changed(tmp_path):
+    path = tmp_path / "test.txt"
+    path.write_bytes(b"hello")
+    part = BinaryFilePart.from_file(path, lazy=True)
+    assert part.as_bytes() == b"hello"
+    path.write_bytes(b"hello, world")
+    with pytest.raises(FileChangedException):
+        part.as_bytes()
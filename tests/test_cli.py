@@ -0,0 +1,56 @@
+import random
+import time
+
+import pytest
+from kani.ext.multimodal_core import cli
+from kani.ext.multimodal_core.cli import find_media_references
+
+
+def regex_references(query: str) -> list[tuple]:
+    return [(m.start(), m.end(), m["url"], m["path"], m["path_quot"]) for m in cli.MEDIA_RE.finditer(query)]
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "Please describe @image.png in detail.",
+        "see @a/b/c.png. and @/abs/path/to/file.mp3",
+        '@"my file.png" and @"dir with spaces/clip.mp4"',
+        '@"my.png" (quoted without spaces)',
+        "@http://example.com/a(b)c). and @https://x.y/foo,bar!",
+        "@HTTPS://Ex.com/wiki/Foo_(bar) @example.com/foo @example.com",
+        "mail me@example.com or @ nothing, @.b @a. @foo.bar/baz",
+        '@"x/y. z" @"unclosed @x/y.z/w',
+    ],
+)
+def test_find_media_references(query):
+    assert [tuple(ref) for ref in find_media_references(query)] == regex_references(query)
+
+
+FRAGMENTS = [
+    "@", "@", " ", "\n", "/", "/", ".", ".", '"', "(", ")", ":", "http:", "https:", "//", "www", ".com", ".co/",
+    "com/", "a", "x.y", "png", "!", "?", ",", "-", "%", "<", "[", "K", "_", "'", "«", "@\"", "example",
+]  # fmt: skip
+
+
+def test_matches_regex_randomized():
+    rng = random.Random(0)
+    for _ in range(5000):
+        query = "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 10)))
+        assert [tuple(ref) for ref in find_media_references(query)] == regex_references(query), query
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "@http://" + "a" * 50_000 + "!" * 50_000,
+        "@" + "a/" * 50_000,
+        "@http://a" + "(a" * 50_000,
+        '@"a ' * 25_000,
+    ],
+)
+def test_linear_time(query):
+    # the regex takes seconds on the first query with only 50 characters
+    start = time.perf_counter()
+    list(find_media_references(query))
+    assert time.perf_counter() - start < 5
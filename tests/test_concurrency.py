@@ -0,0 +1,43 @@
+from pathlib import Path
+
+import pytest
+from kani.ext.multimodal_core import AudioPart, BinaryFilePart, ImagePart, aencode_parts, encode_parts
+
+from .utils import REPO_ROOT
+
+TEST_IMAGE_PATH = Path(REPO_ROOT / "tests/data/test.png")
+TEST_FILE_PATH = Path(REPO_ROOT / "tests/data/test.pdf")
+
+
+def _make_parts():
+    image = ImagePart.from_file(TEST_IMAGE_PATH)
+    small_image = ImagePart(image=image.image.resize((64, 48)))
+    audio = AudioPart(raw=b"\x00\x01" * 24000, sample_rate=24000)
+    file = BinaryFilePart.from_file(TEST_FILE_PATH)
+    # the same part appearing twice should be handled
+    return [image, audio, file, small_image, image]
+
+
+def test_encode_parts():
+    parts = _make_parts()
+    expected = [
+        parts[0].as_b64_uri("jpeg"),
+        parts[1].as_wav_b64_uri(),
+        parts[2].as_b64_uri(),
+        parts[3].as_b64_uri("jpeg"),
+        parts[0].as_b64_uri("jpeg"),
+    ]
+    assert encode_parts(parts, format="jpeg") == expected
+    assert encode_parts(parts, format="jpeg", max_workers=1) == expected
+
+
+@pytest.mark.asyncio
+async def test_aencode_parts():
+    parts = _make_parts()
+    expected = encode_parts(parts)
+    assert await aencode_parts(parts, max_workers=2) == expected
+
+
+def test_encode_invalid():
+    with pytest.raises(TypeError):
+        encode_parts(["hello"])
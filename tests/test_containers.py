@@ -0,0 +1,123 @@
+import io
+import struct
+
+from kani.ext.multimodal_core.containers import parse_container_metadata
+from kani.ext.multimodal_core.video import VideoPart
+
+
+# ==== mp4 ====
+def box(box_type: bytes, *payload: bytes) -> bytes:
+    data = b"".join(payload)
+    return struct.pack(">I4s", len(data) + 8, box_type) + data
+
+
+def full_box(box_type: bytes, *payload: bytes) -> bytes:
+    return box(box_type, b"\0\0\0\0", *payload)
+
+
+def make_mp4(moov_first: bool) -> bytes:
+    # 125 frames over 5 seconds @ 640x360
+    avc1 = box(b"avc1", bytes(6), struct.pack(">H", 1), bytes(16), struct.pack(">HH", 640, 360), bytes(50))
+    stbl = box(
+        b"stbl",
+        full_box(b"stsd", struct.pack(">I", 1), avc1),
+        full_box(b"stts", struct.pack(">III", 1, 125, 512)),
+    )
+    mdia = box(
+        b"mdia",
+        full_box(b"mdhd", struct.pack(">IIII", 0, 0, 12800, 64000), bytes(4)),
+        full_box(b"hdlr", bytes(4), b"vide", bytes(13)),
+        box(b"minf", stbl),
+    )
+    moov = box(
+        b"moov",
+        full_box(b"mvhd", struct.pack(">IIII", 0, 0, 1000, 5000), bytes(80)),
+        box(b"trak", full_box(b"tkhd", bytes(80)), mdia),
+    )
+    ftyp = box(b"ftyp", b"isom", bytes(4), b"isomavc1")
+    mdat = box(b"mdat", bytes(10000))
+    return ftyp + moov + mdat if moov_first else ftyp + mdat + moov
+
+
+def test_mp4():
+    for moov_first in (True, False):
+        metadata = parse_container_metadata(io.BytesIO(make_mp4(moov_first)))
+        assert metadata.duration == 5
+        assert metadata.resolution == (640, 360)
+        assert metadata.codec == "h264"
+        assert metadata.fps == 25
+        assert metadata.streams == [
+            {
+                "index": 0,
+                "codec_type": "video",
+                "codec_name": "h264",
+                "width": 640,
+                "height": 360,
+                "avg_frame_rate": "25/1",
+            }
+        ]
+
+
+# ==== webm ====
+def element(element_id: int, *payload: bytes) -> bytes:
+    data = b"".join(payload)
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    return id_bytes + (0x01 << 56 | len(data)).to_bytes(8, "big") + data
+
+
+def uint_element(element_id: int, value: int) -> bytes:
+    return element(element_id, value.to_bytes(4, "big"))
+
+
+def make_webm() -> bytes:
+    ebml_header = element(0x1A45DFA3, element(0x4282, b"webm"))
+    info = element(0x1549A966, uint_element(0x2AD7B1, 1_000_000), element(0x4489, struct.pack(">d", 4008.0)))
+    track = element(
+        0xAE,
+        uint_element(0xD7, 1),
+        uint_element(0x83, 1),
+        element(0x86, b"V_VP9"),
+        uint_element(0x23E383, 40_000_000),
+        element(0xE0, uint_element(0xB0, 640), uint_element(0xBA, 360)),
+    )
+    cluster = element(0x1F43B675, bytes(1000))
+    # live-style segment of unknown size
+    segment = bytes.fromhex("18538067") + bytes.fromhex("01ffffffffffffff") + info + element(0x1654AE6B, track)
+    return ebml_header + segment + cluster
+
+
+def test_webm():
+    metadata = parse_container_metadata(io.BytesIO(make_webm()))
+    assert metadata.duration == 4.008
+    assert metadata.resolution == (640, 360)
+    assert metadata.codec == "vp9"
+    assert metadata.fps == 25
+
+
+def test_unrecognized():
+    assert parse_container_metadata(io.BytesIO(b"definitely not a video file")) is None
+    # truncated headers should fall back rather than raise
+    assert parse_container_metadata(io.BytesIO(make_mp4(False)[:-100])) is None
+    webm = make_webm()
+    expected = parse_container_metadata(io.BytesIO(webm))
+    for end in range(len(webm)):
+        # the cluster isn't needed, so only some truncations lose the metadata
+        assert parse_container_metadata(io.BytesIO(webm[:end])) in (None, expected)
+
+    # an empty movie header at the end of the moov box
+    ftyp = box(b"ftyp", b"isom", bytes(4), b"isomavc1")
+    assert parse_container_metadata(io.BytesIO(ftyp + box(b"moov", box(b"mvhd")))) is None
+    # an EBML header of unknown size
+    assert parse_container_metadata(io.BytesIO(bytes.fromhex("1a45dfa3ff") + make_webm()[4:])) is None
+
+
+def test_video_part():
+    # metadata is read without ffprobe
+    part = VideoPart.from_bytes(make_mp4(False), mime="video/mp4")
+    assert part.duration == 5
+    assert part.resolution == (640, 360)
+
+    # reassigning the file reloads the metadata
+    longer = make_mp4(False).replace(struct.pack(">II", 1000, 5000), struct.pack(">II", 1000, 10000), 1)
+    part.file = io.BytesIO(longer)
+    assert part.duration == 10
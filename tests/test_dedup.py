@@ -0,0 +1,64 @@
+import io
+from pathlib import Path
+
+from kani import ChatMessage
+from kani.ext.multimodal_core import AudioPart, BinaryFilePart, ImagePart, MediaIndex, set_memory_budget
+
+from .utils import REPO_ROOT
+
+TEST_IMAGE_PATH = Path(REPO_ROOT / "tests/data/test.png")
+TEST_FILE_PATH = Path(REPO_ROOT / "tests/data/test.pdf")
+
+
+def test_exact_duplicates():
+    index = MediaIndex()
+    image1 = ImagePart.from_file(TEST_IMAGE_PATH)
+    image2 = ImagePart.from_file(TEST_IMAGE_PATH)
+    file1 = BinaryFilePart.from_file(TEST_FILE_PATH)
+    file2 = BinaryFilePart.from_bytes(file1.as_bytes(), mime="application/pdf")
+
+    assert index.add(image1) is None
+    assert index.add(file1) is None
+    assert index.add("some text") is None
+    assert index.add(image2) == (image1, 0)
+    assert index.add(file2) == (file1, 0)
+    assert len(index) == 2
+
+
+def test_near_duplicates():
+    image1 = ImagePart.from_file(TEST_IMAGE_PATH)
+    image2 = ImagePart(image=image1.image.resize((512, 384)))
+    image3 = ImagePart(image=image1.image.rotate(90))
+
+    index = MediaIndex.from_messages([ChatMessage.user(["describe this", image1])])
+    match = index.find(image2)
+    assert match is not None and match.part is image1
+    assert image3 not in index
+
+    exact_index = MediaIndex(near_threshold=None)
+    exact_index.add(image1)
+    assert image2 not in exact_index
+
+
+def test_hashes_follow_reassignment():
+    audio = AudioPart(raw=b"\x00\x01" * 100, sample_rate=16000)
+    audio_hash = audio.content_hash
+    audio.raw = b"\x01\x00" * 100
+    assert audio.content_hash != audio_hash
+    assert audio.content_hash == AudioPart(raw=b"\x01\x00" * 100, sample_rate=16000).content_hash
+
+    image = ImagePart.from_file(TEST_IMAGE_PATH)
+    hashes = image.content_hash, image.perceptual_hash
+    image.image = image.image.rotate(90)
+    assert (image.content_hash, image.perceptual_hash) != hashes
+
+    # spilling a part to disk doesn't change its contents, so its hash is kept
+    file = BinaryFilePart.from_bytes(b"hello", mime="text/plain")
+    file_hash = file.content_hash
+    set_memory_budget(0)
+    try:
+        AudioPart(raw=b"\x00\x01" * 100, sample_rate=16000)
+        assert not isinstance(file.file, io.BytesIO)
+        assert file.__dict__["content_hash"] == file_hash
+    finally:
+        set_memory_budget(None)
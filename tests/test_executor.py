@@ -0,0 +1,64 @@
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from kani.ext.multimodal_core import AudioPart, BinaryFilePart, ImagePart, get_executor, set_executor, set_memory_budget
+
+from .utils import REPO_ROOT
+
+TEST_IMAGE_PATH = Path(REPO_ROOT / "tests/data/test.png")
+TEST_FILE_PATH = Path(REPO_ROOT / "tests/data/test.pdf")
+
+
+@pytest.fixture(params=["default", "thread", "process"])
+def executor(request):
+    if request.param == "default":
+        yield None
+        return
+    pool_cls = ThreadPoolExecutor if request.param == "thread" else ProcessPoolExecutor
+    with pool_cls(max_workers=2) as pool:
+        set_executor(pool)
+        yield pool
+        set_executor(None)
+
+
+@pytest.mark.asyncio
+async def test_async_conversions(executor):
+    assert get_executor() is executor
+    image = ImagePart.from_file(TEST_IMAGE_PATH)
+    audio = AudioPart(raw=b"\x00\x01\x02\x03" * 12000, sample_rate=24000)
+    file = BinaryFilePart.from_file(TEST_FILE_PATH)
+
+    assert await image.aas_b64_uri("jpeg") == image.as_b64_uri("jpeg")
+    assert (await image.ato_array((32, 32), layout="HWC")).shape == (32, 32, 3)
+    assert await audio.aas_bytes(16000) == audio.as_bytes(16000)
+    assert await audio.aas_wav_b64_uri() == audio.as_wav_b64_uri()
+    assert await file.aas_b64_uri() == file.as_b64_uri()
+
+    file_json = await file.amodel_dump_json()
+    assert file_json == file.model_dump_json()
+    loaded = await BinaryFilePart.amodel_validate_json(file_json)
+    assert loaded.as_bytes() == file.as_bytes()
+
+
+def test_pickle():
+    image = ImagePart.from_file(TEST_IMAGE_PATH)
+    loaded_image = pickle.loads(pickle.dumps(image))
+    assert loaded_image.mime == image.mime
+    assert loaded_image.as_bytes() == image.as_bytes()
+
+    file = BinaryFilePart.from_file(TEST_FILE_PATH)
+    loaded_file = pickle.loads(pickle.dumps(file))
+    assert loaded_file.mime == file.mime
+    assert loaded_file.as_bytes() == file.as_bytes()
+
+    # spilled data is included
+    audio = AudioPart(raw=b"\x00\x01" * 100, sample_rate=100)
+    set_memory_budget(0)
+    try:
+        AudioPart(raw=b"\x00\x00", sample_rate=100)
+        assert "raw" not in audio.__dict__
+        assert pickle.loads(pickle.dumps(audio)).raw == audio.raw
+    finally:
+        set_memory_budget(None)
@@ -1,5 +1,9 @@
+import io
 from pathlib import Path
 
+import numpy as np
+import pytest
+from PIL import Image
 from kani.ext.multimodal_core.image import ImagePart
 
 from .utils import REPO_ROOT
@@ -21,7 +25,52 @@ def test_roundtrip_b64():
     assert part1.as_bytes() == part2.as_bytes()
 
 
+def test_roundtrip_b64_uri():
+    part1 = ImagePart.from_file(TEST_IMAGE_PATH)
+    for data in (part1.as_b64_uri(), io.StringIO(part1.as_b64_uri())):
+        part2 = ImagePart.from_b64_uri(data)
+        assert part1.as_bytes() == part2.as_bytes()
+
+    with pytest.raises(ValueError):
+        ImagePart.from_b64_uri("data:text/plain;base64,aGVsbG8=")
+
+
 def test_roundtrip_json():
     part1 = ImagePart.from_file(TEST_IMAGE_PATH)
     part2 = ImagePart.model_validate_json(part1.model_dump_json())
     assert part1.as_bytes() == part2.as_bytes()
+
+
+def test_hashes():
+    part1 = ImagePart.from_file(TEST_IMAGE_PATH)
+    part2 = ImagePart.from_b64(part1.as_b64())
+    assert part1.content_hash == part2.content_hash
+    assert part1.hash_distance(part2) == 0
+
+    # a rescaled copy is a near-duplicate, but not an exact one
+    part3 = ImagePart(image=part1.image.resize((512, 384)))
+    assert part1.content_hash != part3.content_hash
+    assert part1.hash_distance(part3) <= 4
+
+
+def test_to_array():
+    part = ImagePart.from_file(TEST_IMAGE_PATH)
+    mean, std = (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)
+
+    # reference: the unfused computation
+    resized = np.asarray(part.image.convert("RGB").resize((224, 168), Image.Resampling.BICUBIC))
+    expected = ((resized / 255 - mean) / std).transpose(2, 0, 1)
+
+    arr = part.to_array((224, 168), mean=mean, std=std)
+    assert arr.shape == (3, 168, 224)
+    assert arr.dtype == np.float32
+    assert np.allclose(arr, expected, atol=1e-5)
+
+    # preallocated output, HWC
+    out = np.empty((168, 224, 3), dtype=np.float32)
+    assert part.to_array((224, 168), layout="HWC", mean=mean, std=std, out=out) is out
+    assert np.allclose(out, expected.transpose(1, 2, 0), atol=1e-5)
+
+    # integer passthrough and grayscale
+    assert (part.to_array(layout="HWC", dtype=np.uint8) == part.as_ndarray()).all()
+    assert part.to_array(mode="L").shape == (1, 768, 1024)
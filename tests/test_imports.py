@@ -0,0 +1,102 @@
+import subprocess
+import sys
+
+import kani.ext.multimodal_core as multimodal_core
+import pytest
+from kani.exceptions import MissingMessagePartType
+from kani.ext.multimodal_core import BinaryFilePart
+from kani.models import MessagePart
+
+HEAVY_MODULES = ("numpy", "PIL", "pydub", "aiohttp")
+
+
+def _modules_after(code: str) -> set[str]:
+    code = f"{code}\nimport sys\nprint(' '.join(sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return set(result.stdout.split())
+
+
+def test_import_is_lazy():
+    modules = _modules_after(
+        "import kani\n"
+        "import kani.ext.multimodal_core.cli\n"
+        "from kani.ext.multimodal_core import BinaryFilePart, TextPart, MediaFormatException"
+    )
+    assert "kani.ext.multimodal_core" in modules
+    for module in HEAVY_MODULES:
+        assert module not in modules
+    for module in ("audio", "image", "video"):
+        assert f"kani.ext.multimodal_core.{module}" not in modules
+
+
+def test_lazy_attributes():
+    modules = _modules_after("from kani.ext.multimodal_core import ImagePart")
+    assert "kani.ext.multimodal_core.image" in modules
+    assert "PIL" in modules
+
+    from kani.ext.multimodal_core.video import VideoPart
+
+    assert multimodal_core.VideoPart is VideoPart
+    assert "VideoPart" in dir(multimodal_core)
+    with pytest.raises(AttributeError):
+        multimodal_core.NotAPart
+
+
+def test_registry_imports_part_modules():
+    code = (
+        "import sys\n"
+        "from kani.models import MessagePart\n"
+        "import kani.ext.multimodal_core\n"
+        "assert 'kani.ext.multimodal_core.audio' not in sys.modules\n"
+        "part = MessagePart.model_validate({\n"
+        "    '__kani_messagepart_type__': 'kani.ext.multimodal_core.audio.AudioPart',\n"
+        "    'raw': b'\\0\\0',\n"
+        "    'sample_rate': 1,\n"
+        "})\n"
+        "print(type(part).__name__)"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "AudioPart"
+
+    # unknown types still raise
+    with pytest.raises(MissingMessagePartType):
+        MessagePart.model_validate({"__kani_messagepart_type__": "kani.ext.multimodal_core.audio.NotAPart"})
+
+
+def test_registry_is_patched():
+    # the lazy imports above rely on replacing kani's private MessagePart._messagepart_registry dict; if kani renames
+    # or restructures it, this fails instead of saved messages silently failing to load
+    assert "_messagepart_registry" in vars(MessagePart), "kani no longer defines MessagePart._messagepart_registry"
+    registry = MessagePart._messagepart_registry
+    assert isinstance(registry, multimodal_core._LazyPartRegistry), "the MessagePart registry was not patched"
+    # new subclasses must still be registered in it by fully qualified name
+    assert registry["kani.ext.multimodal_core.base.BinaryFilePart"] is BinaryFilePart
+
+
+def test_registry_lookups():
+    # however kani looks up a saved part's type, its module is imported on demand
+    code = (
+        "import sys\n"
+        "import kani.ext.multimodal_core\n"
+        "from kani.models import MessagePart\n"
+        "registry = MessagePart._messagepart_registry\n"
+        "assert 'kani.ext.multimodal_core.image.ImagePart' in registry\n"
+        "assert registry.get('kani.ext.multimodal_core.video.VideoPart').__name__ == 'VideoPart'\n"
+        "assert registry.get('kani.ext.multimodal_core.video.NotAPart') is None\n"
+        "assert 'kani.ext.multimodal_core.audio' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_registry_fallback():
+    # if kani's registry isn't what we expect, the part modules are imported up front instead
+    code = (
+        "import collections, sys\n"
+        "import kani.ext.multimodal_core\n"
+        "from kani.models import MessagePart\n"
+        "MessagePart._messagepart_registry = collections.UserDict(MessagePart._messagepart_registry)\n"
+        "kani.ext.multimodal_core._install_lazy_registry()\n"
+        "assert 'kani.ext.multimodal_core.audio' in sys.modules\n"
+        "assert 'kani.ext.multimodal_core.audio.AudioPart' in MessagePart._messagepart_registry"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
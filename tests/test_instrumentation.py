@@ -0,0 +1,125 @@
+import logging
+from pathlib import Path
+
+import pytest
+from kani.ext.multimodal_core import (
+    AudioPart,
+    BinaryFilePart,
+    ImagePart,
+    LoggingCollector,
+    MediaCollector,
+    get_collector,
+    set_collector,
+)
+from kani.ext.multimodal_core.instrumentation import span
+
+from .utils import REPO_ROOT
+
+TEST_IMAGE_PATH = Path(REPO_ROOT / "tests/data/test.png")
+TEST_FILE_PATH = Path(REPO_ROOT / "tests/data/test.pdf")
+
+
+class ListCollector(MediaCollector):
+    def __init__(self):
+        self.events = []
+
+    def record(self, event):
+        self.events.append(event)
+
+
+@pytest.fixture
+def collector():
+    collector = ListCollector()
+    set_collector(collector)
+    yield collector
+    set_collector(None)
+
+
+def test_no_collector():
+    assert get_collector() is None
+    with span("test") as s:
+        s.bytes_out = 1
+    assert not s
+
+
+def test_binary_file_events(collector):
+    part = BinaryFilePart.from_file(TEST_FILE_PATH)
+    data = part.as_bytes()
+    part.as_b64_uri()
+    BinaryFilePart.model_validate_json(part.model_dump_json())
+
+    ops = [(e.operation, e.part_type) for e in collector.events]
+    assert ops[:3] == [("from_file", "BinaryFilePart"), ("as_bytes", "BinaryFilePart"), ("as_bytes", "BinaryFilePart")]
+    assert ("as_b64_uri", "BinaryFilePart") in ops
+    assert ("serialize", "BinaryFilePart") in ops
+    assert ("deserialize", "BinaryFilePart") in ops
+
+    from_file = collector.events[0]
+    assert from_file.bytes_out == len(data)
+    assert from_file.error is None
+    assert all(e.duration >= 0 for e in collector.events)
+
+    serialize = next(e for e in collector.events if e.operation == "serialize")
+    assert serialize.bytes_in == len(data)
+    deserialize = next(e for e in collector.events if e.operation == "deserialize")
+    assert deserialize.bytes_in == serialize.bytes_out
+    assert deserialize.bytes_out == len(data)
+
+
+def test_conversion_events(collector):
+    image = ImagePart.from_file(TEST_IMAGE_PATH)
+    png = image.as_bytes()
+    audio = AudioPart(raw=b"\x00\x01" * 24000, sample_rate=24000)
+    audio.as_bytes(sr=24000)  # no resampling needed
+    resampled = audio.as_bytes(sr=16000)
+
+    events = {e.operation: e for e in collector.events}
+    assert events["as_bytes"].part_type == "ImagePart"
+    assert events["as_bytes"].bytes_out == len(png)
+    assert events["resample"].bytes_in == len(audio.raw)
+    assert events["resample"].bytes_out == len(resampled)
+    assert sum(e.operation == "resample" for e in collector.events) == 1
+
+
+def test_nested_events(collector):
+    part = BinaryFilePart.from_bytes(b"hello", mime="text/plain")
+    part.as_b64_uri()
+
+    # as_b64_uri reads the data with as_bytes, whose bytes shouldn't be counted twice
+    assert [(e.operation, e.depth) for e in collector.events] == [("as_bytes", 1), ("as_b64_uri", 0)]
+    assert sum(e.bytes_out for e in collector.events if e.depth == 0) == len(part.as_b64_uri())
+
+
+def test_collector_is_abstract():
+    with pytest.raises(TypeError):
+        MediaCollector()
+
+
+def test_errors(collector):
+    with pytest.raises(FileNotFoundError):
+        ImagePart.from_file("does-not-exist.png")
+    assert collector.events[-1].operation == "from_file"
+    assert collector.events[-1].error == "FileNotFoundError"
+
+
+def test_collector_exceptions_are_suppressed(caplog):
+    class BadCollector(MediaCollector):
+        def record(self, event):
+            raise RuntimeError("oops")
+
+    set_collector(BadCollector())
+    try:
+        assert BinaryFilePart.from_file(TEST_FILE_PATH).as_bytes()
+    finally:
+        set_collector(None)
+    assert "Exception in media instrumentation collector" in caplog.text
+
+
+def test_logging_collector(caplog):
+    set_collector(LoggingCollector(level=logging.INFO))
+    try:
+        with caplog.at_level(logging.INFO):
+            BinaryFilePart.from_file(TEST_FILE_PATH)
+    finally:
+        set_collector(None)
+    assert "BinaryFilePart.from_file took" in caplog.text
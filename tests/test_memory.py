@@ -0,0 +1,141 @@
+import copy
+import gc
+import io
+import os
+import weakref
+from pathlib import Path
+
+import pytest
+from kani.ext.multimodal_core import AudioPart, BinaryFilePart, ImagePart, get_memory_usage, memory, set_memory_budget
+
+from .utils import REPO_ROOT
+
+TEST_IMAGE_PATH = Path(REPO_ROOT / "tests/data/test.png")
+
+
+@pytest.fixture
+def budget():
+    # spill everything but the most recently used part
+    set_memory_budget(0)
+    yield
+    set_memory_budget(None)
+
+
+def test_usage():
+    gc.collect()
+    before = get_memory_usage()
+    audio = AudioPart(raw=b"\x00\x01" * 1000, sample_rate=1000)
+    file = BinaryFilePart.from_bytes(b"hello" * 100, mime="text/plain")
+    usage = get_memory_usage()
+    assert usage.bytes_in_memory - before.bytes_in_memory == 2500
+    assert usage.parts_in_memory - before.parts_in_memory == 2
+    assert usage.budget is None
+
+    del audio, file
+    gc.collect()
+    assert get_memory_usage().bytes_in_memory == before.bytes_in_memory
+
+
+def test_audio_spill(budget):
+    first = AudioPart(raw=b"\x00\x01" * 1000, sample_rate=1000)
+    before = get_memory_usage()
+    second = AudioPart(raw=b"\x02\x03" * 1000, sample_rate=1000)
+    usage = get_memory_usage()
+    assert "raw" not in first.__dict__
+    assert usage.spills == before.spills + 1
+    assert usage.parts_spilled >= 1
+
+    # accessing the data restores it transparently, spilling the other part
+    assert first.raw == b"\x00\x01" * 1000
+    assert first.duration == 1
+    assert "raw" not in second.__dict__
+    assert get_memory_usage().restores == usage.restores + 1
+
+    # serialization loads spilled data too
+    assert second.model_dump()["raw"] == b"\x02\x03" * 1000
+    assert AudioPart.model_validate_json(first.model_dump_json()).raw == first.raw
+
+
+def test_image_spill(budget):
+    image = ImagePart.from_file(TEST_IMAGE_PATH)
+    expected = image.as_bytes()
+    palette = ImagePart(image=image.image.convert("P"))
+    palette_expected = palette.as_bytes()
+    assert "image" not in image.__dict__
+
+    assert image.as_bytes() == expected
+    assert image.mime == "image/png"
+    assert "image" not in palette.__dict__
+    assert palette.image.mode == "P"
+    assert palette.as_bytes() == palette_expected
+
+
+def test_copy_spilled(budget):
+    audio = AudioPart(raw=b"\x00\x01" * 1000, sample_rate=1000)
+    image = ImagePart.from_file(TEST_IMAGE_PATH)
+    expected = image.as_bytes()
+    AudioPart(raw=b"\x00\x00" * 10, sample_rate=10)
+    assert "raw" not in audio.__dict__ and "image" not in image.__dict__
+
+    for copy_fn in (copy.copy, copy.deepcopy, lambda part: part.model_copy()):
+        assert copy_fn(audio).raw == b"\x00\x01" * 1000
+        assert copy_fn(image).as_bytes() == expected
+
+    # spilled parts compare equal to unspilled ones
+    unspilled = AudioPart(raw=b"\x00\x01" * 1000, sample_rate=1000)
+    AudioPart(raw=b"\x00\x00" * 10, sample_rate=10)
+    assert "raw" not in audio.__dict__
+    assert audio == AudioPart(raw=b"\x00\x01" * 1000, sample_rate=1000)
+    assert "raw" not in unspilled.__dict__
+    assert unspilled == audio
+
+
+def test_binary_file_spill(budget):
+    file = BinaryFilePart.from_bytes(b"hello world", mime="text/plain")
+    file.file.seek(6)
+    AudioPart(raw=b"\x00\x00" * 10, sample_rate=10)
+    assert not isinstance(file.file, io.BytesIO)
+    assert file.file.read() == b"world"
+    assert file.as_bytes() == b"hello world"
+
+
+def test_spill_files_removed(budget):
+    part = AudioPart(raw=b"\x00\x01" * 10, sample_rate=10)
+    AudioPart(raw=b"\x00\x01" * 10, sample_rate=10)
+    spill_path = memory._spilled[id(part)].spill_path
+    assert os.path.exists(spill_path)
+    del part
+    gc.collect()
+    assert not os.path.exists(spill_path)
+
+
+def test_memoize_finalizers(tmp_path):
+    path = tmp_path / "hello.txt"
+    path.write_bytes(b"hello")
+    part = BinaryFilePart.from_file(path)
+    set_memory_budget(1024 * 1024)
+    try:
+        # dropping and recreating the memoized payload of a file-backed part shouldn't pile up finalizers
+        for _ in range(10):
+            part.model_dump_json()
+            part.mime = "text/plain"
+    finally:
+        set_memory_budget(None)
+    assert sum(f.peek() is not None and f.peek()[0] is part for f in list(weakref.finalize._registry)) == 1
+
+
+def test_encoded_audio_memory():
+    audio = AudioPart(raw=bytes(range(256)) * 64, sample_rate=16000)
+    set_memory_budget(1024 * 1024)
+    try:
+        before = get_memory_usage().bytes_in_memory
+        flac = audio.as_encoded("flac")
+        assert get_memory_usage().bytes_in_memory == before + len(flac)
+
+        # spilling the part drops the encoded data
+        set_memory_budget(0)
+        AudioPart(raw=b"\x00\x01" * 100, sample_rate=16000)
+        assert audio._encoded is None
+        assert audio.as_encoded("flac") == flac
+    finally:
+        set_memory_budget(None)
@@ -0,0 +1,67 @@
+import contextlib
+import logging
+
+from kani.ext.multimodal_core.metadata import MetadataCache, VideoMetadata, get_metadata_cache, set_metadata_cache_dir
+from kani.ext.multimodal_core.video import VideoPart
+
+FFPROBE_OUTPUT = {
+    "streams": [
+        {
+            "index": 0,
+            "codec_name": "h264",
+            "codec_type": "video",
+            "width": 480,
+            "height": 360,
+            "avg_frame_rate": "30/1",
+        },
+        {"index": 1, "codec_name": "aac", "codec_type": "audio", "sample_rate": "44100", "channels": 2},
+    ],
+    "format": {"duration": "219.099000"},
+}
+
+
+def test_from_ffprobe():
+    metadata = VideoMetadata.from_ffprobe(FFPROBE_OUTPUT)
+    assert metadata.duration == 219.099
+    assert metadata.resolution == (480, 360)
+    assert metadata.codec == "h264"
+    assert metadata.fps == 30
+    assert [s["codec_type"] for s in metadata.streams] == ["video", "audio"]
+
+
+def test_persistent_cache(tmp_path):
+    metadata = VideoMetadata.from_ffprobe(FFPROBE_OUTPUT)
+    MetadataCache(tmp_path).set("hash:abc", metadata)
+
+    # a new cache instance (e.g. in another process) should see the same data
+    cache = MetadataCache(tmp_path)
+    assert cache.get("hash:abc") == metadata
+    assert cache.get("hash:def") is None
+    cache.clear()
+    assert cache.get("hash:abc") is None
+
+
+def test_invalid_cache_entry(tmp_path, caplog):
+    cache = MetadataCache(tmp_path)
+    cache.set("hash:abc", VideoMetadata.from_ffprobe(FFPROBE_OUTPUT))
+    with contextlib.closing(cache._connect()) as conn, conn:
+        conn.execute("UPDATE video_metadata SET data = ? WHERE key = ?", ("not json", "hash:abc"))
+
+    # the invalid entry is treated as a miss and removed
+    with caplog.at_level(logging.WARNING):
+        assert cache.get("hash:abc") is None
+    assert "Discarding invalid entry" in caplog.text
+    with contextlib.closing(cache._connect()) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM video_metadata").fetchone() == (0,)
+
+
+def test_video_part_uses_cache(tmp_path):
+    metadata = VideoMetadata.from_ffprobe(FFPROBE_OUTPUT)
+    set_metadata_cache_dir(tmp_path)
+    try:
+        # an unrecognized container would need ffprobe, unless the metadata is already cached
+        part = VideoPart.from_bytes(b"not a real video", mime="video/mp4")
+        get_metadata_cache().set(f"hash:{part.content_hash}", metadata)
+        assert part.metadata == metadata
+    finally:
+        set_metadata_cache_dir(None)
@@ -0,0 +1,149 @@
+import gc
+
+from PIL import Image, ImageDraw
+from kani import ChatMessage
+from kani.ext.multimodal_core import (
+    AudioPart,
+    BinaryFilePart,
+    ImagePart,
+    MediaCollector,
+    MessageLog,
+    get_memory_usage,
+    set_collector,
+    set_memory_budget,
+)
+
+
+class ListCollector(MediaCollector):
+    def __init__(self):
+        self.events = []
+
+    def record(self, event):
+        self.events.append(event)
+
+
+def make_history():
+    return [
+        ChatMessage.user(["Describe this image.", ImagePart(image=Image.new("RGB", (64, 64), (255, 0, 0)))]),
+        ChatMessage.assistant("It's red."),
+        ChatMessage.user([BinaryFilePart.from_bytes(b"hello", mime="text/plain")]),
+        ChatMessage.user([AudioPart(raw=b"\x00\x01" * 100, sample_rate=16000)]),
+    ]
+
+
+def test_memoized_json():
+    collector = ListCollector()
+    events = collector.events
+    set_collector(collector)
+    try:
+        part = BinaryFilePart.from_bytes(b"hello", mime="text/plain")
+        data = part.model_dump_json()
+        assert part.model_dump_json() == data
+        assert [e.cache_hit for e in events if e.operation == "serialize"] == [None, True]
+
+        # reassigning a field invalidates the memoized payload
+        part.mime = "text/markdown"
+        assert "text/markdown" in part.model_dump_json()
+
+        # loaded parts reuse the loaded payload
+        loaded = BinaryFilePart.model_validate_json(data)
+        events.clear()
+        assert loaded.model_dump_json() == data
+        assert [e.cache_hit for e in events if e.operation == "serialize"] == [True]
+    finally:
+        set_collector(None)
+
+
+def test_memoized_json_modified_in_place(tmp_path):
+    # resizing an image in place is detected
+    image = ImagePart(image=Image.new("RGB", (64, 64), (255, 0, 0)))
+    image.model_dump_json()
+    image.image.thumbnail((8, 8))
+    assert ImagePart.model_validate_json(image.model_dump_json()).image.size == (8, 8)
+
+    # drawing on it isn't, until the part is invalidated
+    ImageDraw.Draw(image.image).point((0, 0), fill=(0, 0, 255))
+    assert ImagePart.model_validate_json(image.model_dump_json()).image.getpixel((0, 0)) == (255, 0, 0)
+    image.invalidate()
+    assert ImagePart.model_validate_json(image.model_dump_json()).image.getpixel((0, 0)) == (0, 0, 255)
+
+    # writing to in-memory or on-disk files is detected
+    file = BinaryFilePart.from_bytes(b"hello", mime="text/plain")
+    file.model_dump_json()
+    file.file.seek(0)
+    file.file.write(b"HELLO")
+    assert BinaryFilePart.model_validate_json(file.model_dump_json()).as_bytes() == b"HELLO"
+
+    path = tmp_path / "hello.txt"
+    path.write_bytes(b"hello")
+    file = BinaryFilePart.from_file(path)
+    file.model_dump_json()
+    path.write_bytes(b"hello world")
+    assert BinaryFilePart.model_validate_json(file.model_dump_json()).as_bytes() == b"hello world"
+
+
+def test_memoized_json_memory(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(bytes(range(256)) * 100)
+    file = BinaryFilePart.from_file(path)
+    gc.collect()
+    before = get_memory_usage().bytes_in_memory
+    # memoized payloads are only counted while there is a budget
+    file.model_dump_json()
+    assert get_memory_usage().bytes_in_memory == before
+    file.invalidate()
+    set_memory_budget(1024 * 1024 * 1024)
+    try:
+        data = file.model_dump_json()
+        assert get_memory_usage().bytes_in_memory > before
+
+        # the memoized payload is dropped when the budget is exceeded
+        set_memory_budget(0)
+        assert file._json_payload is None
+        assert get_memory_usage().bytes_in_memory <= before
+        assert file.model_dump_json() == data
+    finally:
+        set_memory_budget(None)
+
+
+def test_json_roundtrip_types():
+    for msg in make_history():
+        loaded = ChatMessage.model_validate_json(msg.model_dump_json())
+        assert [type(part) for part in loaded.parts] == [type(part) for part in msg.parts]
+
+
+def test_incremental_save(tmp_path):
+    path = tmp_path / "history.jsonl"
+    history = make_history()
+    message_log = MessageLog(path)
+    assert message_log.save(history[:2]) == 2
+    assert message_log.save(history[:2]) == 0
+    assert message_log.save(history) == 2
+    assert len(path.read_text().splitlines()) == 4
+
+    # a changed history is rewritten
+    assert message_log.save(history[1:]) == 3
+    assert len(path.read_text().splitlines()) == 3
+
+    # loading resumes appending where we left off
+    resumed = MessageLog(path)
+    loaded = resumed.load()
+    assert [msg.role for msg in loaded] == [msg.role for msg in history[1:]]
+    assert [type(part) for msg in loaded for part in msg.parts] == [str, BinaryFilePart, AudioPart]
+    assert resumed.save(loaded + [ChatMessage.assistant("Hi!")]) == 1
+    assert len(MessageLog(path).load()) == 4
+
+
+def test_load_incomplete(tmp_path):
+    path = tmp_path / "history.jsonl"
+    message_log = MessageLog(path)
+    assert message_log.load() == []
+    message_log.save(make_history())
+    # simulate a crash while saving
+    with open(path, "a") as f:
+        f.write('{"role": "user", "content": "trunc')
+
+    message_log = MessageLog(path)
+    assert len(message_log.load()) == 4
+    message_log.save(message_log.load() + [ChatMessage.assistant("Hi!")])
+    assert len(MessageLog(path).load()) == 5
@@ -0,0 +1,87 @@
+import copy
+import gc
+import io
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pytest
+from PIL import Image
+from kani.ext.multimodal_core import AudioPart, BinaryFilePart, ImagePart, export_shared
+from kani.ext.multimodal_core.shm import SharedPart
+
+from .utils import REPO_ROOT
+
+TEST_FILE_PATH = Path(REPO_ROOT / "tests/data/test.pdf")
+TEST_IMAGE_PATH = Path(REPO_ROOT / "tests/data/test.png")
+
+
+def attach_and_dump(shared: SharedPart) -> str:
+    return shared.attach().model_dump_json()
+
+
+@pytest.fixture(scope="module")
+def pool():
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        yield executor
+
+
+def make_parts():
+    image = Image.new("RGB", (32, 16), (255, 0, 0))
+    palette_image = Image.new("P", (8, 8))
+    palette_image.putpalette([0, 0, 0, 0, 255, 0])
+    palette_image.putpixel((0, 0), 1)
+    return [
+        AudioPart(raw=bytes(range(256)) * 64, sample_rate=16000),
+        ImagePart.from_file(TEST_IMAGE_PATH),
+        ImagePart(image=image),
+        ImagePart(image=palette_image),
+        BinaryFilePart.from_file(TEST_FILE_PATH),
+        BinaryFilePart.from_bytes(b"hello", mime="text/plain"),
+    ]
+
+
+@pytest.mark.parametrize("part", make_parts(), ids=lambda part: type(part).__name__)
+def test_roundtrip(part, pool):
+    with export_shared(part) as shared:
+        # the handle is small no matter how big the part is
+        assert len(pickle.dumps(shared)) < 1024
+        assert pool.submit(attach_and_dump, shared).result() == part.model_dump_json()
+
+        attached = shared.attach()
+        assert type(attached) is type(part)
+        assert attached.model_dump_json() == part.model_dump_json()
+    # attached parts stay valid after the segment is unlinked
+    assert attached.model_dump_json() == part.model_dump_json()
+
+
+def test_zero_copy():
+    audio = AudioPart(raw=b"\x00\x01" * 100, sample_rate=16000)
+    with export_shared(audio) as shared:
+        attached = shared.attach()
+        assert isinstance(attached.raw, memoryview) and attached.raw.readonly
+        assert type(attached.as_bytes(16000)) is bytes and attached.as_bytes(16000) == audio.raw
+        assert type(copy.deepcopy(attached).raw) is bytes and copy.deepcopy(attached) == audio
+        assert attached.raw == audio.raw
+        assert AudioPart.model_validate_json(attached.model_dump_json()).raw == audio.raw
+        assert pickle.loads(pickle.dumps(attached)).raw == audio.raw
+
+    image = ImagePart(image=Image.new("RGBA", (4, 4)))
+    with export_shared(image) as shared:
+        assert shared.attach().image.readonly
+
+
+def test_lifetime():
+    shared = export_shared(BinaryFilePart.from_file(io.BytesIO(b"hello"), mime="text/plain"))
+
+    shared.unlink()
+    with pytest.raises(FileNotFoundError):
+        shared.attach()
+
+    # unlinked when the exporting handle is garbage collected
+    shared = export_shared(BinaryFilePart.from_bytes(b"hello", mime="text/plain"))
+    copy = pickle.loads(pickle.dumps(shared))
+    del shared
+    gc.collect()
+    with pytest.raises(FileNotFoundError):
+        copy.attach()
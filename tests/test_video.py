@@ -1,5 +1,12 @@
+import asyncio
+import io
+import math
+import sys
+import time
 from pathlib import Path
 
+import pytest
+from kani.ext.multimodal_core.ffmpeg import arun_ffmpeg
 from kani.ext.multimodal_core.video import VideoPart
 
 from .utils import REPO_ROOT
@@ -32,3 +39,94 @@ def test_roundtrip_json():
     part1 = VideoPart.from_file(TEST_VIDEO_PATH)
     part2 = VideoPart.model_validate_json(part1.model_dump_json())
     assert part1.as_bytes() == part2.as_bytes()
+
+
+def test_keyframes():
+    part = VideoPart.from_file(TEST_VIDEO_PATH)
+    keyframes = part.keyframes(max_frames=8)
+    assert 1 <= len(keyframes) <= 8
+    assert keyframes[0].timestamp == 0
+    assert [kf.timestamp for kf in keyframes] == sorted(kf.timestamp for kf in keyframes)
+    assert keyframes[0].part.size == (480, 360)
+
+    small_keyframes = part.keyframes(max_frames=8, size=(160, 120), keyframes_only=True)
+    assert small_keyframes[0].part.size == (160, 120)
+
+
+def test_keyframes_timestamps():
+    # frames sampled at a fixed rate have known timestamps even if ffmpeg doesn't log them; keyframes don't
+    assert VideoPart._keyframe_timestamp([0.0, 0.5], 1, fps=2, keyframes_only=False) == 0.5
+    assert VideoPart._keyframe_timestamp([0.0], 3, fps=2, keyframes_only=False) == 1.5
+    assert VideoPart._keyframe_timestamp([0.0], 3, fps=2, keyframes_only=True) is None
+
+    part = VideoPart.from_bytes(b"not a real video", mime="video/mp4")
+    with pytest.raises(ValueError):
+        part.keyframes(max_frames=0)
+
+
+def test_as_audio():
+    part = VideoPart.from_file(TEST_VIDEO_PATH)
+    audio = part.as_audio(sr=16000)
+    assert audio.sample_rate == 16000
+    assert math.isclose(audio.duration, part.duration, abs_tol=0.1)
+
+    chunks = list(part.iter_audio(sr=16000, chunk_duration=60))
+    assert all(chunk.duration == 60 for chunk in chunks[:-1])
+    assert b"".join(chunk.raw for chunk in chunks) == audio.raw
+
+
+@pytest.mark.asyncio
+async def test_async_conversions():
+    part = VideoPart.from_file(TEST_VIDEO_PATH)
+    audio = await part.aas_audio(sr=16000)
+    assert audio.raw == part.as_audio(sr=16000).raw
+    keyframes = await part.akeyframes(max_frames=4, size=(64, 48))
+    assert [k.timestamp for k in keyframes] == [k.timestamp for k in part.keyframes(max_frames=4, size=(64, 48))]
+
+
+def test_transcode():
+    part = VideoPart.from_file(TEST_VIDEO_PATH)
+    # already within budget
+    assert part.transcode(max_bytes=part.filesize, max_height=360) is part
+
+    small = part.transcode(max_bytes=2_000_000, max_height=240, fps=10)
+    assert small.filesize <= 2_000_000
+    assert small.resolution == (320, 240)
+    assert small.mime == "video/mp4"
+    assert math.isclose(small.duration, part.duration, abs_tol=0.5)
+
+
+@pytest.mark.asyncio
+async def test_atranscode():
+    part = VideoPart.from_bytes(TEST_VIDEO_PATH.read_bytes(), mime="video/mp4")
+    small = await part.atranscode(max_height=120, codec="vp9")
+    assert small.resolution == (160, 120)
+    assert small.mime == "video/webm"
+
+
+class SlowBytesIO(io.BytesIO):
+    def read(self, *args):
+        time.sleep(0.2)
+        return super().read(*args)
+
+
+@pytest.mark.asyncio
+async def test_arun_ffmpeg_doesnt_block():
+    # in-memory files are copied to a temporary file for ffmpeg, which shouldn't block the event loop
+    longest_gap = 0
+
+    async def tick():
+        nonlocal longest_gap
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            longest_gap = max(longest_gap, time.perf_counter() - start)
+
+    ticker = asyncio.create_task(tick())
+    await asyncio.sleep(0)
+    try:
+        cmd = [sys.executable, "-c", "import sys; assert sys.stdin.buffer.read() == b'x' * 100000"]
+        await arun_ffmpeg(cmd, SlowBytesIO(b"x" * 100000))
+    finally:
+        ticker.cancel()
+    assert longest_gap < 0.15